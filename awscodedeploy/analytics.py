@@ -0,0 +1,73 @@
+"""
+Lifecycle event analytics.
+"""
+from collections import OrderedDict
+from logging import getLogger
+from math import ceil
+from threading import Lock
+
+from termcolor import colored
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a non-empty list of values.
+    """
+    values = sorted(values)
+    index = int(ceil(fraction * len(values))) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+
+class LifecycleStats(object):
+    """
+    Collect lifecycle event (hook) durations across instances.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.durations = OrderedDict()
+
+    def add(self, event_name, instance_id, seconds):
+        with self.lock:
+            self.durations.setdefault(event_name, []).append((seconds, instance_id))
+
+    def summary(self, slowest=3):
+        """
+        Summarize each event's durations: count, p50, p95, max and the slowest instances.
+        """
+        with self.lock:
+            durations = OrderedDict(
+                (event_name, list(samples))
+                for event_name, samples in self.durations.items()
+            )
+
+        result = OrderedDict()
+        for event_name, samples in durations.items():
+            seconds = [duration for duration, _ in samples]
+            result[event_name] = OrderedDict([
+                ("count", len(samples)),
+                ("p50", percentile(seconds, 0.5)),
+                ("p95", percentile(seconds, 0.95)),
+                ("max", max(seconds)),
+                ("slowest", [
+                    (instance_id, duration)
+                    for duration, instance_id in sorted(samples, reverse=True)[:slowest]
+                ]),
+            ])
+        return result
+
+
+def print_lifecycle_report(args, stats):
+    logger = getLogger("wait")
+    for event_name, summary in stats.summary(args.slowest_instances).items():
+        logger.info("[{}]: {}: {} instances, p50 {:.1f}s, p95 {:.1f}s, max {:.1f}s{}".format(
+            colored(args.deployment_id, "cyan"),
+            colored(event_name, "green"),
+            summary["count"],
+            summary["p50"],
+            summary["p95"],
+            summary["max"],
+            "; slowest: {}".format(", ".join(
+                "{} ({:.1f}s)".format(instance_id, duration)
+                for instance_id, duration in summary["slowest"]
+            )) if summary["slowest"] else "",
+        ))
@@ -0,0 +1,47 @@
+"""
+Performance benchmarks.
+
+Each module is runnable on its own, e.g. `python -m awscodedeploy.benchmarks.startup`.
+"""
+import sys
+
+
+def output(line):
+    """
+    Write a line of results to stdout.
+    """
+    sys.stdout.write(line + "\n")
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def parse_limit(value):
+    """
+    Parse a NAME=VALUE limit argument.
+    """
+    name, limit = value.split("=", 1)
+    return name, float(limit)
+
+
+def check_limits(results, limits):
+    """
+    Compare results against limits.
+
+    Limit names are dotted paths into the (nested) results, e.g. "help.median".
+    Returns a process exit code: 1 if any limit was exceeded.
+    """
+    exceeded = []
+    for name, limit in limits:
+        value = results
+        for key in name.split("."):
+            value = value[key]
+        if value > limit:
+            exceeded.append(name)
+            output("{} exceeded its limit: {} > {}".format(name, value, limit))
+    return 1 if exceeded else 0
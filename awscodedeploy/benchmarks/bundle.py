@@ -0,0 +1,150 @@
+"""
+Benchmark bundle size against build time.
+
+Builds representative revisions in every bundle type at several compression
+levels, to weigh CPU spent building bundles against bytes sent to every instance:
+ - `hello_world`: a single hook and no files
+ - `compose_small`: a single service with a small environment
+ - `compose_large`: a generated compose file with large environment blocks
+"""
+from argparse import ArgumentParser
+from io import StringIO
+from json import dumps
+from time import time
+
+from awscodedeploy.benchmarks import check_limits, median, output, parse_limit
+from awscodedeploy.benchmarks.render import generate_compose_data
+from awscodedeploy.revision import BUNDLE_TYPES, DockerComposeRevision, HelloWorldRevision
+from awscodedeploy.yamlio import dump
+
+
+def compose_revision(services, environment_size):
+    compose_file = StringIO(dump(generate_compose_data(services, environment_size)).decode(
+        "utf-8",
+    ))
+    return DockerComposeRevision("benchmark", compose_file, timeout=300)
+
+
+REVISION_NAMES = ("hello_world", "compose_small", "compose_large")
+
+
+def make_revisions(args):
+    return zip(REVISION_NAMES, [
+        HelloWorldRevision(),
+        compose_revision(1, 10),
+        compose_revision(args.services, args.environment_size),
+    ])
+
+
+def measure(revision, bundle_type, compression_level, repeat):
+    """
+    Build a bundle `repeat` times.
+
+    Returns its size, in bytes, and the min and median build time, in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time()
+        with revision.bundle(bundle_type, compression_level) as bundle:
+            size = len(bundle.read())
+        timings.append(time() - start)
+    return dict(
+        size=size,
+        min=min(timings),
+        median=median(timings),
+    )
+
+
+def benchmark(args):
+    """
+    Returns a mapping from revision name to bundle type and level (e.g. "tgz_9") to
+    the bundle's size and build time.
+    """
+    results = dict()
+    for name, revision in make_revisions(args):
+        # render once up front, so that only archiving is measured
+        list(revision.entries())
+        results[name] = dict(
+            (
+                "{}_{}".format(bundle_type, level),
+                measure(revision, bundle_type, level, args.repeat),
+            )
+            for bundle_type in BUNDLE_TYPES
+            for level in ([0] if bundle_type == "tar" else args.levels)
+        )
+    return results
+
+
+def parse_args():
+    parser = ArgumentParser(description="Benchmark bundle size against build time")
+    parser.add_argument(
+        "--services",
+        type=int,
+        default=50,
+        help="Number of services in the large generated compose file",
+    )
+    parser.add_argument(
+        "--environment-size",
+        type=int,
+        default=200,
+        help="Number of environment variables per service in the large compose file",
+    )
+    parser.add_argument(
+        "--level",
+        dest="levels",
+        type=int,
+        action="append",
+        help="Compression level to measure; may be repeated (default: 0, 1, 6 and 9)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of builds per measurement",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print results as JSON",
+    )
+    parser.add_argument(
+        "--limit",
+        type=parse_limit,
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="Fail if a result exceeds a limit, e.g. compose_large.tgz_6.median=0.1 or "
+             "compose_large.tgz_6.size=50000; may be repeated",
+    )
+    args = parser.parse_args()
+    if not args.levels:
+        args.levels = [0, 1, 6, 9]
+    return args
+
+
+def main():
+    args = parse_args()
+    results = benchmark(args)
+
+    if args.json:
+        output(dumps(results, indent=2, sort_keys=True))
+    else:
+        output("{:>14} {:>7} {:>10} {:>10} {:>10}".format(
+            "revision", "bundle", "bytes", "min_ms", "median_ms",
+        ))
+        for name in REVISION_NAMES:
+            for bundle in sorted(results[name]):
+                result = results[name][bundle]
+                output("{:>14} {:>7} {:>10} {:>10.2f} {:>10.2f}".format(
+                    name,
+                    bundle,
+                    result["size"],
+                    result["min"] * 1000,
+                    result["median"] * 1000,
+                ))
+
+    return check_limits(results, args.limit)
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,306 @@
+"""
+Benchmark the wait loop and push against the in-process CodeDeploy and S3 fakes.
+
+For each fleet size, creates a deployment on a `FakeCodeDeploy`, waits for it with
+`wait_for_deploy` on a virtual clock, and reports the API calls made, the wall-clock and
+CPU time spent (including the fakes' own bookkeeping), and the simulated deployment time.
+Deployments are followed by polling or, with `--status-source queue`, through trigger
+notifications on a fake SQS queue.
+Also reports push throughput for a generated docker-compose revision.
+"""
+from argparse import ArgumentParser, Namespace
+from io import BytesIO
+from json import dumps
+from logging import basicConfig
+from os import times
+from random import seed
+from time import time
+
+from botocore.exceptions import ClientError
+
+from awscodedeploy.benchmarks import check_limits, output, parse_limit
+from awscodedeploy.deploy import push
+from awscodedeploy.fake import (
+    FakeClock,
+    FakeCodeDeploy,
+    FakeProfile,
+    FakeS3,
+    FakeSQS,
+    LIFECYCLE_EVENTS,
+)
+from awscodedeploy.notifications import QueueSource
+from awscodedeploy.revision import DEFAULT_COMPRESSION_LEVEL, DockerComposeRevision
+from awscodedeploy.wait import FailedDeploymentException, PollingSource, wait_for_deploy
+
+
+FLEET_SIZES = [10, 100, 1000, 10000]
+
+
+def cpu_time():
+    user, system = times()[:2]
+    return user + system
+
+
+def measure(function):
+    """
+    Call a function, returning its result, wall-clock time and CPU time.
+    """
+    wall_start, cpu_start = time(), cpu_time()
+    result = function()
+    return result, time() - wall_start, cpu_time() - cpu_start
+
+
+def benchmark_deployment(args, fleet_size):
+    """
+    Wait for one simulated deployment across `fleet_size` instances.
+    """
+    # keep poll jitter reproducible across runs
+    seed(args.seed)
+
+    clock = FakeClock()
+    sqs = FakeSQS(clock=clock)
+    codedeploy = FakeCodeDeploy(
+        clock=clock,
+        default_fleet_size=fleet_size,
+        batch_size=max(1, int(fleet_size * args.batch_fraction)),
+        event_durations=[(name, args.event_duration) for name in LIFECYCLE_EVENTS],
+        failure_rate=args.failure_rate,
+        throttle_rate=args.throttle_rate,
+        seed=args.seed,
+        notifications=sqs if args.status_source == "queue" else None,
+    )
+    deployment_id = codedeploy.create_deployment(
+        applicationName="benchmark",
+        deploymentGroupName="benchmark",
+    )["deploymentId"]
+    codedeploy.calls.clear()
+
+    wait_args = Namespace(
+        deployment_id=deployment_id,
+        sleep_timeout=args.sleep_timeout,
+        max_sleep_timeout=args.max_sleep_timeout,
+        lifecycle_report=False,
+        max_failed_instances=args.max_failed_instances,
+        max_failed_percent=None,
+        fail_on_failed_event=False,
+        auto_rollback=False,
+        event_stream=None,
+    )
+    if args.status_source == "queue":
+        source = QueueSource(sqs, "benchmark", codedeploy, clock=clock.time)
+    else:
+        source = PollingSource(codedeploy)
+    scheduler = source.scheduler(wait_args)
+    scheduler.sleep = clock.sleep
+
+    def wait():
+        try:
+            wait_for_deploy(codedeploy, wait_args, scheduler, source)
+            return "Succeeded"
+        except FailedDeploymentException:
+            return "Failed"
+        except ClientError as error:
+            return error.response["Error"]["Code"]
+
+    result, wall_time, cpu = measure(wait)
+    calls = codedeploy.calls + sqs.calls
+    return dict(
+        result=result,
+        api_calls=sum(count for name, count in calls.items() if name != "Throttled"),
+        calls=dict(calls),
+        wall_time=wall_time,
+        cpu_time=cpu,
+        deployment_time=clock.time(),
+    )
+
+
+def make_compose_file(services, variables):
+    """
+    Generate a docker-compose file with large environment blocks.
+    """
+    lines = []
+    for service in range(services):
+        lines.append("service{}:".format(service))
+        lines.append("  image: registry.example.com/service{}:latest".format(service))
+        lines.append("  environment:")
+        for variable in range(variables):
+            lines.append("    VARIABLE_{}: value-{}-{}".format(variable, service, variable))
+    return BytesIO("\n".join(lines).encode("utf-8"))
+
+
+def benchmark_push(args):
+    """
+    Push the same generated revision repeatedly; all but the first push are unchanged.
+    """
+    s3 = FakeS3()
+    profile = FakeProfile(s3=s3)
+    push_args = Namespace(
+        application_name="benchmark",
+        deployment_name="benchmark",
+        bucket="benchmark",
+        description="benchmark",
+        force_push=args.force_push,
+        bundle_type="zip",
+        compression_level=DEFAULT_COMPRESSION_LEVEL,
+    )
+    revision = DockerComposeRevision(
+        deployment_name="benchmark",
+        compose_file=make_compose_file(1, args.variables),
+        timeout=300,
+    )
+    client = profile.create_client("codedeploy")
+
+    def pushes():
+        for _ in range(args.pushes):
+            push(profile, client, push_args, revision)
+
+    _, wall_time, cpu = measure(pushes)
+    return dict(
+        pushes=args.pushes,
+        calls=dict(s3.calls),
+        wall_time=wall_time,
+        cpu_time=cpu,
+        pushes_per_second=args.pushes / wall_time if wall_time else None,
+    )
+
+
+def parse_args():
+    parser = ArgumentParser(description="Benchmark aws-code-deploy against in-process fakes")
+    parser.add_argument(
+        "--fleet-size",
+        type=int,
+        action="append",
+        help="Fleet size to simulate; may be repeated (default: {})".format(
+            ", ".join(str(size) for size in FLEET_SIZES),
+        ),
+    )
+    parser.add_argument(
+        "--batch-fraction",
+        type=float,
+        default=0.1,
+        help="Fraction of the fleet deployed at a time",
+    )
+    parser.add_argument(
+        "--event-duration",
+        type=float,
+        default=10.0,
+        help="Simulated seconds per lifecycle event",
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of instances that fail",
+    )
+    parser.add_argument(
+        "--status-source",
+        choices=["poll", "queue"],
+        default="poll",
+        help="Follow deployments by polling or through trigger notifications on a queue",
+    )
+    parser.add_argument(
+        "--max-failed-instances",
+        type=int,
+        help="Stop deployments once more than this many instances have failed",
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of API calls that are throttled",
+    )
+    parser.add_argument(
+        "--sleep-timeout",
+        type=float,
+        default=1.0,
+    )
+    parser.add_argument(
+        "--max-sleep-timeout",
+        type=float,
+        default=10.0,
+    )
+    parser.add_argument(
+        "--pushes",
+        type=int,
+        default=20,
+        help="Number of pushes to time",
+    )
+    parser.add_argument(
+        "--variables",
+        type=int,
+        default=1000,
+        help="Environment variables in the pushed compose file",
+    )
+    parser.add_argument(
+        "--force-push",
+        action="store_true",
+        help="Upload on every push instead of skipping unchanged revisions",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print results as JSON",
+    )
+    parser.add_argument(
+        "--limit",
+        type=parse_limit,
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="Fail if a result exceeds a limit, e.g. 1000.api_calls=500 or push.wall_time=1; "
+             "may be repeated",
+    )
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="Show the wait loop's output",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    basicConfig(level="INFO" if args.verbose else "WARN", format="%(message)s")
+
+    results = dict()
+    for fleet_size in args.fleet_size or FLEET_SIZES:
+        results[str(fleet_size)] = benchmark_deployment(args, fleet_size)
+    results["push"] = benchmark_push(args)
+
+    if args.json:
+        output(dumps(results, indent=2, sort_keys=True))
+    else:
+        output("{:>8} {:>10} {:>10} {:>10} {:>12}  {}".format(
+            "fleet", "api_calls", "wall_s", "cpu_s", "simulated_s", "result",
+        ))
+        for fleet_size in args.fleet_size or FLEET_SIZES:
+            result = results[str(fleet_size)]
+            output("{:>8} {:>10} {:>10.3f} {:>10.3f} {:>12.1f}  {}".format(
+                fleet_size,
+                result["api_calls"],
+                result["wall_time"],
+                result["cpu_time"],
+                result["deployment_time"],
+                result["result"],
+            ))
+        output("{} pushes in {:.3f}s ({:.3f}s CPU): {}".format(
+            results["push"]["pushes"],
+            results["push"]["wall_time"],
+            results["push"]["cpu_time"],
+            ", ".join(
+                "{} {}".format(count, name)
+                for name, count in sorted(results["push"]["calls"].items())
+            ),
+        ))
+
+    return check_limits(results, args.limit)
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,184 @@
+"""
+Benchmark revision rendering.
+
+Renders docker-compose revision bundles for many deployment names from a generated
+compose file, and compares:
+ - `single`: building a revision from the compose file per name, as separate runs do
+ - `batch`: `render_bundles`, parsing once, with one process and with a pool
+
+It also times repeated access to a revision's hooks, files and appspec.
+"""
+from argparse import ArgumentParser
+from io import StringIO
+from json import dumps
+from multiprocessing import cpu_count
+from shutil import copyfileobj, rmtree
+from tempfile import mkdtemp
+from time import time
+
+from awscodedeploy.benchmarks import check_limits, median, output, parse_limit
+from awscodedeploy.render import bundle_path, render_bundles
+from awscodedeploy.revision import DockerComposeRevision
+from awscodedeploy.yamlio import dump, load
+
+
+def generate_compose_data(services, environment_size):
+    """
+    Generate compose data with `services` services, each with `environment_size`
+    environment variables, depending on the previous service.
+    """
+    compose_data = dict()
+    for index in range(services):
+        service = dict(
+            image="registry.example.com/service-{}:1.0.{}".format(index, index),
+            environment=dict(
+                ("SETTING_{}".format(number), "value-{}-{}".format(index, number))
+                for number in range(environment_size)
+            ),
+            ports=["{}:8080".format(8000 + index)],
+        )
+        if index:
+            service["depends_on"] = ["service-{}".format(index - 1)]
+        compose_data["service-{}".format(index)] = service
+    return dict(version="2", services=compose_data)
+
+
+def render_single(compose_text, deployment_names, output_dir):
+    for deployment_name in deployment_names:
+        revision = DockerComposeRevision(deployment_name, StringIO(compose_text), timeout=300)
+        path = bundle_path(output_dir, deployment_name)
+        with revision.bundle() as bundle, open(path, "wb") as file_:
+            copyfileobj(bundle, file_)
+
+
+def render_batch(compose_text, deployment_names, output_dir, processes):
+    render_bundles(
+        load(StringIO(compose_text)),
+        deployment_names,
+        output_dir,
+        timeout=300,
+        processes=processes,
+    )
+
+
+def access_properties(compose_text, accesses):
+    revision = DockerComposeRevision("benchmark", StringIO(compose_text), timeout=300)
+    for _ in range(accesses):
+        revision.hooks
+        revision.files
+        revision.to_appspec_dict()
+
+
+def measure(func, *args):
+    start = time()
+    func(*args)
+    return time() - start
+
+
+def benchmark(args):
+    """
+    Run every measurement `args.repeat` times.
+
+    Returns a mapping from measurement name to the min and median time, in seconds.
+    """
+    compose_text = dump(generate_compose_data(args.services, args.environment_size)).decode(
+        "utf-8",
+    )
+    deployment_names = ["deployment-{}".format(index) for index in range(args.names)]
+    output_dir = mkdtemp()
+
+    measurements = [
+        ("single", lambda: measure(render_single, compose_text, deployment_names, output_dir)),
+        ("batch_1", lambda: measure(render_batch, compose_text, deployment_names, output_dir, 1)),
+        ("batch_{}".format(args.processes), lambda: measure(
+            render_batch, compose_text, deployment_names, output_dir, args.processes,
+        )),
+        ("properties", lambda: measure(access_properties, compose_text, args.accesses)),
+    ]
+
+    results = dict()
+    try:
+        for name, run in measurements:
+            timings = [run() for _ in range(args.repeat)]
+            results[name] = dict(
+                min=min(timings),
+                median=median(timings),
+            )
+    finally:
+        rmtree(output_dir)
+    return results
+
+
+def parse_args():
+    parser = ArgumentParser(description="Benchmark revision rendering")
+    parser.add_argument(
+        "--names",
+        type=int,
+        default=200,
+        help="Number of deployment names to render",
+    )
+    parser.add_argument(
+        "--services",
+        type=int,
+        default=10,
+        help="Number of services in the generated compose file",
+    )
+    parser.add_argument(
+        "--environment-size",
+        type=int,
+        default=50,
+        help="Number of environment variables per service",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=cpu_count(),
+        help="Number of processes for the pooled batch (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--accesses",
+        type=int,
+        default=100,
+        help="Number of times to access a revision's hooks, files and appspec",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of runs per measurement",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print results as JSON",
+    )
+    parser.add_argument(
+        "--limit",
+        type=parse_limit,
+        action="append",
+        default=[],
+        metavar="NAME=SECONDS",
+        help="Fail if a result exceeds a limit, e.g. batch_1.median=2; may be repeated",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = benchmark(args)
+
+    if args.json:
+        output(dumps(results, indent=2, sort_keys=True))
+    else:
+        for name in sorted(results):
+            output("{:<12} min: {:.3f}s median: {:.3f}s".format(
+                name,
+                results[name]["min"],
+                results[name]["median"],
+            ))
+
+    return check_limits(results, args.limit)
+
+
+if __name__ == "__main__":
+    exit(main())
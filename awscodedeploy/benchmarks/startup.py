@@ -0,0 +1,186 @@
+"""
+Benchmark CLI startup.
+
+Measures, in fresh interpreters:
+ - the time to import `awscodedeploy.main`
+ - the time to run `aws-code-deploy --help`
+ - the time from process start to the first CodeDeploy API call
+
+The first API call is intercepted before it is sent, so no AWS account is needed.
+"""
+from argparse import ArgumentParser
+from json import dumps
+from os import close, environ, remove
+from subprocess import check_output
+from sys import executable
+from tempfile import mkstemp
+from time import time
+
+from awscodedeploy.benchmarks import check_limits, median, output, parse_limit
+
+
+IMPORT_SCRIPT = """
+import sys
+from time import time
+start = time()
+import awscodedeploy.main
+sys.stdout.write("{}\\n".format(time() - start))
+"""
+
+HELP_SCRIPT = """
+from awscodedeploy.main import main
+main()
+"""
+
+# patches botocore to exit (and report the time) on the first API call
+FIRST_CALL_SCRIPT = """
+import os
+import sys
+from time import time
+
+from botocore.session import Session
+
+create_client = Session.create_client
+
+
+def first_call(**kwargs):
+    sys.stdout.write("{}\\n".format(time()))
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def patched_create_client(self, *args, **kwargs):
+    client = create_client(self, *args, **kwargs)
+    client.meta.events.register("before-call", first_call)
+    return client
+
+
+Session.create_client = patched_create_client
+
+from awscodedeploy.main import main
+main()
+"""
+
+FIRST_CALL_ARGS = [
+    "--application-name", "benchmark",
+    "--deployment-name", "benchmark",
+    "--deployment-id", "d-BENCHMARK",
+    "--hello-world",
+    "--profile", "benchmark",
+    "--sleep-timeout", "0",
+]
+
+FIRST_CALL_CONFIG = """
+[profile benchmark]
+region = us-west-2
+"""
+
+FIRST_CALL_ENVIRONMENT = dict(
+    AWS_ACCESS_KEY_ID="benchmark",
+    AWS_SECRET_ACCESS_KEY="benchmark",
+    AWS_SHARED_CREDENTIALS_FILE="/dev/null",
+)
+
+
+def run(script, args=(), env=None):
+    """
+    Run a script in a fresh interpreter, returning its start time and output.
+    """
+    start = time()
+    output = check_output([executable, "-c", script] + list(args), env=env)
+    return start, time(), output
+
+
+def measure_import():
+    _, _, output = run(IMPORT_SCRIPT)
+    return float(output)
+
+
+def measure_help():
+    start, end, _ = run(HELP_SCRIPT, ["--help"])
+    return end - start
+
+
+def measure_first_call():
+    fd, config_file = mkstemp()
+    close(fd)
+    try:
+        with open(config_file, "w") as file_:
+            file_.write(FIRST_CALL_CONFIG)
+        env = dict(environ)
+        # time a local run, even if a daemon is configured
+        env.pop("AWS_CODE_DEPLOY_SOCKET", None)
+        env.update(FIRST_CALL_ENVIRONMENT)
+        env.update(AWS_CONFIG_FILE=config_file)
+        start, _, output = run(FIRST_CALL_SCRIPT, FIRST_CALL_ARGS, env=env)
+    finally:
+        remove(config_file)
+    return float(output) - start
+
+
+MEASUREMENTS = [
+    ("import", measure_import),
+    ("help", measure_help),
+    ("first_call", measure_first_call),
+]
+
+
+def benchmark(repeat):
+    """
+    Run every measurement `repeat` times.
+
+    Returns a mapping from measurement name to the min and median time, in seconds.
+    """
+    results = dict()
+    for name, measure in MEASUREMENTS:
+        timings = [measure() for _ in range(repeat)]
+        results[name] = dict(
+            min=min(timings),
+            median=median(timings),
+        )
+    return results
+
+
+def parse_args():
+    parser = ArgumentParser(description="Benchmark aws-code-deploy startup time")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of runs per measurement",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print results as JSON",
+    )
+    parser.add_argument(
+        "--limit",
+        type=parse_limit,
+        action="append",
+        default=[],
+        metavar="NAME=SECONDS",
+        help="Fail if a result exceeds a limit, e.g. help.median=0.5; may be repeated",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = benchmark(args.repeat)
+
+    if args.json:
+        output(dumps(results, indent=2, sort_keys=True))
+    else:
+        for name, _ in MEASUREMENTS:
+            output("{:<12} min: {:.3f}s median: {:.3f}s".format(
+                name,
+                results[name]["min"],
+                results[name]["median"],
+            ))
+
+    return check_limits(results, args.limit)
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,116 @@
+"""
+Benchmark the YAML backends.
+
+Loads and dumps generated compose files (see `benchmarks.render`) with the
+pure-Python implementation and, if available, libyaml, and checks that both
+produce the same output.
+"""
+from argparse import ArgumentParser
+from json import dumps
+from time import time
+
+from awscodedeploy.benchmarks import check_limits, median, output, parse_limit
+from awscodedeploy.benchmarks.render import generate_compose_data
+from awscodedeploy.yamlio import dump, has_libyaml, load
+
+
+def measure(func, repeat):
+    """
+    Call `func` `repeat` times, returning the min and median time, in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time()
+        func()
+        timings.append(time() - start)
+    return dict(
+        min=min(timings),
+        median=median(timings),
+    )
+
+
+def benchmark(args):
+    compose_data = generate_compose_data(args.services, args.environment_size)
+    text = dump(compose_data, pure=True)
+
+    backends = [("pure", True)]
+    if has_libyaml():
+        backends.append(("libyaml", False))
+
+    results = dict(size=len(text))
+    for name, pure in backends:
+        results[name] = dict(
+            load=measure(lambda: load(text, pure=pure), args.repeat),
+            dump=measure(lambda: dump(compose_data, pure=pure), args.repeat),
+            identical=(
+                load(text, pure=pure) == compose_data and dump(compose_data, pure=pure) == text
+            ),
+        )
+    return results
+
+
+def parse_args():
+    parser = ArgumentParser(description="Benchmark the YAML backends")
+    parser.add_argument(
+        "--services",
+        type=int,
+        default=50,
+        help="Number of services in the generated compose file",
+    )
+    parser.add_argument(
+        "--environment-size",
+        type=int,
+        default=200,
+        help="Number of environment variables per service",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of runs per measurement",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print results as JSON",
+    )
+    parser.add_argument(
+        "--limit",
+        type=parse_limit,
+        action="append",
+        default=[],
+        metavar="NAME=SECONDS",
+        help="Fail if a result exceeds a limit, e.g. libyaml.load.median=0.5; may be repeated",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = benchmark(args)
+
+    if args.json:
+        output(dumps(results, indent=2, sort_keys=True))
+    else:
+        output("compose file: {} bytes".format(results["size"]))
+        for name in ("pure", "libyaml"):
+            if name not in results:
+                output("{:<8} unavailable".format(name))
+                continue
+            for operation in ("load", "dump"):
+                output("{:<8} {:<5} min: {:.3f}s median: {:.3f}s".format(
+                    name,
+                    operation,
+                    results[name][operation]["min"],
+                    results[name][operation]["median"],
+                ))
+            if not results[name]["identical"]:
+                output("{:<8} output differs from the pure-Python implementation".format(
+                    name,
+                ))
+
+    return check_limits(results, args.limit)
+
+
+if __name__ == "__main__":
+    exit(main())
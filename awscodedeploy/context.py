@@ -0,0 +1,31 @@
+"""
+Per-request output context.
+
+The daemon serves several requests at once from one process. Each request binds its
+connection to the threads that handle it; the daemon routes output from those threads
+back to the right client. Thread pools started while handling a request inherit the
+binding, so that output from worker threads is routed too.
+"""
+from multiprocessing.pool import ThreadPool
+from threading import local
+
+
+_local = local()
+
+
+def current():
+    """
+    Get the request bound to the current thread, if any.
+    """
+    return getattr(_local, "request", None)
+
+
+def bind(request):
+    _local.request = request
+
+
+def thread_pool(processes):
+    """
+    Create a thread pool whose workers share the current thread's request.
+    """
+    return ThreadPool(processes=processes, initializer=bind, initargs=(current(),))
@@ -0,0 +1,186 @@
+"""
+Assumed-role credential caching.
+
+awsenv reuses an assumed-role session when its credentials are in the environment
+(`AWS_SESSION_NAME`, `AWS_SESSION_TOKEN` and friends). To reuse sessions across runs,
+save those variables per profile in a file readable only by the current user, and
+load the profile from them the way awsenv loads it from the environment. The process
+environment is left alone, since the daemon loads profiles from several threads.
+"""
+from json import dump, load
+from logging import getLogger
+from os import O_CREAT, O_EXCL, O_WRONLY, fdopen, getpid, getuid, open as os_open
+from os import rename, stat, unlink
+from os.path import expanduser
+from time import time
+
+
+DEFAULT_CACHE = expanduser("~/.aws-code-deploy-credentials")
+
+# only reuse cached credentials with at least this long left, in seconds
+CACHE_MARGIN = 10 * 60
+
+CACHED_VARIABLES = (
+    "AWS_ACCESS_KEY_ID",
+    "AWS_PROFILE",
+    "AWS_SECRET_ACCESS_KEY",
+    "AWS_SESSION_NAME",
+    "AWS_SESSION_TOKEN",
+)
+
+
+def session_expiry(profile):
+    """
+    Get when a profile's assumed-role session expires, or None if it does not.
+    """
+    if not getattr(profile, "session_name", None):
+        return None
+
+    from awsenv.cache import uuid1_to_timestamp
+    return uuid1_to_timestamp(profile.session_name) + profile.session_duration
+
+
+def is_entry(entry):
+    """
+    Check that a cache entry has an expiry and every cached variable.
+    """
+    return (
+        isinstance(entry, dict) and
+        isinstance(entry.get("expires_at"), (int, long, float)) and
+        isinstance(entry.get("variables"), dict) and
+        all(key in entry["variables"] for key in CACHED_VARIABLES)
+    )
+
+
+def from_variables(profile_name, variables):
+    """
+    Load a profile with the assumed-role session in cached variables.
+
+    Mirrors awsenv's handling of a session in the environment.
+    """
+    from awsenv.cache import DEFAULT_SESSION_DURATION, CachedSession
+    from awsenv.profile import AWSProfile
+
+    profile = AWSProfile(
+        profile=profile_name,
+        session_duration=DEFAULT_SESSION_DURATION,
+        cached_session=CachedSession(
+            name=variables["AWS_SESSION_NAME"],
+            token=variables["AWS_SESSION_TOKEN"],
+            profile=variables["AWS_PROFILE"],
+        ),
+    )
+    access_key = variables["AWS_ACCESS_KEY_ID"] or profile.access_key_id
+    secret_key = variables["AWS_SECRET_ACCESS_KEY"] or profile.secret_access_key
+    if profile.role_arn and access_key and secret_key:
+        profile.session.set_credentials(
+            access_key=access_key,
+            secret_key=secret_key,
+            token=variables["AWS_SESSION_TOKEN"],
+        )
+    return profile
+
+
+class CredentialCache(object):
+    """
+    Assumed-role session variables by profile name, stored in a JSON file.
+    """
+    def __init__(self, path, margin=CACHE_MARGIN, clock=time):
+        self.path = path
+        self.margin = margin
+        self.clock = clock
+
+    def read(self):
+        logger = getLogger("credentials")
+        try:
+            status = stat(self.path)
+        except OSError:
+            return dict()
+
+        if status.st_uid != getuid() or status.st_mode & 0o077:
+            logger.warn("Ignoring credential cache {}: it must be private to its owner".format(
+                self.path,
+            ))
+            return dict()
+
+        try:
+            with open(self.path) as file_:
+                entries = load(file_)
+        except (IOError, ValueError) as error:
+            logger.warn("Ignoring credential cache {}: {}".format(self.path, error))
+            return dict()
+
+        if not isinstance(entries, dict):
+            logger.warn("Ignoring credential cache {}: not a mapping".format(self.path))
+            return dict()
+        # drop partial entries, e.g. from an older version
+        return dict((name, entry) for name, entry in entries.items() if is_entry(entry))
+
+    def write(self, entries):
+        """
+        Replace the cache file atomically, creating it readable by its owner only.
+        """
+        temp_path = "{}.{}".format(self.path, getpid())
+        with fdopen(os_open(temp_path, O_WRONLY | O_CREAT | O_EXCL, 0o600), "w") as file_:
+            dump(entries, file_)
+        try:
+            rename(temp_path, self.path)
+        except OSError:
+            unlink(temp_path)
+            raise
+
+    def get(self, profile_name):
+        """
+        Get a profile's cached session variables, unless they expire soon.
+        """
+        entry = self.read().get(profile_name)
+        if entry is None or entry["expires_at"] - self.margin < self.clock():
+            return None
+        return entry["variables"]
+
+    def put(self, profile):
+        """
+        Save a profile's assumed-role session, dropping any expired sessions.
+        """
+        expires_at = session_expiry(profile)
+        if expires_at is None:
+            return
+
+        now = self.clock()
+        entries = dict(
+            (name, entry)
+            for name, entry in self.read().items()
+            if entry["expires_at"] > now
+        )
+        variables = profile.to_envvars()
+        entries[profile.profile] = dict(
+            expires_at=expires_at,
+            variables=dict((key, variables[key]) for key in CACHED_VARIABLES),
+        )
+        try:
+            self.write(entries)
+        except (IOError, OSError) as error:
+            getLogger("credentials").warn("Unable to write credential cache {}: {}".format(
+                self.path,
+                error,
+            ))
+
+
+def get_profile(profile_name, cache=None, refresh=False):
+    """
+    Load a profile through awsenv, reusing a cached assumed-role session if possible.
+
+    :param cache: the credential cache to use, if any
+    :param refresh: whether to assume the role again even if a cached session is valid
+    """
+    from awsenv.main import get_profile as load
+
+    variables = cache.get(profile_name) if cache and not refresh else None
+    if variables is not None:
+        getLogger("credentials").debug("Using cached credentials for {}".format(profile_name))
+        return from_variables(profile_name, variables)
+
+    profile = load(profile=profile_name, refresh=refresh)
+    if cache:
+        cache.put(profile)
+    return profile
@@ -0,0 +1,419 @@
+"""
+Warm daemon.
+
+Serves push, deploy and wait requests from a long-running process, so that each
+run skips interpreter startup, imports, role assumption and connection setup.
+Profiles are loaded once and their clients (and connection pools) reused.
+Assumed-role credentials renew themselves when they are about to expire, so runs
+in flight keep working; they are also refreshed in the background, so that runs
+rarely wait on the refresh.
+
+Requests arrive on a unix socket as one JSON line holding the client's parsed
+command line. The daemon streams the run's output back as JSON lines, ending with
+the run's exit code.
+"""
+from argparse import ArgumentParser, Namespace
+from copy import copy
+from datetime import datetime
+from functools import partial
+from io import StringIO
+from json import dumps, loads
+from logging import Filter, basicConfig, getLevelName, getLogger
+from os import environ, umask, unlink
+from os.path import abspath, exists
+from socket import AF_UNIX, SOCK_STREAM, error as socket_error, socket
+from SocketServer import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+from threading import Lock, Thread
+from time import sleep, time
+import sys
+
+from awscodedeploy.context import bind, current
+from awscodedeploy.credentials import DEFAULT_CACHE, CredentialCache, get_profile, session_expiry
+from awscodedeploy.main import load_profile, log_level, run
+from awscodedeploy.metrics import ApiMetrics
+from awscodedeploy.ratelimit import parse_rate_limit
+from awscodedeploy.timing import PhaseTimer
+
+
+# refresh credentials when they have less than this long left, in seconds; this is also
+# when botocore starts refreshing them on its own
+REFRESH_MARGIN = 15 * 60
+
+# how often to check for credentials due for refresh, in seconds
+REFRESH_INTERVAL = 60
+
+
+def to_request(args):
+    """
+    Encode parsed arguments for the daemon.
+
+    Files are read (or resolved) here, since the daemon has a different working directory.
+    """
+    request = dict(vars(args))
+    request["daemon_socket"] = None
+    if args.docker_compose:
+        request["docker_compose"] = args.docker_compose.read()
+    for key in ("timing_report", "timing_baseline", "render_dir"):
+        if request[key]:
+            request[key] = abspath(request[key])
+    if args.events and not args.events.startswith("unix:"):
+        request["events"] = abspath(args.events)
+    return request
+
+
+def from_request(request):
+    args = Namespace(**request)
+    if args.docker_compose is not None:
+        args.docker_compose = StringIO(args.docker_compose)
+    return args
+
+
+def credential_metadata(profile):
+    """
+    Describe a profile's assumed-role credentials for botocore's refreshable credentials.
+    """
+    return dict(
+        access_key=profile.access_key_id,
+        secret_key=profile.secret_access_key,
+        token=profile.session_token,
+        expiry_time=datetime.utcfromtimestamp(session_expiry(profile)).strftime(
+            "%Y-%m-%dT%H:%M:%SZ",
+        ),
+    )
+
+
+class WarmProfile(object):
+    """
+    A loaded profile that creates each client once and reuses it.
+
+    :param reload: loads the profile again with a newly assumed role; if given, an
+           assumed-role session's credentials are refreshed through it, including
+           those of clients already in use
+    """
+    def __init__(self, profile, metrics, reload=None):
+        self.profile = profile
+        self.metrics = metrics
+        self.lock = Lock()
+        self.clients = dict()
+        self.credentials = None
+        if reload is not None and session_expiry(profile) is not None:
+            from botocore.credentials import RefreshableCredentials
+            self.credentials = RefreshableCredentials.create_from_metadata(
+                metadata=credential_metadata(profile),
+                refresh_using=lambda: credential_metadata(reload()),
+                method="assume-role",
+            )
+            self.session._credentials = self.credentials
+
+    @property
+    def session(self):
+        return self.profile.session
+
+    @property
+    def region_name(self):
+        return self.profile.region_name
+
+    def create_client(self, service_name, config=None):
+        key = (service_name, config and (config.connect_timeout, config.read_timeout))
+        with self.lock:
+            if key not in self.clients:
+                self.clients[key] = self.new_client(service_name, config)
+            return self.clients[key]
+
+    def new_client(self, service_name, config):
+        if self.credentials is None:
+            return self.profile.create_client(service_name, config=config)
+        # without explicit keys, the client signs with the session's refreshable credentials
+        return self.session.create_client(
+            service_name,
+            region_name=self.region_name,
+            config=config,
+        )
+
+    def refresh(self):
+        """
+        Refresh the credentials if they expire within REFRESH_MARGIN.
+        """
+        if self.credentials is not None:
+            self.credentials.get_frozen_credentials()
+
+
+class ProfileCache(object):
+    """
+    Loaded profiles by name.
+    """
+    def __init__(self, args):
+        self.args = args
+        self.lock = Lock()
+        self.profiles = dict()
+
+    def load(self, name):
+        profile_args = copy(self.args)
+        profile_args.profile = name
+        profile, metrics = load_profile(profile_args)
+        return WarmProfile(profile, metrics, reload=partial(self.reload, name))
+
+    def reload(self, name):
+        getLogger("daemon").info("Refreshing profile: {}".format(name))
+        cache = CredentialCache(self.args.credential_cache) if self.args.credential_cache else None
+        return get_profile(name, cache, refresh=True)
+
+    def get(self, name):
+        """
+        Get a profile and the API metrics of the request being served, loading the
+        profile if necessary.
+        """
+        with self.lock:
+            profile = self.profiles.get(name)
+            if profile is None:
+                getLogger("daemon").info("Loading profile: {}".format(name))
+                profile = self.profiles[name] = self.load(name)
+            return profile, profile.metrics.current()
+
+    def refresh(self):
+        for name, profile in list(self.profiles.items()):
+            try:
+                profile.refresh()
+            except Exception as error:
+                getLogger("daemon").warn("Unable to refresh profile {}: {}".format(name, error))
+
+
+class Connection(object):
+    """
+    A client connection: receives the output of the run it requested.
+    """
+    def __init__(self, wfile, level):
+        self.wfile = wfile
+        self.level = level
+        self.timer = PhaseTimer()
+        self.metrics = ApiMetrics()
+        self.lock = Lock()
+        self.closed = False
+
+    def send(self, **message):
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.wfile.write(dumps(message) + "\n")
+                self.wfile.flush()
+            except (IOError, socket_error):
+                # the client went away; let the run finish quietly
+                self.closed = True
+
+
+class RequestStream(object):
+    """
+    Stand-in for stdout or stderr that routes writes to the current request's client.
+    """
+    def __init__(self, name, stream):
+        self.name = name
+        self.stream = stream
+
+    def write(self, data):
+        connection = current()
+        if connection is None:
+            self.stream.write(data)
+        else:
+            connection.send(stream=self.name, data=data)
+
+    def flush(self):
+        if current() is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class RequestFilter(Filter):
+    """
+    Apply each request's own verbosity to its log records.
+    """
+    def __init__(self, level):
+        Filter.__init__(self)
+        self.level = level
+
+    def filter(self, record):
+        connection = current()
+        return record.levelno >= (self.level if connection is None else connection.level)
+
+
+class RequestHandler(StreamRequestHandler):
+
+    def handle(self):
+        request = loads(self.rfile.readline())
+        args = from_request(request["args"])
+
+        connection = Connection(self.wfile, getLevelName(log_level(args.verbose)))
+        bind(connection)
+        try:
+            exit_code = run(args, time(), self.server.profiles)
+        except Exception:
+            getLogger("daemon").exception("Request failed")
+            exit_code = 1
+        finally:
+            bind(None)
+        connection.send(exit=exit_code)
+
+
+class DaemonServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, profiles):
+        self.profiles = profiles
+        UnixStreamServer.__init__(self, path, RequestHandler)
+
+
+def is_listening(path):
+    sock = socket(AF_UNIX, SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except socket_error:
+        return False
+    finally:
+        sock.close()
+
+
+def send_request(args):
+    """
+    Run through the daemon, printing its output.
+
+    Returns the run's exit code, or None if the daemon is not running.
+    """
+    logger = getLogger("cli")
+    if args.events and args.events.startswith("fd:"):
+        logger.info("File descriptors cannot be passed to the daemon; running locally")
+        return None
+
+    sock = socket(AF_UNIX, SOCK_STREAM)
+    try:
+        sock.connect(args.daemon_socket)
+    except socket_error as error:
+        logger.warn("Unable to reach daemon at {} ({}); running locally".format(
+            args.daemon_socket,
+            error,
+        ))
+        sock.close()
+        return None
+
+    if args.rate_limits:
+        logger.warn("Ignoring --rate-limit: the daemon applies its own rate limits to all runs")
+
+    try:
+        sock.sendall(dumps(dict(args=to_request(args))).encode("utf-8") + b"\n")
+        for line in sock.makefile("r"):
+            message = loads(line)
+            if "exit" in message:
+                return message["exit"]
+            stream = sys.stdout if message["stream"] == "stdout" else sys.stderr
+            getattr(stream, "buffer", stream).write(message["data"].encode("utf-8"))
+            stream.flush()
+    finally:
+        sock.close()
+
+    logger.error("Daemon closed the connection")
+    return 1
+
+
+def refresh_forever(profiles):
+    while True:
+        sleep(REFRESH_INTERVAL)
+        profiles.refresh()
+
+
+def parse_args():
+    parser = ArgumentParser(description="Serve aws-code-deploy runs from a warm process")
+    parser.add_argument(
+        "--socket",
+        default=environ.get("AWS_CODE_DEPLOY_SOCKET"),
+        required="AWS_CODE_DEPLOY_SOCKET" not in environ,
+        help="Path of the unix socket to listen on (default: $AWS_CODE_DEPLOY_SOCKET)",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profiles",
+        action="append",
+        default=[],
+        help="AWS CLI profile to load at startup; may be repeated",
+    )
+    parser.add_argument(
+        "--credential-cache",
+        metavar="FILE",
+        default=DEFAULT_CACHE,
+        help="Share assumed-role credentials with other runs through this file "
+             "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-credential-cache",
+        dest="credential_cache",
+        action="store_const",
+        const=None,
+    )
+    parser.add_argument(
+        "--rate-limit",
+        dest="rate_limits",
+        type=parse_rate_limit,
+        action="append",
+        default=[],
+        metavar="OPERATION=RATE",
+        help="Limit an API operation to RATE calls per second across all runs; "
+             "may be repeated",
+    )
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        action="count",
+        default=1,
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # route output written while serving a request to that request's client
+    sys.stdout = RequestStream("stdout", sys.stdout)
+    sys.stderr = RequestStream("stderr", sys.stderr)
+    basicConfig(level="DEBUG", format="%(message)s")
+    getLogger().handlers[0].addFilter(RequestFilter(getLevelName(log_level(args.verbose))))
+    getLogger("botocore").setLevel("WARN")
+    logger = getLogger("daemon")
+
+    if exists(args.socket):
+        if is_listening(args.socket):
+            logger.error("A daemon is already listening on {}".format(args.socket))
+            return 1
+        unlink(args.socket)
+
+    # import what runs need up front
+    from awscodedeploy import deploy, wait  # noqa
+
+    profiles = ProfileCache(args)
+    for name in args.profiles:
+        profiles.get(name)
+
+    refresher = Thread(target=refresh_forever, args=(profiles,))
+    refresher.daemon = True
+    refresher.start()
+
+    # only the current user may connect
+    old_umask = umask(0o077)
+    try:
+        server = DaemonServer(args.socket, profiles)
+    finally:
+        umask(old_umask)
+
+    logger.info("Listening on {}".format(args.socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        unlink(args.socket)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -1,36 +1,56 @@
 """
 Deployment operations.
 """
-from argparse import Namespace
-from contextlib import contextmanager
+from collections import OrderedDict
 from logging import getLogger
-from re import search
-from StringIO import StringIO
-import sys
 
-from awscli.customizations.codedeploy.push import Push
 from termcolor import colored
 
+from awscodedeploy.context import thread_pool
+from awscodedeploy.timing import phase
+from awscodedeploy.upload import bundle_digest, create_client, find_bundle, upload_bundle
 
-@contextmanager
-def capture_stdout():
+
+# upper bound on concurrent create_deployment calls
+MAX_WORKERS = 16
+
+
+def revision_key(args):
     """
-    Temporarily capture stdout.
+    Return the S3 key of the revision pushed for a deployment.
     """
-    try:
-        old_stdout = sys.stdout
-        sys.stdout = StringIO()
-        yield sys.stdout
-    finally:
-        sys.stdout = old_stdout
+    return "{}/{}.{}".format(
+        args.application_name,
+        args.deployment_name,
+        args.bundle_type,
+    )
 
 
-def push(profile, args, revision):
+def s3_location(args, etag, version=None):
+    location = {
+        "bucket": args.bucket,
+        "key": revision_key(args),
+        "bundleType": args.bundle_type,
+        "eTag": etag,
+    }
+    if version:
+        location["version"] = version
+    return location
+
+
+def push(profile, client, args, revision):
     """
-    Run "aws deploy push" against a generated revision.
+    Upload a generated revision to S3 and register it with CodeDeploy.
+
+    Equivalent to "aws deploy push", but uploads the in-memory bundle directly
+    and reads the ETag and version from the API responses. Touches no global
+    state, so pushes may run from many threads at once.
 
-    Uses the AWS CLI directly because push logic is slightly involved and the
-    code already exists.
+    Bundles are content-addressed: if the object in S3 already holds the same
+    bundle, the upload is skipped and the existing object is registered instead
+    (unless `--force-push` is set).
+
+    Returns the (ETag, version) of the uploaded revision.
     """
     logger = getLogger("push")
 
@@ -40,72 +60,74 @@ def push(profile, args, revision):
         colored(args.bucket, "green"),
     ))
 
-    with capture_stdout() as capture, revision.make() as revision_dir:
-        push_command = Push(profile.session)
-        # simulate CLI args and global args
-        push_command([
-            "--application-name", args.application_name,
-            "--s3-location", "s3://{}/{}/{}.zip".format(
-                args.bucket,
-                args.application_name,
-                args.deployment_name,
-            ),
-            "--ignore-hidden-files",
-            "--source", revision_dir,
-        ], Namespace(
-            region=profile.region_name,
-            endpoint_url=None,
-            verify_ssl=True,
-        ))
-
-        result = capture.getvalue()
-        # Note that the push command returns the next instructions as an AWS CLI call. Parse it.
-        etag = search('eTag="([a-f0-9]+)"', result).group(1)
+    s3 = create_client(profile, "s3")
+    key = revision_key(args)
+    with revision.bundle(args.bundle_type, args.compression_level) as bundle, phase("push.upload"):
+        digest = bundle_digest(bundle)
+        existing = None if args.force_push else find_bundle(s3, args.bucket, key, digest)
+        if existing:
+            etag, version = existing
+            logger.info("[{}] Revision is unchanged; skipping upload".format(
+                colored("push", "cyan"),
+            ))
+        else:
+            etag, version = upload_bundle(s3, args.bucket, key, bundle, digest)
+
+    with phase("push.register"):
+        client.register_application_revision(**{
+            "applicationName": args.application_name,
+            "description": args.description,
+            "revision": {
+                "revisionType": "S3",
+                "s3Location": s3_location(args, etag, version),
+            },
+        })
 
     logger.info("[{}] Generated revision eTag: {}".format(
         colored("push", "cyan"),
         colored(etag, "green"),
     ))
 
-    return etag
+    return etag, version
 
 
-def deploy(profile, client, args):
+def deploy(profile, client, args, deployment_group=None):
     """
     Run "aws deploy create-deployment" (or the botocore equivalent).
 
     Uses botocore because this is just a single API call and there's no similar
     AWS CLI abstraction.
+
+    Deploys to the deployment group named by `--deployment-name` unless another
+    `deployment_group` is given; the revision is always the one pushed for
+    `--deployment-name`.
     """
+    if deployment_group is None:
+        deployment_group = args.deployment_name
+
     logger = getLogger("deploy")
-    logger.info("[{}] Deploying revision {} from bucket: {}".format(
+    logger.info("[{}] Deploying revision {} to {} from bucket: {}".format(
         colored("deploy", "cyan"),
         colored(args.deployment_name, "green"),
+        colored(deployment_group, "green"),
         colored(args.bucket, "green"),
     ))
 
-    result = client.create_deployment(**{
-        "applicationName": args.application_name,
-        "deploymentConfigName": args.deployment_config,
-        "deploymentGroupName": args.deployment_name,
-        "description": args.description,
-        # If the previous revision didn't have an ApplicationStop script,
-        # the current script will fail every time if it attempts to process this event
-        # because the script of the last successful deploy is used, not the new one.
-        "ignoreApplicationStopFailures": True,
-        "revision": {
-            "revisionType": "S3",
-            "s3Location":  {
-                "bucket": args.bucket,
-                "key": "{}/{}.zip".format(
-                    args.application_name,
-                    args.deployment_name,
-                ),
-                "bundleType": "zip",
-                "eTag": args.etag,
-            }
-        },
-    })
+    with phase("deploy.create_deployment"):
+        result = client.create_deployment(**{
+            "applicationName": args.application_name,
+            "deploymentConfigName": args.deployment_config,
+            "deploymentGroupName": deployment_group,
+            "description": args.description,
+            # If the previous revision didn't have an ApplicationStop script,
+            # the current script will fail every time if it attempts to process this event
+            # because the script of the last successful deploy is used, not the new one.
+            "ignoreApplicationStopFailures": True,
+            "revision": {
+                "revisionType": "S3",
+                "s3Location": s3_location(args, args.etag, args.revision_version),
+            },
+        })
 
     deployment_id = result["deploymentId"]
 
@@ -127,3 +149,52 @@ def deploy(profile, client, args):
     ))
 
     return deployment_id
+
+
+def deploy_many(profile, client, args, deployment_groups):
+    """
+    Deploy the same revision to several deployment groups concurrently.
+
+    Returns a mapping from deployment group name to deployment id. If any deployment
+    cannot be created, the others are still created and logged, and the first error
+    is raised.
+    """
+    pool = thread_pool(min(len(deployment_groups), MAX_WORKERS))
+    try:
+        results = OrderedDict(
+            (deployment_group, pool.apply_async(
+                deploy,
+                (profile, client, args, deployment_group),
+            ))
+            for deployment_group in deployment_groups
+        )
+    finally:
+        pool.close()
+        pool.join()
+
+    logger = getLogger("deploy")
+    deployment_ids = OrderedDict()
+    errors = []
+    for deployment_group, result in results.items():
+        try:
+            deployment_ids[deployment_group] = result.get()
+        except Exception as error:
+            logger.error("[{}] Unable to deploy to {}: {}".format(
+                colored("deploy", "cyan"),
+                colored(deployment_group, "red"),
+                error,
+            ))
+            errors.append(error)
+
+    if errors:
+        if deployment_ids:
+            logger.warn("[{}] Created deployments: {}".format(
+                colored("deploy", "cyan"),
+                ", ".join(
+                    "{} ({})".format(colored(deployment_id, "green"), deployment_group)
+                    for deployment_group, deployment_id in deployment_ids.items()
+                ),
+            ))
+        raise errors[0]
+
+    return deployment_ids
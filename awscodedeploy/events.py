@@ -0,0 +1,161 @@
+"""
+Structured event stream.
+
+Writes deployment progress as JSON lines, one object per event, for tooling that
+should not have to parse the colored console output. Each object has a `time`
+(epoch seconds) and an `event` name, e.g.:
+
+    {"event": "instance_status", "time": 1476000000.0, "deployment_id": "d-...",
+     "instance_id": "i-...", "status": "InProgress"}
+
+Events are queued and written by a background thread, so a slow consumer never
+stalls polling: once the queue is full, events are dropped and a `dropped` event
+reports how many once the writer catches up.
+"""
+from datetime import datetime
+from json import dumps
+from logging import getLogger
+from os import fdopen
+from Queue import Full, Queue
+from socket import AF_UNIX, SOCK_STREAM, socket
+from threading import Lock, Thread
+from time import time
+
+
+# events waiting to be written; further events are dropped
+MAX_QUEUED_EVENTS = 10000
+
+# log tails longer than this many characters are truncated, keeping their end
+MAX_LOG_TAIL = 4096
+
+# how long to wait for queued events to be written when closing, in seconds
+CLOSE_TIMEOUT = 5.0
+
+# tells the writer thread to finish
+CLOSE = object()
+
+
+def truncate_log_tail(log_tail, limit=MAX_LOG_TAIL):
+    """
+    Return a log tail and whether it was truncated.
+    """
+    if len(log_tail) <= limit:
+        return log_tail, False
+    return log_tail[-limit:], True
+
+
+def to_json(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError("{!r} is not JSON serializable".format(value))
+
+
+def open_target(target):
+    """
+    Open where events go: "fd:N" for an open file descriptor, "unix:PATH" for a unix
+    socket, or else a file path, which is appended to.
+    """
+    if target.startswith("fd:"):
+        return fdopen(int(target[3:]), "w")
+    if target.startswith("unix:"):
+        sock = socket(AF_UNIX, SOCK_STREAM)
+        try:
+            sock.connect(target[5:])
+            return sock.makefile("w")
+        finally:
+            # the file keeps the connection open
+            sock.close()
+    return open(target, "a")
+
+
+class EventStream(object):
+    """
+    Writes events as JSON lines to a file from a background thread.
+    """
+    def __init__(self, file_, max_queued_events=MAX_QUEUED_EVENTS, clock=time):
+        self.file_ = file_
+        self.clock = clock
+        self.queue = Queue(maxsize=max_queued_events)
+        self.lock = Lock()
+        self.dropped = 0
+        self.failed = False
+        self.writer = Thread(target=self.write_all, name="event-stream")
+        self.writer.daemon = True
+        self.writer.start()
+
+    @classmethod
+    def open(cls, target):
+        return cls(open_target(target))
+
+    def emit(self, event, **fields):
+        """
+        Queue an event; never blocks.
+        """
+        fields.update(event=event, time=self.clock())
+        try:
+            self.queue.put_nowait(fields)
+        except Full:
+            with self.lock:
+                self.dropped += 1
+
+    def take_dropped(self):
+        with self.lock:
+            dropped, self.dropped = self.dropped, 0
+        return dropped
+
+    def write(self, fields):
+        if self.failed:
+            return
+        try:
+            self.file_.write(dumps(fields, default=to_json, sort_keys=True) + "\n")
+            self.file_.flush()
+        except (IOError, OSError, ValueError) as error:
+            # e.g. the consumer went away; keep draining the queue so that emit stays cheap
+            getLogger("events").warn("Unable to write events: {}".format(error))
+            self.failed = True
+
+    def write_all(self):
+        while True:
+            fields = self.queue.get()
+            if fields is CLOSE:
+                break
+            self.write(fields)
+
+            dropped = self.take_dropped()
+            if dropped:
+                self.write(dict(event="dropped", time=self.clock(), count=dropped))
+
+        dropped = self.take_dropped()
+        if dropped:
+            self.write(dict(event="dropped", time=self.clock(), count=dropped))
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        """
+        Write the queued events, waiting at most `timeout` seconds, and close the file.
+        """
+        deadline = self.clock() + timeout
+        while True:
+            try:
+                self.queue.put(CLOSE, timeout=0.1)
+                break
+            except Full:
+                if self.clock() >= deadline:
+                    break
+        self.writer.join(max(0, deadline - self.clock()))
+        if self.writer.is_alive():
+            getLogger("events").warn("Gave up writing {} queued events".format(
+                self.queue.qsize(),
+            ))
+            return
+        try:
+            self.file_.close()
+        except (IOError, OSError):
+            pass
+
+
+def emit(args, event, **fields):
+    """
+    Emit an event to the run's event stream, if it has one.
+    """
+    if args.event_stream is not None:
+        args.event_stream.emit(event, **fields)
@@ -0,0 +1,681 @@
+"""
+In-process stand-ins for the CodeDeploy, S3 and SQS APIs.
+
+Implements the client methods used by `deploy`, `upload` and `wait` with botocore's
+keyword arguments and response shapes, so the real code paths can run (and be measured)
+without an AWS account. Deployments move instances through lifecycle events on a
+configurable schedule against a virtual clock; throttling and instance failures can be
+injected. Deployments can also publish trigger notifications to a fake SQS queue.
+"""
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from hashlib import md5
+from heapq import heappop, heappush
+from itertools import count
+from json import dumps
+from random import Random
+from threading import Lock
+
+from botocore.exceptions import ClientError
+
+from awscodedeploy.wait import BATCH_SIZE, TERMINAL_STATUSES
+
+
+LIFECYCLE_EVENTS = [
+    "ApplicationStop",
+    "DownloadBundle",
+    "BeforeInstall",
+    "Install",
+    "AfterInstall",
+    "ApplicationStart",
+    "ValidateService",
+]
+
+# virtual time zero
+EPOCH = datetime(2016, 1, 1)
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+
+class FakeClock(object):
+    """
+    Virtual time; sleeping advances the clock instantly.
+    """
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def to_datetime(timestamp):
+    return EPOCH + timedelta(seconds=timestamp)
+
+
+def to_epoch_string(value):
+    """
+    Format a datetime as notifications do: epoch seconds, as a string.
+    """
+    return "{:.3f}".format((value - UNIX_EPOCH).total_seconds())
+
+
+def to_notification_event(event):
+    """
+    Shape a lifecycle event as trigger notifications do.
+    """
+    result = dict(
+        LifecycleEvent=event["lifecycleEventName"],
+        LifecycleEventStatus=event["status"],
+    )
+    if "startTime" in event:
+        result["StartTime"] = to_epoch_string(event["startTime"])
+    if "endTime" in event:
+        result["EndTime"] = to_epoch_string(event["endTime"])
+    return result
+
+
+def client_error(operation_name, code, message):
+    return ClientError({
+        "Error": {
+            "Code": code,
+            "Message": message,
+        },
+    }, operation_name)
+
+
+class FakeService(object):
+    """
+    Base class for fake clients: counts calls and injects throttling.
+    """
+    def __init__(self, throttle_rate=0.0, seed=0):
+        self.throttle_rate = throttle_rate
+        self.random = Random(seed)
+        self.calls = Counter()
+        self.lock = Lock()
+
+    def call(self, operation_name):
+        with self.lock:
+            self.calls[operation_name] += 1
+            throttled = self.random.random() < self.throttle_rate
+        if throttled:
+            with self.lock:
+                self.calls["Throttled"] += 1
+            raise client_error(operation_name, "ThrottlingException", "Rate exceeded")
+
+
+class FakeDeployment(object):
+    """
+    A deployment that moves its instances through lifecycle events in batches.
+
+    Instances start `start_delay` seconds after creation, `batch_size` at a time; each
+    batch starts when the previous one finishes. Failed instances fail at `failure_event`
+    and skip the remaining events.
+    """
+    def __init__(self,
+                 deployment_id,
+                 application_name,
+                 deployment_group_name,
+                 instance_ids,
+                 created_at,
+                 batch_size,
+                 event_durations,
+                 start_delay,
+                 failed_instances,
+                 failure_event):
+        self.deployment_id = deployment_id
+        self.application_name = application_name
+        self.deployment_group_name = deployment_group_name
+        self.instance_ids = instance_ids
+        self.indexes = {instance_id: index for index, instance_id in enumerate(instance_ids)}
+        self.created_at = created_at
+        self.batch_size = max(1, batch_size)
+        self.event_durations = event_durations
+        self.start_delay = start_delay
+        self.failed_instances = failed_instances
+        self.failure_event = failure_event
+        self.stopped_at = None
+        self.cached_statuses = (None, None)
+        self.cached_filters = dict()
+
+        self.instance_duration = sum(duration for _, duration in event_durations)
+        self.failure_duration = 0.0
+        for name, duration in event_durations:
+            self.failure_duration += duration
+            if name == failure_event:
+                break
+
+    def instances_added(self, now):
+        return now >= self.created_at + self.start_delay
+
+    def started_at(self, instance_id):
+        batch = self.indexes[instance_id] // self.batch_size
+        return self.created_at + self.start_delay + batch * self.instance_duration
+
+    def finished_at(self, instance_id):
+        if instance_id in self.failed_instances:
+            return self.started_at(instance_id) + self.failure_duration
+        return self.started_at(instance_id) + self.instance_duration
+
+    def instance_status(self, instance_id, now):
+        started_at = self.started_at(instance_id)
+        finished_at = self.finished_at(instance_id)
+        stopped = self.stopped_at is not None and now >= self.stopped_at
+
+        if stopped and started_at >= self.stopped_at:
+            return "Skipped"
+        if now < started_at:
+            return "Pending"
+        if stopped and self.stopped_at < finished_at:
+            return "Failed"
+        if now < finished_at:
+            return "InProgress"
+        return "Failed" if instance_id in self.failed_instances else "Succeeded"
+
+    def lifecycle_events(self, instance_id, now):
+        """
+        Build the lifecycle event list for an instance, as of `now`.
+        """
+        failed = instance_id in self.failed_instances
+        stopped_at = self.stopped_at
+        if stopped_at is not None and now < stopped_at:
+            stopped_at = None
+        start = self.started_at(instance_id)
+        finished = False
+        events = []
+
+        for name, duration in self.event_durations:
+            event = dict(lifecycleEventName=name)
+            end = start + duration
+            if finished or (stopped_at is not None and start >= stopped_at):
+                event["status"] = "Skipped"
+            elif now < start:
+                event["status"] = "Pending"
+            elif now < end and stopped_at is None:
+                event["status"] = "InProgress"
+                event["startTime"] = to_datetime(start)
+            else:
+                interrupted = stopped_at is not None and stopped_at < end
+                finished = interrupted or (failed and name == self.failure_event)
+                event.update(
+                    status="Failed" if finished else "Succeeded",
+                    startTime=to_datetime(start),
+                    endTime=to_datetime(stopped_at if interrupted else end),
+                    diagnostics=dict(
+                        errorCode="ScriptFailed" if finished else "Success",
+                        scriptName="",
+                        message="Script failed" if finished else "Succeeded",
+                        logTail="[stderr]{} failed on {}".format(name, instance_id)
+                        if finished else "",
+                    ),
+                )
+            events.append(event)
+            start = end
+
+        return events
+
+    def instance_summary(self, instance_id, now):
+        return dict(
+            deploymentId=self.deployment_id,
+            instanceId="arn:aws:ec2:us-west-2:000000000000:instance/{}".format(instance_id),
+            status=self.instance_status(instance_id, now),
+            lastUpdatedAt=to_datetime(now),
+            lifecycleEvents=self.lifecycle_events(instance_id, now),
+        )
+
+    def statuses(self, now):
+        """
+        Return the status of every instance, as of `now`.
+
+        Cached per point in time, so that polling large fleets stays cheap for the fake.
+        """
+        cached_now, statuses = self.cached_statuses
+        if cached_now == now and statuses is not None:
+            return statuses
+
+        statuses = OrderedDict(
+            (instance_id, self.instance_status(instance_id, now))
+            for instance_id in self.instance_ids
+        )
+        self.cached_statuses = (now, statuses)
+        self.cached_filters = dict()
+        return statuses
+
+    def filter_instances(self, now, instance_statuses):
+        """
+        Return the ids of instances with one of the given statuses, as of `now`.
+        """
+        statuses = self.statuses(now)
+        key = tuple(sorted(instance_statuses))
+        if key not in self.cached_filters:
+            self.cached_filters[key] = [
+                instance_id
+                for instance_id, status in statuses.items()
+                if status in instance_statuses
+            ]
+        return self.cached_filters[key]
+
+    def overview(self, now):
+        overview = OrderedDict(
+            (status, 0)
+            for status in ["Pending", "InProgress", "Succeeded", "Failed", "Skipped", "Ready"]
+        )
+        if not self.instances_added(now):
+            return overview
+        for status in self.statuses(now).values():
+            overview[status] += 1
+        return overview
+
+    def instance_notification(self, instance_id, now):
+        return dict(
+            deploymentId=self.deployment_id,
+            instanceId="arn:aws:ec2:us-west-2:000000000000:instance/{}".format(instance_id),
+            instanceStatus=self.instance_status(instance_id, now),
+            lastUpdatedAt=to_epoch_string(to_datetime(now)),
+            lifecycleEvents=dumps([
+                to_notification_event(event)
+                for event in self.lifecycle_events(instance_id, now)
+            ]),
+        )
+
+    def deployment_notification(self, now):
+        return dict(
+            deploymentId=self.deployment_id,
+            applicationName=self.application_name,
+            deploymentGroupName=self.deployment_group_name,
+            status=self.status(now).upper(),
+            deploymentOverview=dumps(dict(
+                (status, str(instances))
+                for status, instances in self.overview(now).items()
+            )),
+        )
+
+    def notifications(self):
+        """
+        Return the trigger notifications of an uninterrupted deployment as (time, message).
+        """
+        result = [(self.created_at, self.deployment_notification(self.created_at))]
+        finished_at = self.created_at + self.start_delay
+        for instance_id in self.instance_ids:
+            started_at = self.started_at(instance_id)
+            instance_finished_at = self.finished_at(instance_id)
+            result.append((started_at, self.instance_notification(instance_id, started_at)))
+            result.append((
+                instance_finished_at,
+                self.instance_notification(instance_id, instance_finished_at),
+            ))
+            finished_at = max(finished_at, instance_finished_at)
+        result.append((finished_at, self.deployment_notification(finished_at)))
+        return result
+
+    def status(self, now):
+        if not self.instances_added(now):
+            return "Created"
+        overview = self.overview(now)
+        if sum(overview[status] for status in TERMINAL_STATUSES) < len(self.instance_ids):
+            return "InProgress"
+        if self.stopped_at is not None:
+            return "Stopped"
+        return "Failed" if overview["Failed"] else "Succeeded"
+
+
+class FakeCodeDeploy(FakeService):
+    """
+    Stand-in for a botocore CodeDeploy client.
+
+    :param clock: the (virtual) clock driving deployments
+    :param fleets: a mapping from deployment group name to instance count
+    :param default_fleet_size: the instance count of any other deployment group
+    :param batch_size: instances deployed at a time; defaults to following the
+           deployment config (OneAtATime, HalfAtATime or AllAtOnce)
+    :param event_durations: a list of (lifecycle event name, seconds)
+    :param start_delay: seconds before a new deployment has added its instances
+    :param failure_rate: the fraction of instances that fail
+    :param failure_event: the lifecycle event at which instances fail
+    :param page_size: instance ids per list_deployment_instances page
+    :param notifications: a FakeSQS queue to publish trigger notifications to, if any
+    """
+    def __init__(self,
+                 clock=None,
+                 fleets=None,
+                 default_fleet_size=10,
+                 batch_size=None,
+                 event_durations=None,
+                 start_delay=1.0,
+                 failure_rate=0.0,
+                 failure_event="ApplicationStart",
+                 page_size=100,
+                 throttle_rate=0.0,
+                 seed=0,
+                 notifications=None):
+        super(FakeCodeDeploy, self).__init__(throttle_rate=throttle_rate, seed=seed)
+        self.clock = clock or FakeClock()
+        self.fleets = fleets or {}
+        self.default_fleet_size = default_fleet_size
+        self.batch_size = batch_size
+        self.event_durations = event_durations or [(name, 1.0) for name in LIFECYCLE_EVENTS]
+        self.start_delay = start_delay
+        self.failure_rate = failure_rate
+        self.failure_event = failure_event
+        self.page_size = page_size
+        self.notifications = notifications
+        self.deployments = OrderedDict()
+        self.revisions = []
+
+    def get(self, operation_name, deployment_id):
+        try:
+            return self.deployments[deployment_id]
+        except KeyError:
+            raise client_error(
+                operation_name,
+                "DeploymentDoesNotExistException",
+                "The deployment {} could not be found.".format(deployment_id),
+            )
+
+    def choose_batch_size(self, deployment_config_name, fleet_size):
+        if self.batch_size is not None:
+            return self.batch_size
+        if deployment_config_name == "CodeDeployDefault.AllAtOnce":
+            return fleet_size
+        if deployment_config_name == "CodeDeployDefault.HalfAtATime":
+            return (fleet_size + 1) // 2
+        return 1
+
+    def register_application_revision(self, **kwargs):
+        self.call("RegisterApplicationRevision")
+        self.revisions.append(kwargs)
+        return {}
+
+    def create_deployment(self, **kwargs):
+        self.call("CreateDeployment")
+        with self.lock:
+            deployment_id = "d-{:09d}".format(len(self.deployments) + 1)
+            group_name = kwargs["deploymentGroupName"]
+            fleet_size = self.fleets.get(group_name, self.default_fleet_size)
+            instance_ids = [
+                "i-{:08x}{:04x}".format(len(self.deployments) + 1, index)
+                for index in range(fleet_size)
+            ]
+            failed_instances = set(
+                instance_id for instance_id in instance_ids
+                if self.random.random() < self.failure_rate
+            )
+            self.deployments[deployment_id] = FakeDeployment(
+                deployment_id=deployment_id,
+                application_name=kwargs["applicationName"],
+                deployment_group_name=group_name,
+                instance_ids=instance_ids,
+                created_at=self.clock.time(),
+                batch_size=self.choose_batch_size(kwargs.get("deploymentConfigName"), fleet_size),
+                event_durations=self.event_durations,
+                start_delay=self.start_delay,
+                failed_instances=failed_instances,
+                failure_event=self.failure_event,
+            )
+        if self.notifications is not None:
+            for at, message in self.deployments[deployment_id].notifications():
+                self.notifications.schedule(at, sns_envelope(message), tag=deployment_id)
+        return dict(deploymentId=deployment_id)
+
+    def get_deployment(self, deploymentId):
+        self.call("GetDeployment")
+        deployment = self.get("GetDeployment", deploymentId)
+        now = self.clock.time()
+        return dict(deploymentInfo=dict(
+            deploymentId=deploymentId,
+            applicationName=deployment.application_name,
+            deploymentGroupName=deployment.deployment_group_name,
+            status=deployment.status(now),
+            createTime=to_datetime(deployment.created_at),
+            deploymentOverview=deployment.overview(now),
+        ))
+
+    def list_deployment_instances(self, deploymentId, nextToken=None, instanceStatusFilter=None):
+        self.call("ListDeploymentInstances")
+        deployment = self.get("ListDeploymentInstances", deploymentId)
+        now = self.clock.time()
+        if not deployment.instances_added(now):
+            raise client_error(
+                "ListDeploymentInstances",
+                "InvalidDeploymentStatusException",
+                "The deployment {} hasn't completed adding instances.".format(deploymentId),
+            )
+
+        instance_ids = deployment.instance_ids
+        if instanceStatusFilter:
+            instance_ids = deployment.filter_instances(now, instanceStatusFilter)
+
+        start = int(nextToken or 0)
+        result = dict(instancesList=instance_ids[start:start + self.page_size])
+        if start + self.page_size < len(instance_ids):
+            result["nextToken"] = str(start + self.page_size)
+        return result
+
+    def get_deployment_instance(self, deploymentId, instanceId):
+        self.call("GetDeploymentInstance")
+        deployment = self.get("GetDeploymentInstance", deploymentId)
+        return dict(instanceSummary=deployment.instance_summary(instanceId, self.clock.time()))
+
+    def batch_get_deployment_instances(self, deploymentId, instanceIds):
+        self.call("BatchGetDeploymentInstances")
+        if len(instanceIds) > BATCH_SIZE:
+            raise client_error(
+                "BatchGetDeploymentInstances",
+                "BatchLimitExceededException",
+                "The maximum number of instance ids was exceeded.",
+            )
+        deployment = self.get("BatchGetDeploymentInstances", deploymentId)
+        now = self.clock.time()
+        return dict(
+            instancesSummary=[
+                deployment.instance_summary(instance_id, now)
+                for instance_id in instanceIds
+                if instance_id in deployment.indexes
+            ],
+            errorMessage="",
+        )
+
+    def stop_deployment(self, deploymentId, autoRollbackEnabled=False):
+        self.call("StopDeployment")
+        deployment = self.get("StopDeployment", deploymentId)
+        deployment.stopped_at = self.clock.time()
+        deployment.cached_statuses = (None, None)
+        if self.notifications is not None:
+            self.notifications.cancel(deploymentId, after=deployment.stopped_at)
+            self.notifications.schedule(
+                deployment.stopped_at,
+                sns_envelope(deployment.deployment_notification(deployment.stopped_at)),
+                tag=deploymentId,
+            )
+        return dict(
+            status="Pending",
+            statusMessage="Stopping deployment",
+        )
+
+
+class FakeS3(FakeService):
+    """
+    Stand-in for a botocore S3 client, storing objects in memory.
+    """
+    def __init__(self, versioning=False, throttle_rate=0.0, seed=0):
+        super(FakeS3, self).__init__(throttle_rate=throttle_rate, seed=seed)
+        self.versioning = versioning
+        self.objects = dict()
+        self.uploads = dict()
+
+    def store(self, bucket, key, data, metadata):
+        etag = '"{}"'.format(md5(data).hexdigest())
+        with self.lock:
+            version = "v{}".format(len(self.objects) + 1) if self.versioning else None
+            self.objects[(bucket, key)] = dict(
+                data=data,
+                etag=etag,
+                metadata=dict(metadata or {}),
+                version=version,
+            )
+        result = dict(ETag=etag)
+        if version:
+            result["VersionId"] = version
+        return result
+
+    def put_object(self, Bucket, Key, Body, Metadata=None):
+        self.call("PutObject")
+        data = Body.read() if hasattr(Body, "read") else Body
+        return self.store(Bucket, Key, data, Metadata)
+
+    def head_object(self, Bucket, Key):
+        self.call("HeadObject")
+        try:
+            stored = self.objects[(Bucket, Key)]
+        except KeyError:
+            raise client_error("HeadObject", "404", "Not Found")
+        result = dict(
+            ETag=stored["etag"],
+            ContentLength=len(stored["data"]),
+            Metadata=stored["metadata"],
+        )
+        if stored["version"]:
+            result["VersionId"] = stored["version"]
+        return result
+
+    def create_multipart_upload(self, Bucket, Key, Metadata=None):
+        self.call("CreateMultipartUpload")
+        with self.lock:
+            upload_id = "upload-{}".format(len(self.uploads) + 1)
+            self.uploads[upload_id] = dict(parts=dict(), metadata=Metadata)
+        return dict(UploadId=upload_id)
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.call("UploadPart")
+        with self.lock:
+            self.uploads[UploadId]["parts"][PartNumber] = Body
+        return dict(ETag='"{}"'.format(md5(Body).hexdigest()))
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.call("CompleteMultipartUpload")
+        with self.lock:
+            upload = self.uploads.pop(UploadId)
+        data = b"".join(
+            upload["parts"][part["PartNumber"]]
+            for part in MultipartUpload["Parts"]
+        )
+        return self.store(Bucket, Key, data, upload["metadata"])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.call("AbortMultipartUpload")
+        with self.lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+
+def sns_envelope(message):
+    return dumps(dict(
+        Type="Notification",
+        Message=dumps(message),
+    ))
+
+
+class FakeSQS(FakeService):
+    """
+    Stand-in for a botocore SQS client with a single queue.
+
+    Messages may be scheduled to become visible at a (virtual) time. Receiving with
+    `WaitTimeSeconds` long polls by sleeping on the clock until a message is due.
+    Received messages reappear after `visibility_timeout` unless deleted.
+    """
+    def __init__(self, clock=None, visibility_timeout=30.0, throttle_rate=0.0, seed=0):
+        super(FakeSQS, self).__init__(throttle_rate=throttle_rate, seed=seed)
+        self.clock = clock or FakeClock()
+        self.visibility_timeout = visibility_timeout
+        self.sequence = count()
+        # heap of (visible_at, sequence, message)
+        self.queue = []
+        self.receipts = dict()
+
+    def schedule(self, at, body, tag=None):
+        with self.lock:
+            heappush(self.queue, (at, next(self.sequence), dict(
+                body=body,
+                tag=tag,
+                deleted=False,
+            )))
+
+    def cancel(self, tag, after):
+        """
+        Drop messages with a tag that are not yet visible at `after`.
+        """
+        with self.lock:
+            for visible_at, _, message in self.queue:
+                if message["tag"] == tag and visible_at > after:
+                    message["deleted"] = True
+
+    def send_message(self, QueueUrl, MessageBody):
+        self.call("SendMessage")
+        self.schedule(self.clock.time(), MessageBody)
+        return dict(MessageId="message")
+
+    def next_visible_at(self):
+        with self.lock:
+            while self.queue and self.queue[0][2]["deleted"]:
+                heappop(self.queue)
+            return self.queue[0][0] if self.queue else None
+
+    def take(self, limit):
+        now = self.clock.time()
+        messages = []
+        with self.lock:
+            while self.queue and len(messages) < limit and self.queue[0][0] <= now:
+                _, sequence, message = heappop(self.queue)
+                if message["deleted"]:
+                    continue
+                receipt_handle = "{}-{}".format(sequence, next(self.sequence))
+                self.receipts[receipt_handle] = message
+                heappush(self.queue, (now + self.visibility_timeout, sequence, message))
+                messages.append(dict(
+                    MessageId=str(sequence),
+                    ReceiptHandle=receipt_handle,
+                    Body=message["body"],
+                ))
+        return messages
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0):
+        self.call("ReceiveMessage")
+        messages = self.take(MaxNumberOfMessages)
+        if not messages and WaitTimeSeconds:
+            visible_at = self.next_visible_at()
+            delay = WaitTimeSeconds
+            if visible_at is not None:
+                delay = min(delay, max(0.0, visible_at - self.clock.time()))
+            self.clock.sleep(delay)
+            messages = self.take(MaxNumberOfMessages)
+        return dict(Messages=messages) if messages else dict()
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self.call("DeleteMessageBatch")
+        with self.lock:
+            for entry in Entries:
+                message = self.receipts.pop(entry["ReceiptHandle"], None)
+                if message is not None:
+                    message["deleted"] = True
+        return dict(
+            Successful=[dict(Id=entry["Id"]) for entry in Entries],
+            Failed=[],
+        )
+
+
+class FakeProfile(object):
+    """
+    Stand-in for an awsenv profile that hands out fake clients.
+    """
+    region_name = "us-west-2"
+
+    def __init__(self, codedeploy=None, s3=None, sqs=None):
+        self.clients = dict(
+            codedeploy=codedeploy or FakeCodeDeploy(),
+            s3=s3 or FakeS3(),
+            sqs=sqs or FakeSQS(),
+        )
+
+    def create_client(self, service_name, **kwargs):
+        return self.clients[service_name]
@@ -1,16 +1,22 @@
 #!/usr/bin/env python
 from argparse import ArgumentParser, FileType
+from collections import OrderedDict
 from getpass import getuser
 from logging import basicConfig, getLogger
 from os import environ
+from time import time
 
-from awsenv.main import get_profile
-from botocore.client import Config
-from botocore.exceptions import ClientError
-
-from awscodedeploy.deploy import push, deploy
-from awscodedeploy.revision import HelloWorldRevision, DockerComposeRevision
-from awscodedeploy.wait import FailedDeploymentException, wait_for_deploy
+from awscodedeploy.credentials import DEFAULT_CACHE
+from awscodedeploy.metrics import ApiMetrics
+from awscodedeploy.ratelimit import DEFAULT_RATE, RateLimiter, parse_rate_limit
+from awscodedeploy.revision import (
+    BUNDLE_TYPES,
+    DEFAULT_COMPRESSION_LEVEL,
+    DEFAULT_PULL_CONCURRENCY,
+    DockerComposeRevision,
+    HelloWorldRevision,
+)
+from awscodedeploy.timing import phase, record, report
 
 
 def parse_args():
@@ -31,7 +37,10 @@ def parse_args():
     )
     parser.add_argument(
         "--deployment-id",
-        help="CodeDeploy deployment id to poll",
+        dest="deployment_ids",
+        action="append",
+        default=[],
+        help="CodeDeploy deployment id to poll; may be repeated",
     )
     parser.add_argument(
         "--deployment-name",
@@ -39,6 +48,14 @@ def parse_args():
         required=True,
         help="CodeDeploy deployment name",
     )
+    parser.add_argument(
+        "--deployment-group",
+        dest="deployment_groups",
+        action="append",
+        default=[],
+        help="Also deploy the revision pushed for --deployment-name to this deployment group; "
+             "may be repeated",
+    )
     parser.add_argument(
         "--description",
         required=False,
@@ -49,6 +66,19 @@ def parse_args():
         default=environ.get("AWS_PROFILE"),
         help="AWS CLI profile",
     )
+    parser.add_argument(
+        "--credential-cache",
+        metavar="FILE",
+        default=DEFAULT_CACHE,
+        help="Reuse assumed-role credentials saved in this file (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-credential-cache",
+        dest="credential_cache",
+        action="store_const",
+        const=None,
+        help="Assume the profile's role on every run",
+    )
     parser.add_argument(
         "--bucket",
         help="Name of the bucket to use; defaults to the Location Labs convention",
@@ -57,16 +87,58 @@ def parse_args():
         "--etag",
         help="Etag of the revision to use",
     )
+    parser.add_argument(
+        "--revision-version",
+        help="S3 object version of the revision to use",
+    )
 
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument("--hello-world", action="store_true")
     group.add_argument("--docker-compose", type=FileType("r"))
 
+    parser.add_argument(
+        "--bundle-type",
+        choices=BUNDLE_TYPES,
+        default="zip",
+        help="Archive format of the revision bundle (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        choices=range(10),
+        default=DEFAULT_COMPRESSION_LEVEL,
+        metavar="{0-9}",
+        help="Compression level of zip and tgz bundles; 0 stores files uncompressed "
+             "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--render-dir",
+        metavar="DIR",
+        help="Only write the docker-compose revision bundle for --deployment-name (and each "
+             "--render-name) to DIR, as <name>.<bundle type>",
+    )
+    parser.add_argument(
+        "--render-name",
+        dest="render_names",
+        action="append",
+        default=[],
+        help="Also render the revision for this deployment name; may be repeated",
+    )
+    parser.add_argument(
+        "--render-processes",
+        type=int,
+        help="Number of processes to render revisions with (default: one per CPU)",
+    )
     parser.add_argument(
         "--no-push",
         action="store_true",
         help="Skip the push step",
     )
+    parser.add_argument(
+        "--force-push",
+        action="store_true",
+        help="Upload the revision even if an identical bundle is already in S3",
+    )
     parser.add_argument(
         "--no-deploy",
         action="store_true",
@@ -88,7 +160,30 @@ def parse_args():
         "--sleep-timeout",
         type=float,
         default=1.0,
-        help="Set the poll loop's sleep timeout",
+        help="Set the poll loop's minimum sleep timeout",
+    )
+    parser.add_argument(
+        "--max-sleep-timeout",
+        type=float,
+        default=10.0,
+        help="Set the poll loop's maximum sleep timeout when nothing changes",
+    )
+    parser.add_argument(
+        "--poll-concurrency",
+        type=int,
+        default=8,
+        help="Set the maximum number of deployments polled concurrently",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        dest="rate_limits",
+        type=parse_rate_limit,
+        action="append",
+        default=[],
+        metavar="OPERATION=RATE",
+        help="Limit an API operation (e.g. GetDeployment) to RATE calls per second; "
+             "'default' sets the limit for other operations ({} unless set; 0 is unlimited). "
+             "May be repeated".format(DEFAULT_RATE),
     )
     parser.add_argument(
         "--step-timeout",
@@ -96,6 +191,90 @@ def parse_args():
         default=300,
         help="Set the timeout for each step (ApplicationStop, Install, etc)"
     )
+    parser.add_argument(
+        "--pull-concurrency",
+        type=int,
+        default=DEFAULT_PULL_CONCURRENCY,
+        help="Pull at most this many docker images at once on each instance "
+             "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--events",
+        metavar="TARGET",
+        help="Also write deployment progress as JSON lines to TARGET: a file path, "
+             "fd:N for an open file descriptor or unix:PATH for a unix socket",
+    )
+    parser.add_argument(
+        "--status-queue",
+        metavar="QUEUE_URL",
+        help="Follow deployments through CodeDeploy trigger notifications delivered "
+             "(via SNS) to this SQS queue instead of polling every instance",
+    )
+    parser.add_argument(
+        "--max-failed-instances",
+        type=int,
+        help="Stop the deployment as soon as more than this many instances have failed",
+    )
+    parser.add_argument(
+        "--max-failed-percent",
+        type=float,
+        help="Stop the deployment as soon as more than this percentage of instances have failed",
+    )
+    parser.add_argument(
+        "--fail-on-failed-event",
+        action="store_true",
+        help="Stop the deployment as soon as any lifecycle event fails",
+    )
+    parser.add_argument(
+        "--auto-rollback",
+        action="store_true",
+        help="Roll back to the last successful revision when stopping a deployment",
+    )
+    parser.add_argument(
+        "--metrics",
+        choices=["text", "json"],
+        help="Print a summary of API calls (counts, latencies, retries, throttles) at exit",
+    )
+    parser.add_argument(
+        "--metrics-statsd",
+        metavar="HOST:PORT",
+        help="Send API call metrics to a StatsD server at exit",
+    )
+    parser.add_argument(
+        "--lifecycle-report",
+        action="store_true",
+        help="After waiting, report p50/p95/max duration per lifecycle event "
+             "and the slowest instances",
+    )
+    parser.add_argument(
+        "--slowest-instances",
+        type=int,
+        default=3,
+        help="Number of slowest instances to name per lifecycle event",
+    )
+    parser.add_argument(
+        "--timing-report",
+        metavar="FILE",
+        help="Write the wall time of each phase (render, push, deploy, wait, ...) as JSON",
+    )
+    parser.add_argument(
+        "--timing-baseline",
+        metavar="FILE",
+        help="Compare phase timings against a report saved by --timing-report",
+    )
+    parser.add_argument(
+        "--timing-threshold",
+        type=float,
+        default=1.25,
+        help="Flag phases that take this many times longer than the baseline",
+    )
+    parser.add_argument(
+        "--daemon-socket",
+        metavar="PATH",
+        default=environ.get("AWS_CODE_DEPLOY_SOCKET"),
+        help="Run through the aws-code-deploy-daemon listening on this unix socket, "
+             "if it is running (default: $AWS_CODE_DEPLOY_SOCKET)",
+    )
     parser.add_argument(
         "--verbose",
         "-v",
@@ -110,6 +289,11 @@ def parse_args():
             getuser(),
         )
 
+    if args.render_dir:
+        if not args.docker_compose:
+            parser.error("--render-dir requires --docker-compose.")
+        return args
+
     if not args.profile:
         parser.error("One of --profile or AWS_PROFILE is required.")
 
@@ -120,11 +304,15 @@ def parse_args():
     return args
 
 
+def log_level(verbosity):
+    return ["WARN", "INFO", "DEBUG"][min(verbosity, 2)]
+
+
 def initialize_logging(verbosity):
     """
     Set logging verbosity.
     """
-    level = ["WARN", "INFO", "DEBUG"][min(verbosity, 2)]
+    level = log_level(verbosity)
     basicConfig(level=level, format="%(message)s")
     getLogger("botocore").setLevel("DEBUG" if level == "DEBUG" else "WARN")
 
@@ -137,40 +325,134 @@ def choose_revision(args):
             deployment_name=args.deployment_name,
             compose_file=args.docker_compose,
             timeout=args.step_timeout,
+            pull_concurrency=args.pull_concurrency,
         )
     raise Exception("Unsupported revision")
 
 
+def load_profile(args):
+    """
+    Load the AWS profile and instrument its session.
+
+    Returns the profile and the API metrics collected from its clients.
+    """
+    from awscodedeploy.credentials import CredentialCache, get_profile
+
+    cache = CredentialCache(args.credential_cache) if args.credential_cache else None
+    profile = get_profile(args.profile, cache)
+    metrics = ApiMetrics()
+    metrics.register(profile.session)
+    RateLimiter.from_args(args).register(profile.session)
+    return profile, metrics
+
+
 def main():
     """
     CLI entry point.
     """
+    started_at = time()
     args = parse_args()
     initialize_logging(args.verbose)
+
+    if args.daemon_socket:
+        from awscodedeploy.daemon import send_request
+        exit_code = send_request(args)
+        if exit_code is not None:
+            return exit_code
+
+    return run(args, started_at)
+
+
+def run(args, started_at, profiles=None):
+    """
+    Push, deploy and wait as configured by the command line.
+
+    :param profiles: a cache of loaded profiles to reuse, if any; otherwise the
+           profile is loaded for this run
+    """
     logger = getLogger("cli")
 
-    revision = choose_revision(args)
+    if args.render_dir:
+        from awscodedeploy.render import render_revisions
+        render_revisions(args)
+        record("total", time() - started_at)
+        report(args)
+        return 0
+
+    # botocore and awsenv are slow to import; defer them until after argument
+    # parsing so that --help and usage errors return quickly
+    from botocore.client import Config
+    from botocore.exceptions import ClientError
+
+    from awscodedeploy.deploy import push, deploy, deploy_many
+    from awscodedeploy.events import EventStream
+    from awscodedeploy.wait import FailedDeploymentException, wait_for_deploy, wait_for_deploys
+
+    with phase("revision.load"):
+        revision = choose_revision(args)
+    metrics = None
+    args.event_stream = None
     try:
-        profile = get_profile(profile=args.profile)
+        if args.events:
+            try:
+                args.event_stream = EventStream.open(args.events)
+            except (IOError, OSError) as error:
+                logger.error("Unable to open event stream {}: {}".format(args.events, error))
+                return 1
+
+        if profiles is None:
+            profile, metrics = load_profile(args)
+        else:
+            profile, metrics = profiles.get(args.profile)
 
         client = profile.create_client("codedeploy", config=Config(
             connect_timeout=args.socket_timeout,
             read_timeout=args.socket_timeout,
         ))
 
+        # watch existing deployments by id
+        deployment_ids = OrderedDict(
+            (deployment_id, deployment_id) for deployment_id in args.deployment_ids
+        )
+
         # push the revision to S3
-        if not args.no_push and not args.deployment_id:
-            args.etag = push(profile, args, revision)
+        if not args.no_push and not deployment_ids:
+            args.etag, args.revision_version = push(profile, client, args, revision)
 
         # deploy from the revision
         if not args.no_deploy and args.etag:
-            args.deployment_id = deploy(profile, client, args)
+            if args.deployment_groups:
+                deployment_ids = deploy_many(
+                    profile,
+                    client,
+                    args,
+                    [args.deployment_name] + args.deployment_groups,
+                )
+            else:
+                deployment_ids = OrderedDict([
+                    (args.deployment_name, deploy(profile, client, args)),
+                ])
 
         # wait for the deploy to finish
-        if not args.no_wait and args.deployment_id:
-            wait_for_deploy(client, args)
+        source = None
+        if args.status_queue:
+            from awscodedeploy.notifications import QueueSource
+            source = QueueSource(profile.create_client("sqs"), args.status_queue, client)
+
+        if not args.no_wait and len(deployment_ids) > 1:
+            wait_for_deploys(client, args, deployment_ids, source=source)
+        elif not args.no_wait and deployment_ids:
+            args.deployment_id, = deployment_ids.values()
+            wait_for_deploy(client, args, source=source)
 
         return 0
     except (ClientError, FailedDeploymentException) as error:
         logger.error(error)
         return 1
+    finally:
+        if args.event_stream is not None:
+            args.event_stream.close()
+        if metrics is not None:
+            metrics.report(args)
+        record("total", time() - started_at)
+        report(args)
@@ -0,0 +1,225 @@
+"""
+API call instrumentation.
+
+Hooks into botocore session events to count and time every API call per operation,
+including retried attempts and throttled responses.
+"""
+from collections import OrderedDict
+from json import dumps
+from logging import getLogger
+from socket import AF_INET, SOCK_DGRAM, socket
+from threading import Lock
+from time import time
+import sys
+
+from awscodedeploy.context import current as current_request
+
+
+# latency histogram bucket upper bounds, in milliseconds
+LATENCY_BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf")]
+
+THROTTLE_CODES = set([
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "SlowDown",
+    "RequestLimitExceeded",
+])
+
+# request context key for the call start time
+START_TIME = "awscodedeploy.metrics.start_time"
+
+
+def operation_key(event_name):
+    """
+    Derive "<service>.<operation>" from an event name like "before-call.s3.PutObject".
+    """
+    return ".".join(event_name.split(".")[1:3])
+
+
+def bucket_label(index):
+    if index == len(LATENCY_BUCKETS) - 1:
+        return ">{}".format(LATENCY_BUCKETS[index - 1])
+    return "<={}".format(LATENCY_BUCKETS[index])
+
+
+def error_code(parsed):
+    return (parsed or {}).get("Error", {}).get("Code")
+
+
+class OperationMetrics(object):
+    """
+    Counters and latency histogram for one API operation.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.attempts = 0
+        self.throttles = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.histogram = [0] * len(LATENCY_BUCKETS)
+
+    @property
+    def retries(self):
+        return max(0, self.attempts - self.calls)
+
+    @property
+    def latency_mean(self):
+        return self.latency_sum / self.calls if self.calls else 0.0
+
+    def record(self, latency, error=None):
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.histogram[index] += 1
+                break
+
+    def to_dict(self):
+        return OrderedDict([
+            ("calls", self.calls),
+            ("retries", self.retries),
+            ("throttles", self.throttles),
+            ("errors", self.errors),
+            ("latency_mean_ms", round(self.latency_mean, 3)),
+            ("latency_max_ms", round(self.latency_max, 3)),
+            ("latency_histogram_ms", OrderedDict(
+                (bucket_label(index), count)
+                for index, count in enumerate(self.histogram)
+            )),
+        ])
+
+
+class ApiMetrics(object):
+    """
+    Per-operation API call metrics, collected from botocore session events.
+
+    Register on a session before creating clients from it; clients copy the session's
+    event handlers when they are created. Calls made while serving a daemon request are
+    recorded in that request's metrics instead, since its clients are shared.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.operations = dict()
+
+    def current(self):
+        """
+        Get the metrics of the daemon request being served, or these metrics.
+        """
+        request = current_request()
+        return self if request is None else request.metrics
+
+    def register(self, session):
+        session.register("before-call", self.before_call)
+        session.register("after-call", self.after_call)
+        session.register("request-created", self.request_created)
+        session.register("needs-retry", self.needs_retry)
+
+    def get(self, key):
+        if key not in self.operations:
+            self.operations[key] = OperationMetrics()
+        return self.operations[key]
+
+    def before_call(self, context=None, **kwargs):
+        if context is not None:
+            context[START_TIME] = time()
+
+    def after_call(self, event_name, parsed=None, context=None, **kwargs):
+        start_time = (context or {}).get(START_TIME)
+        if start_time is None:
+            return
+        latency = (time() - start_time) * 1000.0
+        metrics = self.current()
+        with metrics.lock:
+            metrics.get(operation_key(event_name)).record(latency, error_code(parsed))
+
+    def request_created(self, event_name, **kwargs):
+        metrics = self.current()
+        with metrics.lock:
+            metrics.get(operation_key(event_name)).attempts += 1
+
+    def needs_retry(self, event_name, response=None, **kwargs):
+        if response is None:
+            return
+        _, parsed = response
+        if error_code(parsed) in THROTTLE_CODES:
+            metrics = self.current()
+            with metrics.lock:
+                metrics.get(operation_key(event_name)).throttles += 1
+
+    def to_dict(self):
+        with self.lock:
+            return OrderedDict(
+                (key, self.operations[key].to_dict())
+                for key in sorted(self.operations)
+            )
+
+    def summary(self):
+        """
+        Format a human-readable summary.
+        """
+        lines = ["API calls:"]
+        for key, metrics in self.to_dict().items():
+            lines.append(
+                "  {}: {calls} calls, {retries} retries, {throttles} throttles, "
+                "mean {latency_mean_ms:.1f}ms, max {latency_max_ms:.1f}ms".format(key, **metrics)
+            )
+            lines.append("    {}".format(" ".join(
+                "{}ms: {}".format(bucket, count)
+                for bucket, count in metrics["latency_histogram_ms"].items()
+                if count
+            )))
+        return "\n".join(lines)
+
+    def to_statsd(self, prefix="awscodedeploy"):
+        """
+        Format the metrics as StatsD lines.
+        """
+        lines = []
+        for key, metrics in self.to_dict().items():
+            name = "{}.api.{}".format(prefix, key)
+            lines.extend([
+                "{}.calls:{}|c".format(name, metrics["calls"]),
+                "{}.retries:{}|c".format(name, metrics["retries"]),
+                "{}.throttles:{}|c".format(name, metrics["throttles"]),
+                "{}.errors:{}|c".format(name, metrics["errors"]),
+                "{}.latency_mean:{}|ms".format(name, metrics["latency_mean_ms"]),
+                "{}.latency_max:{}|g".format(name, metrics["latency_max_ms"]),
+            ])
+        return lines
+
+    def send_statsd(self, address, prefix="awscodedeploy"):
+        """
+        Send the metrics to a StatsD server over UDP.
+        """
+        host, port = address.rsplit(":", 1)
+        sock = socket(AF_INET, SOCK_DGRAM)
+        try:
+            for line in self.to_statsd(prefix):
+                sock.sendto(line.encode("utf-8"), (host, int(port)))
+        finally:
+            sock.close()
+
+    def report(self, args):
+        """
+        Emit metrics as configured on the command line.
+        """
+        if args.metrics == "text":
+            getLogger("metrics").info(self.summary())
+        elif args.metrics == "json":
+            sys.stdout.write(dumps(self.to_dict(), indent=2) + "\n")
+
+        if args.metrics_statsd:
+            try:
+                self.send_statsd(args.metrics_statsd)
+            except Exception as error:
+                getLogger("metrics").warn("Unable to send metrics to {}: {}".format(
+                    args.metrics_statsd,
+                    error,
+                ))
@@ -0,0 +1,206 @@
+"""
+Follow deployments through CodeDeploy trigger notifications.
+
+CodeDeploy triggers publish deployment and instance events to SNS; subscribe an SQS
+queue to the topic and the queue receives one message per event. Long polling the
+queue replaces polling CodeDeploy for every instance on every tick.
+"""
+from collections import defaultdict
+from datetime import datetime
+from json import loads
+from logging import getLogger
+from threading import Lock
+from time import time
+
+from awscodedeploy.schedule import PollScheduler
+from awscodedeploy.wait import FINISHED_STATUSES, StatusSource, TERMINAL_STATUSES, get_deployment
+
+
+# SQS long polls for at most this many seconds
+MAX_WAIT_TIME = 20
+
+# check the deployment directly this often, in seconds, in case a notification is lost
+RECONCILE_INTERVAL = 60.0
+
+# notifications spell statuses in upper case (e.g. "SUCCEEDED"); the API does not
+STATUS_NAMES = dict(
+    (status.upper(), status)
+    for status in [
+        "Created", "Queued", "InProgress", "Succeeded", "Failed", "Stopped", "Ready",
+        "Pending", "Skipped", "Unknown",
+    ]
+)
+
+
+def normalize_status(status):
+    return STATUS_NAMES.get(status.upper().replace("_", ""), status)
+
+
+def parse_timestamp(value):
+    """
+    Parse a notification timestamp (epoch seconds, as a string), if possible.
+    """
+    try:
+        return datetime.utcfromtimestamp(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_notification(body):
+    """
+    Parse a CodeDeploy notification from an SQS message body.
+
+    Accepts both SNS envelopes and raw message delivery. Returns None for anything
+    that is not a CodeDeploy notification.
+    """
+    try:
+        message = loads(body)
+        if message.get("Type") == "Notification":
+            message = loads(message["Message"])
+    except (AttributeError, KeyError, ValueError):
+        return None
+    if not isinstance(message, dict) or "deploymentId" not in message:
+        return None
+    return message
+
+
+def to_instance_update(notification):
+    """
+    Translate an instance notification to (instance_id, status, lifecycle events),
+    with lifecycle events shaped as BatchGetDeploymentInstances returns them.
+    """
+    events = []
+    for notification_event in loads(notification.get("lifecycleEvents") or "[]"):
+        event = dict(
+            lifecycleEventName=notification_event["LifecycleEvent"],
+            status=normalize_status(notification_event["LifecycleEventStatus"]),
+        )
+        for key, notification_key in [("startTime", "StartTime"), ("endTime", "EndTime")]:
+            timestamp = parse_timestamp(notification_event.get(notification_key))
+            if timestamp is not None:
+                event[key] = timestamp
+        events.append(event)
+
+    return (
+        notification["instanceId"].split("/")[-1],
+        normalize_status(notification["instanceStatus"]),
+        events,
+    )
+
+
+def to_deployment_update(notification):
+    """
+    Translate a deployment notification to (status, overview); the overview may be None.
+    """
+    overview = None
+    if notification.get("deploymentOverview"):
+        overview = dict.fromkeys(["Pending", "InProgress", "Succeeded", "Failed", "Skipped"], 0)
+        overview.update(
+            (status, int(count))
+            for status, count in loads(notification["deploymentOverview"]).items()
+        )
+    return normalize_status(notification["status"]), overview
+
+
+class QueueSource(StatusSource):
+    """
+    Follow deployments through trigger notifications delivered to an SQS queue.
+
+    Each fetch long polls the queue and applies the notifications for the watched
+    deployments. The deployment itself is also fetched from CodeDeploy every
+    `reconcile_interval` seconds, in case a notification is lost or the trigger
+    does not cover every event.
+
+    Messages for other deployments are left on the queue for other consumers; their
+    delivery is delayed until their visibility timeout expires, so a queue per host
+    works best.
+    """
+    def __init__(self,
+                 sqs,
+                 queue_url,
+                 client,
+                 wait_time=MAX_WAIT_TIME,
+                 reconcile_interval=RECONCILE_INTERVAL,
+                 clock=time):
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.client = client
+        self.wait_time = wait_time
+        self.reconcile_interval = reconcile_interval
+        self.clock = clock
+        self.lock = Lock()
+        self.watched = set()
+        self.pending = defaultdict(list)
+        self.reconciled_at = dict()
+
+    def scheduler(self, args):
+        # receiving from the queue already waits for news
+        return PollScheduler(0.0, 0.0)
+
+    def receive(self):
+        """
+        Long poll the queue once, keeping notifications for watched deployments.
+        """
+        result = self.sqs.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=self.wait_time,
+        )
+        receipt_handles = []
+        for message in result.get("Messages", []):
+            notification = parse_notification(message["Body"])
+            if notification is None:
+                getLogger("wait").debug("Ignoring message {}".format(message.get("MessageId")))
+                continue
+            with self.lock:
+                if notification["deploymentId"] not in self.watched:
+                    continue
+                self.pending[notification["deploymentId"]].append(notification)
+            receipt_handles.append(message["ReceiptHandle"])
+
+        if receipt_handles:
+            self.sqs.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    dict(Id=str(index), ReceiptHandle=receipt_handle)
+                    for index, receipt_handle in enumerate(receipt_handles)
+                ],
+            )
+
+    def reconcile(self, watcher):
+        """
+        Fetch the deployment from CodeDeploy, if it has not been fetched recently.
+        """
+        now = self.clock()
+        reconciled_at = self.reconciled_at.get(watcher.deployment_id)
+        if reconciled_at is not None and now - reconciled_at < self.reconcile_interval:
+            return False
+        self.reconciled_at[watcher.deployment_id] = now
+        status, overview = get_deployment(self.client, watcher.args)
+        return watcher.update_deployment(status, overview)
+
+    def fetch(self, watcher):
+        with self.lock:
+            self.watched.add(watcher.deployment_id)
+
+        changed = self.reconcile(watcher)
+        if watcher.status not in FINISHED_STATUSES:
+            self.receive()
+
+        with self.lock:
+            notifications = self.pending.pop(watcher.deployment_id, [])
+
+        tracker = watcher.tracker
+        for notification in notifications:
+            if "instanceId" in notification:
+                instance_id, status, events = to_instance_update(notification)
+                # notifications may arrive out of order; finished instances stay finished
+                if tracker.statuses.get(instance_id) in TERMINAL_STATUSES:
+                    continue
+                if tracker.update(watcher.args, instance_id, status, events):
+                    changed = True
+            elif watcher.status not in FINISHED_STATUSES:
+                status, overview = to_deployment_update(notification)
+                if watcher.update_deployment(status, overview or watcher.overview):
+                    changed = True
+        return changed
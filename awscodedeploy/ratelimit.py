@@ -0,0 +1,176 @@
+"""
+API rate limiting.
+
+Hooks into botocore session events so that every API call made through a session's
+clients draws from a token bucket for its operation. Buckets slow down when a call
+is throttled and recover gradually as calls succeed.
+"""
+from argparse import ArgumentTypeError
+from logging import getLogger
+from threading import Lock
+from time import sleep, time
+
+from awscodedeploy.metrics import THROTTLE_CODES, error_code, operation_key
+
+
+# calls per second for operations without their own budget
+DEFAULT_RATE = 10.0
+
+# on throttle, multiply the rate by this much; on success, recover this fraction of the budget
+BACKOFF = 0.5
+RECOVERY = 0.05
+
+# never slow an operation below this fraction of its budget
+MIN_RATE_FRACTION = 1.0 / 32
+
+
+def is_throttle(error):
+    """
+    Check whether a ClientError is a throttling response.
+    """
+    return error_code(error.response) in THROTTLE_CODES
+
+
+def parse_rate_limit(value):
+    """
+    Parse an OPERATION=RATE command line value, e.g. "GetDeployment=5" or "default=20".
+    """
+    try:
+        operation, rate = value.split("=", 1)
+        rate = float(rate)
+    except ValueError:
+        raise ArgumentTypeError("expected OPERATION=RATE, got {}".format(value))
+    if rate < 0:
+        raise ArgumentTypeError("rate must not be negative: {}".format(value))
+    return operation, rate
+
+
+class TokenBucket(object):
+    """
+    Allow `rate` calls per second on average, with bursts of up to `burst` calls.
+
+    Callers reserve a token and sleep until it is due, so concurrent callers are
+    served in order without holding the lock while they wait.
+    """
+    def __init__(self, rate, burst=None, clock=time, sleep=sleep):
+        self.max_rate = rate
+        self.min_rate = rate * MIN_RATE_FRACTION
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = Lock()
+        self.tokens = self.burst
+        self.updated = clock()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available. Returns the time slept.
+        """
+        with self.lock:
+            self.refill(self.clock())
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if delay > 0:
+            self.sleep(delay)
+        return delay
+
+    def throttled(self):
+        """
+        Slow down after a throttled call and drop any saved-up burst.
+        """
+        with self.lock:
+            self.refill(self.clock())
+            self.rate = max(self.min_rate, self.rate * BACKOFF)
+            self.tokens = min(self.tokens, 0.0)
+
+    def succeeded(self):
+        """
+        Recover towards the full rate after a successful call.
+        """
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.refill(self.clock())
+                self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY)
+
+
+class RateLimiter(object):
+    """
+    Per-operation token buckets, applied through botocore session events.
+
+    Each operation (e.g. "GetDeployment") gets its own bucket, with the rate from
+    `budgets` or `default_rate`; a rate of zero leaves the operation unlimited.
+    Register on a session before creating clients from it; every client created
+    from the session then shares the same buckets.
+    """
+    def __init__(self, default_rate=DEFAULT_RATE, budgets=None, clock=time, sleep=sleep):
+        self.default_rate = default_rate
+        self.budgets = dict(budgets or {})
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = Lock()
+        self.buckets = dict()
+
+    @classmethod
+    def from_args(cls, args):
+        budgets = dict(args.rate_limits)
+        default_rate = budgets.pop("default", DEFAULT_RATE)
+        return cls(default_rate=default_rate, budgets=budgets)
+
+    def register(self, session):
+        # request-created fires once per attempt, so retries draw tokens too
+        session.register("request-created", self.request_created)
+        session.register("needs-retry", self.needs_retry)
+        session.register("after-call", self.after_call)
+
+    def get(self, operation):
+        """
+        Get the bucket for an operation, or None if it is unlimited.
+        """
+        with self.lock:
+            if operation not in self.buckets:
+                rate = self.budgets.get(operation, self.default_rate)
+                self.buckets[operation] = TokenBucket(
+                    rate,
+                    clock=self.clock,
+                    sleep=self.sleep,
+                ) if rate > 0 else None
+            return self.buckets[operation]
+
+    def acquire(self, operation):
+        bucket = self.get(operation)
+        if bucket is None:
+            return 0.0
+        delay = bucket.acquire()
+        if delay > 0:
+            getLogger("ratelimit").debug("Delayed {} by {:.3f}s".format(operation, delay))
+        return delay
+
+    def request_created(self, event_name, **kwargs):
+        self.acquire(operation_key(event_name).split(".")[-1])
+
+    def needs_retry(self, event_name, response=None, **kwargs):
+        if response is None:
+            return
+        _, parsed = response
+        if error_code(parsed) not in THROTTLE_CODES:
+            return
+        operation = operation_key(event_name).split(".")[-1]
+        bucket = self.get(operation)
+        if bucket is not None:
+            bucket.throttled()
+            getLogger("ratelimit").debug("Throttled on {}; slowing to {:.2f} calls/s".format(
+                operation,
+                bucket.rate,
+            ))
+
+    def after_call(self, event_name, parsed=None, **kwargs):
+        if error_code(parsed):
+            return
+        bucket = self.get(operation_key(event_name).split(".")[-1])
+        if bucket is not None:
+            bucket.succeeded()
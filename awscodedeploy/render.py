@@ -0,0 +1,139 @@
+"""
+Batch revision rendering.
+
+Renders docker-compose revision bundles for many deployment names from a single
+parse of the compose file. Each worker process renders the parts of the revision
+that do not depend on the deployment name once, and shares them between names.
+"""
+from logging import getLogger
+from multiprocessing import Pool, cpu_count
+from os import makedirs
+from os.path import isdir, join
+from shutil import copyfileobj
+
+from termcolor import colored
+
+from awscodedeploy.revision import (
+    DEFAULT_COMPRESSION_LEVEL,
+    DEFAULT_PULL_CONCURRENCY,
+    DockerComposeRevision,
+)
+from awscodedeploy.timing import phase
+from awscodedeploy.yamlio import load
+
+
+# the revision each worker process copies for every deployment name
+worker_template = None
+
+
+def bundle_path(output_dir, deployment_name, bundle_type="zip"):
+    return join(output_dir, "{}.{}".format(deployment_name, bundle_type))
+
+
+def render_bundle(template, deployment_name, output_dir, bundle_type, compression_level):
+    """
+    Write the bundle of a revision for one deployment name, returning its path.
+    """
+    revision = template.for_deployment(deployment_name)
+    path = bundle_path(output_dir, deployment_name, bundle_type)
+    with revision.bundle(bundle_type, compression_level) as bundle, open(path, "wb") as file_:
+        copyfileobj(bundle, file_)
+    return path
+
+
+def initialize_worker(compose_data, timeout, pull_concurrency):
+    global worker_template
+    worker_template = DockerComposeRevision.from_compose_data(
+        None,
+        compose_data,
+        timeout,
+        pull_concurrency,
+    )
+
+
+def render_in_worker(task):
+    return render_bundle(worker_template, *task)
+
+
+def render_bundles(compose_data,
+                   deployment_names,
+                   output_dir,
+                   timeout,
+                   pull_concurrency=DEFAULT_PULL_CONCURRENCY,
+                   processes=None,
+                   bundle_type="zip",
+                   compression_level=DEFAULT_COMPRESSION_LEVEL):
+    """
+    Render a bundle per deployment name into `output_dir`.
+
+    :param compose_data: the parsed compose file
+    :param processes: the number of worker processes; defaults to one per CPU. With a
+           single process, bundles are rendered in this process.
+
+    Returns the bundle paths, in the order of `deployment_names`.
+    """
+    # validate the compose data before starting any workers
+    template = DockerComposeRevision.from_compose_data(
+        None,
+        compose_data,
+        timeout,
+        pull_concurrency,
+    )
+
+    processes = min(processes or cpu_count(), len(deployment_names))
+    if processes <= 1:
+        return [
+            render_bundle(template, deployment_name, output_dir, bundle_type, compression_level)
+            for deployment_name in deployment_names
+        ]
+
+    pool = Pool(
+        processes=processes,
+        initializer=initialize_worker,
+        initargs=(compose_data, timeout, pull_concurrency),
+    )
+    try:
+        return pool.map(
+            render_in_worker,
+            [
+                (deployment_name, output_dir, bundle_type, compression_level)
+                for deployment_name in deployment_names
+            ],
+            chunksize=max(1, len(deployment_names) // (processes * 4)),
+        )
+    finally:
+        pool.close()
+        pool.join()
+
+
+def render_revisions(args):
+    """
+    Render the bundles for --deployment-name and each --render-name into --render-dir.
+    """
+    logger = getLogger("render")
+    deployment_names = [args.deployment_name] + args.render_names
+
+    with phase("revision.load"):
+        compose_data = load(args.docker_compose)
+
+    if not isdir(args.render_dir):
+        makedirs(args.render_dir)
+
+    with phase("revision.render_batch"):
+        paths = render_bundles(
+            compose_data,
+            deployment_names,
+            args.render_dir,
+            timeout=args.step_timeout,
+            pull_concurrency=args.pull_concurrency,
+            processes=args.render_processes,
+            bundle_type=args.bundle_type,
+            compression_level=args.compression_level,
+        )
+
+    for deployment_name, path in zip(deployment_names, paths):
+        logger.info("[{}] Rendered revision of {} to: {}".format(
+            colored("render", "cyan"),
+            colored(deployment_name, "green"),
+            colored(path, "green"),
+        ))
@@ -2,14 +2,21 @@
 Revision object model.
 """
 from abc import ABCMeta, abstractproperty
+from calendar import timegm
+from collections import namedtuple
 from contextlib import contextmanager
-from shutil import rmtree
-from tempfile import mkdtemp
+from gzip import GzipFile
+from io import BytesIO
+from tarfile import TarFile, TarInfo
+from tempfile import SpooledTemporaryFile
 from textwrap import dedent
-from os import mkdir
-from os.path import basename, dirname, join
+from os.path import basename, dirname
+from pipes import quote
+from zipfile import ZipFile, ZipInfo, ZIP64_LIMIT, ZIP_DEFLATED, ZIP_STORED
+from zlib import DEFLATED, MAX_WBITS, compressobj, crc32
 
-from yaml import dump, load
+from awscodedeploy.timing import phase
+from awscodedeploy.yamlio import dump, load
 
 
 APPLICATION_START = "ApplicationStart"
@@ -24,34 +31,159 @@ EVENTS = [
     BEFORE_INSTALL,
 ]
 
+# bundles larger than this spill from memory to a temporary file
+SPOOL_SIZE = 8 << 20
 
-class Hook(object):
+# fixed timestamp for bundle entries, so identical revisions produce identical bundles
+BUNDLE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# bundle types CodeDeploy can deploy from S3; each is also the key's extension
+BUNDLE_TYPES = ("zip", "tar", "tgz")
+
+# zlib's levels: 0 stores without compression, 9 compresses best
+DEFAULT_COMPRESSION_LEVEL = 6
+
+# how many images to pull at once by default
+DEFAULT_PULL_CONCURRENCY = 4
+
+# rendered properties of a DockerComposeRevision that do not depend on its deployment name
+SHARED_PROPERTIES = ("images", "services", "service_levels", "compose_yaml")
+
+
+def dependency_levels(dependencies):
+    """
+    Group services into levels that can each be started in parallel.
+
+    Every service's dependencies are in earlier levels.
+
+    :param dependencies: a mapping from each service to the services it depends on
+    """
+    for name, depends_on in dependencies.items():
+        unknown = set(depends_on) - set(dependencies)
+        if unknown:
+            raise Exception("Service {} depends on undefined services: {}".format(
+                name,
+                ", ".join(sorted(unknown)),
+            ))
+
+    levels = []
+    started = set()
+    while len(started) < len(dependencies):
+        level = sorted(
+            name
+            for name, depends_on in dependencies.items()
+            if name not in started and set(depends_on) <= started
+        )
+        if not level:
+            raise Exception("Services have circular dependencies: {}".format(
+                ", ".join(sorted(set(dependencies) - started)),
+            ))
+        levels.append(level)
+        started.update(level)
+    return levels
+
+
+class memoized_property(object):
+    """
+    A property computed on first access and then stored on the instance.
+
+    Only suitable for values derived from state that does not change after
+    construction.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.__name__] = self.func(instance)
+        return value
+
+
+class Hook(namedtuple("Hook", ["event", "name", "content", "timeout", "user"])):
     """
     Generic script hook.
 
     Defines an event (e.g. ApplicationStart), a script name, and the script
     content to run. Timeouts and users can be configured as well.
+
+    Hooks are immutable, so a rendered hook can be shared.
     """
-    def __init__(self, event, name, content, timeout=300, user="root"):
-        self.event = event
-        self.name = name
-        self.content = content
-        self.timeout = timeout
-        self.user = user
+    __slots__ = ()
+
+    def __new__(cls, event, name, content, timeout=300, user="root"):
+        return super(Hook, cls).__new__(cls, event, name, content, timeout, user)
 
     def to_appspec_dict(self):
         return dict(
-            location="scripts/{}".format(self.name),
+            location=self.path,
             timeout=self.timeout,
             runas=self.user,
         )
 
-    def write(self, revision_dir):
-        """
-        Write the script to the revision dir.
-        """
-        with open(join(revision_dir, "scripts/{}".format(self.name)), "w") as file_:
-            file_.write(self.content)
+    @property
+    def path(self):
+        return "scripts/{}".format(self.name)
+
+
+def write_deflated(archive, info, content, compression_level):
+    """
+    Add an entry to a zip archive, deflated at the given level.
+
+    Does what `ZipFile.writestr` does, which in Python 2 always deflates at zlib's
+    default level.
+    """
+    compressor = compressobj(compression_level, DEFLATED, -MAX_WBITS)
+    data = compressor.compress(content) + compressor.flush()
+
+    info.compress_type = ZIP_DEFLATED
+    info.file_size = len(content)
+    info.compress_size = len(data)
+    info.CRC = crc32(content) & 0xffffffff
+    info.header_offset = archive.fp.tell()
+    archive._writecheck(info)
+    archive._didModify = True
+    archive.fp.write(info.FileHeader(max(info.file_size, info.compress_size) > ZIP64_LIMIT))
+    archive.fp.write(data)
+    archive.filelist.append(info)
+    archive.NameToInfo[info.filename] = info
+
+
+def write_zip(bundle, entries, compression_level):
+    compress_type = ZIP_DEFLATED if compression_level else ZIP_STORED
+    archive = ZipFile(bundle, "w", compress_type, allowZip64=True)
+    try:
+        for path, content in entries:
+            if not isinstance(content, bytes):
+                content = content.encode("utf-8")
+            info = ZipInfo(path, date_time=BUNDLE_DATE_TIME)
+            # rw-r--r--, as for files bundled from a revision directory
+            info.external_attr = 0o644 << 16
+            if compression_level:
+                write_deflated(archive, info, content, compression_level)
+            else:
+                info.compress_type = ZIP_STORED
+                archive.writestr(info, content)
+    finally:
+        archive.close()
+
+
+def write_tar(bundle, entries):
+    archive = TarFile(fileobj=bundle, mode="w")
+    try:
+        for path, content in entries:
+            if not isinstance(content, bytes):
+                content = content.encode("utf-8")
+            info = TarInfo(path)
+            info.size = len(content)
+            info.mtime = timegm(BUNDLE_DATE_TIME)
+            # rw-r--r--, as for files bundled from a revision directory
+            info.mode = 0o644
+            archive.addfile(info, BytesIO(content))
+    finally:
+        archive.close()
 
 
 class Revision(object):
@@ -77,15 +209,14 @@ class Revision(object):
         pass
 
     def to_appspec_dict(self):
+        hooks = dict((event, []) for event in EVENTS)
+        for hook in self.hooks:
+            hooks[hook.event].append(hook.to_appspec_dict())
+
         return dict(
             version=0.0,
             os="linux",
-            hooks={
-                event: [
-                    hook.to_appspec_dict() for hook in self.hooks
-                    if hook.event == event
-                ] for event in EVENTS
-            },
+            hooks=hooks,
             files=[
                 dict(
                     source="files/{}".format(basename(name)),
@@ -94,36 +225,64 @@ class Revision(object):
             ],
         )
 
-    def write(self, revision_dir):
+    @memoized_property
+    def appspec(self):
         """
-        Write out the revision bundle.
+        Render appspec.yml.
         """
-        # write appspec.yml
-        with open(join(revision_dir, "appspec.yml"), "w") as file_:
-            file_.write(dump(self.to_appspec_dict()))
+        return dump(self.to_appspec_dict())
+
+    def entries(self):
+        """
+        Yield the (path, content) of each file in the revision bundle.
+        """
+        yield "appspec.yml", self.appspec
 
-        # write hook scripts
         for hook in self.hooks:
-            hook.write(revision_dir)
+            yield hook.path, hook.content
 
-        # write files
         for name, content in self.files.items():
-            with open(join(revision_dir, "files", basename(name)), "w") as dest:
-                dest.write(content)
+            yield "files/{}".format(basename(name)), content
 
     @contextmanager
-    def make(self):
+    def bundle(self, bundle_type="zip", compression_level=DEFAULT_COMPRESSION_LEVEL):
         """
-        Create this revision in a temporary directory.
+        Create this revision as an archive, without writing it to a directory first.
+
+        The archive is held in memory unless it grows beyond `SPOOL_SIZE`. Entries are
+        sorted and timestamped with `BUNDLE_DATE_TIME`, so the same revision always
+        produces a byte-for-byte identical bundle.
+
+        :param bundle_type: one of `BUNDLE_TYPES`
+        :param compression_level: 0 (store only) to 9; tar bundles are never compressed.
         """
-        try:
-            revision_dir = mkdtemp()
-            mkdir(join(revision_dir, "scripts"))
-            mkdir(join(revision_dir, "files"))
-            self.write(revision_dir)
-            yield revision_dir
-        finally:
-            rmtree(revision_dir)
+        if bundle_type not in BUNDLE_TYPES:
+            raise Exception("Unsupported bundle type: {}".format(bundle_type))
+
+        with phase("revision.render"):
+            entries = sorted(self.entries())
+
+        with SpooledTemporaryFile(max_size=SPOOL_SIZE) as bundle:
+            with phase("bundle.create"):
+                if bundle_type == "zip":
+                    write_zip(bundle, entries, compression_level)
+                elif bundle_type == "tar":
+                    write_tar(bundle, entries)
+                else:
+                    # an empty name and fixed mtime keep the gzip header reproducible
+                    compressed = GzipFile(
+                        filename="",
+                        mode="wb",
+                        compresslevel=compression_level,
+                        fileobj=bundle,
+                        mtime=0,
+                    )
+                    try:
+                        write_tar(compressed, entries)
+                    finally:
+                        compressed.close()
+            bundle.seek(0)
+            yield bundle
 
 
 class HelloWorldRevision(Revision):
@@ -151,39 +310,229 @@ class HelloWorldRevision(Revision):
 
 class DockerComposeRevision(Revision):
     """
-    Revision that uses Docker Compose. Currently only supports compose files
-    with a single service.
+    Revision that uses Docker Compose.
+
+    A single service is run in the foreground; several services are started in
+    the background, in parallel as far as their dependencies allow.
+
+    Hooks and files are rendered once, on first use; the compose data must not be
+    modified afterwards.
     """
-    def __init__(self, deployment_name, compose_file, timeout):
+    def __init__(self, deployment_name, compose_file, timeout,
+                 pull_concurrency=DEFAULT_PULL_CONCURRENCY):
+        self.configure(deployment_name, load(compose_file), timeout, pull_concurrency)
+
+    @classmethod
+    def from_compose_data(cls, deployment_name, compose_data, timeout,
+                          pull_concurrency=DEFAULT_PULL_CONCURRENCY):
+        """
+        Create a revision from already parsed compose data.
+
+        Revisions for several deployment names can share the same data.
+        """
+        revision = cls.__new__(cls)
+        revision.configure(deployment_name, compose_data, timeout, pull_concurrency)
+        return revision
+
+    def for_deployment(self, deployment_name):
+        """
+        Create a copy of this revision for another deployment name.
+
+        Rendering that does not depend on the deployment name is shared.
+        """
+        revision = self.from_compose_data(
+            deployment_name,
+            self.compose_data,
+            self.timeout,
+            self.pull_concurrency,
+        )
+        revision.__dict__.update((name, getattr(self, name)) for name in SHARED_PROPERTIES)
+        return revision
+
+    def configure(self, deployment_name, compose_data, timeout, pull_concurrency):
         self.deployment_name = deployment_name
-        self.compose_data = load(compose_file)
+        self.compose_data = compose_data
         self.timeout = timeout
+        self.pull_concurrency = pull_concurrency
 
-        # validate compose data has only 1 service.
-        if len(self.compose_data) != 1:
-            raise Exception(
-                "DockerComposeRevision only supports compose files with a single service"
-            )
+        if not self.service_data:
+            raise Exception("DockerComposeRevision requires at least one service")
+        if pull_concurrency < 1:
+            raise Exception("Pull concurrency must be at least 1")
+
+        # validate dependencies up front, rather than while rendering hooks
+        self.service_levels
 
     @property
+    def service_data(self):
+        """
+        Return the mapping from service name to definition.
+
+        Version 2 compose files nest services under "services"; version 1 files
+        define them at the top level.
+        """
+        if "version" in self.compose_data:
+            return self.compose_data.get("services") or {}
+        return self.compose_data
+
+    @memoized_property
     def images(self):
         """
         Extract the set of docker images from the compose data.
         """
         return set([
             container["image"]
-            for name, container in self.compose_data.items()
+            for name, container in self.service_data.items()
             if "image" in container
         ])
 
-    @property
+    @memoized_property
     def services(self):
         """
         Return the list of services from the compose data.
         """
-        return [name for name, _ in self.compose_data.items()]
+        return tuple(sorted(self.service_data))
 
-    @property
+    @memoized_property
+    def service_levels(self):
+        """
+        Return the services grouped by dependency level.
+
+        Dependencies come from `depends_on` and `links` (ignoring link aliases).
+        """
+        return dependency_levels(dict(
+            (
+                name,
+                set(container.get("depends_on") or []) | set(
+                    link.split(":")[0] for link in container.get("links") or []
+                ),
+            )
+            for name, container in self.service_data.items()
+        ))
+
+    @memoized_property
+    def stop_script(self):
+        """
+        Stop and remove the running services.
+
+        This runs from the previous revision, so it stops that revision's services.
+        """
+        lines = [
+            "#!/bin/bash",
+            ""
+            "mkdir -p /etc/docker-compose/{}".format(self.deployment_name),
+            "cd /etc/docker-compose/{}".format(self.deployment_name),
+        ]
+        if len(self.services) == 1:
+            return "\n".join(lines + [
+                "test -r docker-compose.yml && docker-compose stop || /bin/true",
+                "test -r docker-compose.yml && docker-compose rm -f || /bin/true",
+                "",
+            ])
+
+        return "\n".join(lines) + dedent("""\
+
+            test -r docker-compose.yml || exit 0
+
+            for service in {}; do
+                docker-compose stop "$service" &
+            done
+            wait
+            docker-compose rm -f || /bin/true
+            """).format(" ".join(quote(service) for service in self.services))
+
+    @memoized_property
+    def start_script(self):
+        """
+        Start the services.
+
+        A single service is run in the foreground. Otherwise, each dependency level is
+        started in parallel once the previous level is up.
+        """
+        if len(self.services) == 1:
+            return dedent("""\
+                #!/bin/bash
+
+                cd /etc/docker-compose/{}
+                docker-compose run --rm {}
+                """.format(self.deployment_name,
+                           self.services[0]))
+
+        return dedent("""\
+            #!/bin/bash
+
+            cd /etc/docker-compose/{}
+
+            start() {{
+                local pids=() failed=0 index
+                for service in "$@"; do
+                    docker-compose up -d --no-deps "$service" &
+                    pids+=($!)
+                done
+                for index in "${{!pids[@]}}"; do
+                    if ! wait "${{pids[$index]}}"; then
+                        echo "Failed to start service: ${{@:$((index + 1)):1}}" >&2
+                        failed=1
+                    fi
+                done
+                return $failed
+            }}
+
+            """).format(self.deployment_name) + "".join(
+            "start {} || exit 1\n".format(" ".join(quote(service) for service in level))
+            for level in self.service_levels
+        )
+
+    @memoized_property
+    def pull_images_script(self):
+        """
+        Pull images in parallel, at most `pull_concurrency` at a time.
+
+        Images pinned by digest are skipped if already present, since their content
+        cannot have changed; tagged images are always pulled. Each pull's output is
+        buffered so that concurrent pulls do not interleave, and is shown if it fails.
+        """
+        lines = [
+            "#!/bin/bash",
+            "",
+            "mkdir -p /etc/docker-compose/{}".format(self.deployment_name),
+            "",
+        ]
+        if not self.images:
+            return "\n".join(lines)
+
+        return "\n".join(lines) + dedent("""\
+
+            pull() {{
+                case "$1" in
+                    *@sha256:*)
+                        if docker inspect --type=image "$1" > /dev/null 2>&1; then
+                            echo "Image already present: $1"
+                            return 0
+                        fi
+                        ;;
+                esac
+                if ! output=$(docker pull "$1" 2>&1); then
+                    echo "Failed to pull image: $1" >&2
+                    echo "$output" >&2
+                    return 1
+                fi
+                echo "Pulled image: $1"
+            }}
+            export -f pull
+
+            xargs -n 1 -P {} bash -c 'pull "$1"' pull <<'EOF' || {{
+            {}
+            EOF
+                echo "Failed to pull one or more images" >&2
+                exit 1
+            }}
+            """).format(
+            self.pull_concurrency,
+            "\n".join(quote(image) for image in sorted(self.images)),
+        )
+
+    @memoized_property
     def hooks(self):
         """
         Defines three hooks:
@@ -191,50 +540,30 @@ class DockerComposeRevision(Revision):
          - Before installation, pulls images.
          - Starts application using docker compose.
         """
-        return [
+        return (
             Hook(
                 event=APPLICATION_STOP,
                 name="stop_and_remove",
-                content="\n".join([
-                    "#!/bin/bash",
-                    ""
-                    "mkdir -p /etc/docker-compose/{}".format(self.deployment_name),
-                    "cd /etc/docker-compose/{}".format(self.deployment_name),
-                    "test -r docker-compose.yml && docker-compose stop || /bin/true",
-                    "test -r docker-compose.yml && docker-compose rm -f || /bin/true",
-                    "",
-                ]),
+                content=self.stop_script,
                 timeout=self.timeout,
             ),
             Hook(
                 event=BEFORE_INSTALL,
                 name="pull_images",
-                content="\n".join([
-                    "#!/bin/bash",
-                    "",
-                    "mkdir -p /etc/docker-compose/{}".format(self.deployment_name),
-                    ""
-                ] + [
-                    "docker pull {}".format(image)
-                    for image in self.images
-                ] + [
-                    "",
-                ]),
+                content=self.pull_images_script,
                 timeout=self.timeout,
             ),
             Hook(
                 event=APPLICATION_START,
                 name="docker-compose",
-                content=dedent("""\
-                #!/bin/bash
-
-                cd /etc/docker-compose/{}
-                docker-compose run --rm {}
-                """.format(self.deployment_name,
-                           self.services[0])),
+                content=self.start_script,
                 timeout=self.timeout,
             ),
-        ]
+        )
+
+    @memoized_property
+    def compose_yaml(self):
+        return dump(self.compose_data)
 
     @property
     def files(self):
@@ -245,5 +574,5 @@ class DockerComposeRevision(Revision):
             self.deployment_name,
         )
         return {
-            destination: dump(self.compose_data)
+            destination: self.compose_yaml
         }
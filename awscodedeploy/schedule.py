@@ -0,0 +1,46 @@
+"""
+Poll scheduling.
+"""
+from random import uniform
+from time import sleep
+
+
+class PollScheduler(object):
+    """
+    Choose how long to sleep between polls.
+
+    Starts polling every `min_timeout` seconds and backs off exponentially (with jitter)
+    while nothing changes, up to `max_timeout`. Any change resets to fast polling.
+    """
+    def __init__(self, min_timeout, max_timeout, factor=1.5, jitter=0.1, sleep=sleep):
+        self.min_timeout = min_timeout
+        self.max_timeout = max(min_timeout, max_timeout)
+        self.factor = factor
+        self.jitter = jitter
+        self.sleep = sleep
+        self.delay = min_timeout
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(
+            min_timeout=args.sleep_timeout,
+            max_timeout=args.max_sleep_timeout,
+        )
+
+    def wait(self):
+        """
+        Sleep until the next poll.
+        """
+        delay = self.delay * uniform(1 - self.jitter, 1 + self.jitter)
+        delay = min(max(delay, self.min_timeout), self.max_timeout)
+        self.sleep(delay)
+        return delay
+
+    def update(self, changed):
+        """
+        Reset to fast polling on change; otherwise back off.
+        """
+        if changed:
+            self.delay = self.min_timeout
+        else:
+            self.delay = min(self.delay * self.factor, self.max_timeout)
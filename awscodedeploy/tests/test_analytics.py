@@ -0,0 +1,44 @@
+from hamcrest import assert_that, contains, equal_to
+
+from awscodedeploy.analytics import LifecycleStats, percentile
+
+
+def test_percentile_nearest_rank():
+    values = [15, 20, 35, 40, 50]
+
+    assert_that(percentile(values, 0.05), equal_to(15))
+    assert_that(percentile(values, 0.3), equal_to(20))
+    assert_that(percentile(values, 0.4), equal_to(20))
+    assert_that(percentile(values, 0.5), equal_to(35))
+    assert_that(percentile(values, 1.0), equal_to(50))
+
+
+def test_percentile_bounds():
+    assert_that(percentile([3.0], 0.5), equal_to(3.0))
+    assert_that(percentile([3.0], 0.95), equal_to(3.0))
+    assert_that(percentile([2, 1], 0.0), equal_to(1))
+
+
+def test_percentile_of_unsorted_values():
+    values = list(range(100, 0, -1))
+
+    assert_that(percentile(values, 0.5), equal_to(50))
+    assert_that(percentile(values, 0.95), equal_to(95))
+    assert_that(percentile(values, 0.99), equal_to(99))
+
+
+def test_summary():
+    stats = LifecycleStats()
+    for index in range(20):
+        stats.add("Install", "i-{}".format(index), float(index + 1))
+    stats.add("ApplicationStart", "i-0", 2.0)
+
+    summary = stats.summary(slowest=2)
+
+    assert_that(list(summary), contains("Install", "ApplicationStart"))
+    assert_that(summary["Install"]["count"], equal_to(20))
+    assert_that(summary["Install"]["p50"], equal_to(10.0))
+    assert_that(summary["Install"]["p95"], equal_to(19.0))
+    assert_that(summary["Install"]["max"], equal_to(20.0))
+    assert_that(summary["Install"]["slowest"], equal_to([("i-19", 20.0), ("i-18", 19.0)]))
+    assert_that(summary["ApplicationStart"]["slowest"], equal_to([("i-0", 2.0)]))
@@ -0,0 +1,192 @@
+from datetime import datetime, timedelta
+from json import dumps, load
+from os import chmod, environ, stat
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from botocore.session import Session
+from botocore.stub import ANY, Stubber
+from hamcrest import assert_that, close_to, equal_to, is_, none, not_none
+from mock import patch
+
+from awscodedeploy.credentials import CACHE_MARGIN, CredentialCache, get_profile
+
+
+CONFIG = """\
+[default]
+aws_access_key_id = AKIASOURCE
+aws_secret_access_key = source-secret
+region = us-west-2
+
+[profile deploy]
+role_arn = arn:aws:iam::123456789012:role/deploy
+source_profile = default
+"""
+
+ROLE_ARN = "arn:aws:iam::123456789012:role/deploy"
+
+create_client = Session.create_client
+
+
+class Fixture(object):
+
+    def __init__(self):
+        self.tmpdir = mkdtemp()
+        self.cache_path = join(self.tmpdir, "credentials")
+        config_path = join(self.tmpdir, "config")
+        with open(config_path, "w") as file_:
+            file_.write(CONFIG)
+
+        # load profiles from the config above only, with no session in the environment
+        variables = dict(
+            (key, value) for key, value in environ.items() if not key.startswith("AWS_")
+        )
+        variables.update(
+            AWS_CONFIG_FILE=config_path,
+            AWS_SHARED_CREDENTIALS_FILE=join(self.tmpdir, "missing"),
+        )
+        self.environ = patch.dict(environ, variables, clear=True)
+        # stub every sts client, so that each may assume the role once
+        self.create_client = patch.object(
+            Session,
+            "create_client",
+            autospec=True,
+            side_effect=self.stub_create_client,
+        )
+        self.sts_clients = 0
+        self.assume_role_calls = 0
+
+    def stub_create_client(self, session, *args, **kwargs):
+        client = create_client(session, *args, **kwargs)
+        if kwargs.get("service_name") != "sts":
+            return client
+
+        self.sts_clients += 1
+        client.meta.events.register(
+            "before-parameter-build.sts.AssumeRole",
+            self.count_assume_role,
+        )
+        stubber = Stubber(client)
+        stubber.add_response(
+            "assume_role",
+            dict(Credentials=dict(
+                AccessKeyId="AKIAROLE00000000",
+                SecretAccessKey="role-secret",
+                SessionToken="token-{}".format(self.sts_clients),
+                Expiration=datetime.utcnow() + timedelta(hours=1),
+            )),
+            dict(RoleArn=ROLE_ARN, RoleSessionName=ANY, DurationSeconds=3600),
+        )
+        stubber.activate()
+        return client
+
+    def count_assume_role(self, **kwargs):
+        self.assume_role_calls += 1
+
+    def __enter__(self):
+        self.environ.start()
+        self.create_client.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.create_client.stop()
+        self.environ.stop()
+        rmtree(self.tmpdir)
+
+    def cache(self, offset=0):
+        return CredentialCache(self.cache_path, clock=lambda: time() + offset)
+
+    def write_cache(self, content, mode=0o600):
+        with open(self.cache_path, "w") as file_:
+            file_.write(content)
+        chmod(self.cache_path, mode)
+
+
+def test_reuses_cached_session():
+    with Fixture() as fixture:
+        first = get_profile("deploy", fixture.cache())
+        second = get_profile("deploy", fixture.cache())
+
+        assert_that(fixture.assume_role_calls, equal_to(1))
+        assert_that(second.session_name, equal_to(first.session_name))
+        assert_that(second.session_token, equal_to("token-1"))
+        assert_that(second.access_key_id, equal_to("AKIAROLE00000000"))
+        assert_that(second.to_envvars(), equal_to(first.to_envvars()))
+        # the cached session is not leaked into the process environment
+        assert_that(environ.get("AWS_SESSION_TOKEN"), is_(none()))
+
+
+def test_refreshes_session_expiring_soon():
+    with Fixture() as fixture:
+        get_profile("deploy", fixture.cache())
+
+        # five minutes before the hour-long session expires
+        profile = get_profile("deploy", fixture.cache(offset=3600 - CACHE_MARGIN // 2))
+
+        assert_that(fixture.assume_role_calls, equal_to(2))
+        assert_that(profile.session_token, equal_to("token-2"))
+
+
+def test_refresh_ignores_cached_session():
+    with Fixture() as fixture:
+        get_profile("deploy", fixture.cache())
+        get_profile("deploy", fixture.cache(), refresh=True)
+
+        assert_that(fixture.assume_role_calls, equal_to(2))
+
+
+def test_creates_private_cache_file():
+    with Fixture() as fixture:
+        get_profile("deploy", fixture.cache())
+
+        assert_that(stat(fixture.cache_path).st_mode & 0o777, equal_to(0o600))
+        with open(fixture.cache_path) as file_:
+            entries = load(file_)
+        assert_that(entries["deploy"]["variables"]["AWS_SESSION_TOKEN"], equal_to("token-1"))
+        # the session expires an hour after it was assumed
+        assert_that(entries["deploy"]["expires_at"], close_to(time() + 3600, 5))
+
+
+def test_ignores_readable_cache_file():
+    with Fixture() as fixture:
+        get_profile("deploy", fixture.cache())
+        assert_that(fixture.cache().get("deploy"), not_none())
+
+        for mode in (0o640, 0o604):
+            chmod(fixture.cache_path, mode)
+            assert_that(fixture.cache().get("deploy"), is_(none()))
+
+
+def test_ignores_corrupt_cache_file():
+    with Fixture() as fixture:
+        fixture.write_cache('{"deploy": {"expires_at"')
+
+        profile = get_profile("deploy", fixture.cache())
+
+        assert_that(fixture.assume_role_calls, equal_to(1))
+        assert_that(profile.session_token, equal_to("token-1"))
+        # and the cache is replaced with a valid one
+        assert_that(fixture.cache().get("deploy"), not_none())
+
+
+def test_ignores_partial_cache_entries():
+    with Fixture() as fixture:
+        fixture.write_cache(dumps(dict(
+            deploy=dict(variables=dict(AWS_SESSION_TOKEN="stale")),
+            other=dict(expires_at=time() + 3600, variables=dict()),
+        )))
+
+        assert_that(fixture.cache().read(), equal_to(dict()))
+        profile = get_profile("deploy", fixture.cache())
+
+        assert_that(fixture.assume_role_calls, equal_to(1))
+        assert_that(profile.session_token, equal_to("token-1"))
+
+
+def test_ignores_non_mapping_cache_file():
+    with Fixture() as fixture:
+        fixture.write_cache("[]")
+
+        assert_that(fixture.cache().get("deploy"), is_(none()))
@@ -0,0 +1,125 @@
+from argparse import Namespace
+from json import dumps, loads
+from os.path import join
+from shutil import rmtree
+from socket import AF_UNIX, SOCK_STREAM, socket
+from tempfile import mkdtemp
+from threading import Thread
+
+from awsenv.cache import CachedSession
+from botocore.session import Session
+from hamcrest import assert_that, contains_string, equal_to, has_length, is_, none
+from mock import Mock, patch
+
+from awscodedeploy.daemon import WarmProfile, send_request
+from awscodedeploy.metrics import ApiMetrics
+
+
+class RoleProfile(object):
+    """
+    An assumed-role profile with static credentials, as awsenv loads it.
+    """
+    def __init__(self, access_key, session_duration):
+        self.access_key_id = access_key
+        self.secret_access_key = "secret"
+        self.session_token = "token"
+        self.session_name = CachedSession.make_name()
+        self.session_duration = session_duration
+        self.region_name = "us-west-2"
+        self.session = Session()
+        self.session.set_credentials(access_key, "secret", "token")
+
+
+def signing_key(client):
+    return client._request_signer._credentials.get_frozen_credentials().access_key
+
+
+def test_clients_in_use_are_refreshed_before_expiry():
+    # five minutes left, well within botocore's mandatory refresh window
+    profile = RoleProfile("AKIAOLD", session_duration=5 * 60)
+    reload = Mock(return_value=RoleProfile("AKIANEW", session_duration=60 * 60))
+    warm = WarmProfile(profile, ApiMetrics(), reload=reload)
+
+    client = warm.create_client("codedeploy")
+
+    assert_that(signing_key(client), equal_to("AKIANEW"))
+    assert_that(reload.call_count, equal_to(1))
+    # the new credentials are good for an hour
+    assert_that(signing_key(client), equal_to("AKIANEW"))
+    assert_that(reload.call_count, equal_to(1))
+
+
+def test_refresh_waits_until_expiry_is_near():
+    profile = RoleProfile("AKIAOLD", session_duration=60 * 60)
+    reload = Mock()
+    warm = WarmProfile(profile, ApiMetrics(), reload=reload)
+
+    warm.refresh()
+
+    assert_that(signing_key(warm.create_client("codedeploy")), equal_to("AKIAOLD"))
+    assert_that(reload.called, is_(False))
+
+
+def test_profiles_without_a_role_keep_their_clients():
+    profile = Mock(session_name=None)
+    warm = WarmProfile(profile, ApiMetrics(), reload=Mock())
+
+    client = warm.create_client("codedeploy")
+
+    assert_that(warm.credentials, is_(none()))
+    assert_that(client, equal_to(profile.create_client.return_value))
+    assert_that(warm.create_client("codedeploy"), equal_to(client))
+    assert_that(profile.create_client.call_count, equal_to(1))
+
+
+def serve_once(path, requests):
+    """
+    Accept one request on a unix socket and answer with a zero exit code.
+    """
+    server = socket(AF_UNIX, SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+
+    def serve():
+        connection, _ = server.accept()
+        requests.append(loads(connection.makefile("r").readline()))
+        connection.sendall(dumps(dict(exit=0)) + "\n")
+        connection.close()
+        server.close()
+
+    thread = Thread(target=serve)
+    thread.start()
+    return thread
+
+
+def make_args(path, **kwargs):
+    args = dict(
+        daemon_socket=path,
+        docker_compose=None,
+        events=None,
+        rate_limits=[],
+        render_dir=None,
+        timing_baseline=None,
+        timing_report=None,
+    )
+    args.update(kwargs)
+    return Namespace(**args)
+
+
+def test_send_request_warns_that_rate_limits_are_ignored():
+    tmpdir = mkdtemp()
+    try:
+        path = join(tmpdir, "daemon.sock")
+        requests = []
+        thread = serve_once(path, requests)
+
+        with patch("awscodedeploy.daemon.getLogger") as get_logger:
+            exit_code = send_request(make_args(path, rate_limits=[("GetDeployment", 5.0)]))
+        thread.join()
+    finally:
+        rmtree(tmpdir)
+
+    assert_that(exit_code, equal_to(0))
+    assert_that(requests, has_length(1))
+    message, = get_logger.return_value.warn.call_args[0]
+    assert_that(message, contains_string("--rate-limit"))
@@ -0,0 +1,146 @@
+from argparse import Namespace
+from contextlib import contextmanager
+from io import BytesIO
+
+from botocore.exceptions import ClientError
+from hamcrest import (
+    assert_that,
+    calling,
+    contains,
+    contains_string,
+    equal_to,
+    is_not,
+    raises,
+)
+from mock import patch
+
+from awscodedeploy.deploy import deploy_many, push
+from awscodedeploy.fake import FakeCodeDeploy, FakeProfile, FakeS3, client_error
+
+
+GROUPS = ["group-{}".format(index) for index in range(20)]
+
+
+def make_args(**kwargs):
+    args = dict(
+        application_name="application",
+        deployment_name="group-0",
+        deployment_config="CodeDeployDefault.OneAtATime",
+        description="test",
+        bucket="bucket",
+        bundle_type="zip",
+        compression_level=6,
+        force_push=False,
+        etag="etag",
+        revision_version=None,
+    )
+    args.update(kwargs)
+    return Namespace(**args)
+
+
+class StaticRevision(object):
+    """
+    A revision whose bundle is fixed content.
+    """
+    def __init__(self, data):
+        self.data = data
+
+    @contextmanager
+    def bundle(self, bundle_type, compression_level):
+        yield BytesIO(self.data)
+
+
+class RecordingCodeDeploy(FakeCodeDeploy):
+
+    def __init__(self):
+        super(RecordingCodeDeploy, self).__init__()
+        self.revisions = []
+
+    def register_application_revision(self, applicationName, description, revision):
+        self.revisions.append(revision["s3Location"])
+
+
+def test_deploy_many_returns_ids_in_group_order():
+    client = FakeCodeDeploy()
+
+    deployment_ids = deploy_many(FakeProfile(client), client, make_args(), GROUPS)
+
+    assert_that(list(deployment_ids), contains(*GROUPS))
+    assert_that(
+        sorted(deployment_ids.values()),
+        equal_to(sorted(client.deployments)),
+    )
+    for deployment_group, deployment_id in deployment_ids.items():
+        assert_that(
+            client.deployments[deployment_id].deployment_group_name,
+            equal_to(deployment_group),
+        )
+
+
+def test_deploy_many_reports_created_deployments_on_failure():
+    client = FakeCodeDeploy()
+    create_deployment = client.create_deployment
+
+    def fail_one(**kwargs):
+        if kwargs["deploymentGroupName"] == "group-7":
+            raise client_error(
+                "CreateDeployment",
+                "DeploymentGroupDoesNotExistException",
+                "No such deployment group",
+            )
+        return create_deployment(**kwargs)
+
+    client.create_deployment = fail_one
+    with patch("awscodedeploy.deploy.getLogger") as get_logger:
+        assert_that(
+            calling(deploy_many).with_args(FakeProfile(client), client, make_args(), GROUPS),
+            raises(ClientError, "No such deployment group"),
+        )
+
+    # every other group's deployment is still created, and logged
+    assert_that(len(client.deployments), equal_to(len(GROUPS) - 1))
+    message = get_logger.return_value.warn.call_args[0][0]
+    for deployment_id in client.deployments:
+        assert_that(message, contains_string(deployment_id))
+
+
+def test_push_skips_unchanged_revisions():
+    s3 = FakeS3(versioning=True)
+    client = RecordingCodeDeploy()
+    profile = FakeProfile(client, s3)
+
+    first = push(profile, client, make_args(), StaticRevision(b"bundle"))
+    second = push(profile, client, make_args(), StaticRevision(b"bundle"))
+
+    assert_that(s3.calls["PutObject"], equal_to(1))
+    assert_that(s3.calls["HeadObject"], equal_to(2))
+    # the existing object is registered again
+    assert_that(second, equal_to(first))
+    assert_that(client.revisions[1], equal_to(client.revisions[0]))
+
+
+def test_push_uploads_changed_revisions():
+    s3 = FakeS3(versioning=True)
+    client = RecordingCodeDeploy()
+    profile = FakeProfile(client, s3)
+
+    first = push(profile, client, make_args(), StaticRevision(b"bundle"))
+    second = push(profile, client, make_args(), StaticRevision(b"changed bundle"))
+
+    assert_that(s3.calls["PutObject"], equal_to(2))
+    assert_that(second[1], equal_to("v2"))
+    assert_that(second, is_not(equal_to(first)))
+
+
+def test_force_push_uploads_unchanged_revisions():
+    s3 = FakeS3(versioning=True)
+    client = RecordingCodeDeploy()
+    profile = FakeProfile(client, s3)
+
+    push(profile, client, make_args(), StaticRevision(b"bundle"))
+    _, version = push(profile, client, make_args(force_push=True), StaticRevision(b"bundle"))
+
+    assert_that(s3.calls["PutObject"], equal_to(2))
+    assert_that(s3.calls["HeadObject"], equal_to(1))
+    assert_that(version, equal_to("v2"))
+    assert_that(client.revisions[1]["version"], equal_to("v2"))
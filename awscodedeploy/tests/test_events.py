@@ -0,0 +1,93 @@
+from json import loads
+from threading import Event
+
+from hamcrest import assert_that, equal_to, is_
+
+from awscodedeploy.events import EventStream, truncate_log_tail
+
+
+class BlockingFile(object):
+    """
+    A file whose writes wait until released.
+    """
+    def __init__(self):
+        self.writing = Event()
+        self.released = Event()
+        self.lines = []
+        self.closed = False
+
+    def write(self, data):
+        self.writing.set()
+        self.released.wait()
+        self.lines.append(loads(data))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class BrokenFile(BlockingFile):
+
+    def write(self, data):
+        raise IOError("Broken pipe")
+
+
+def summarize(lines):
+    return [
+        (line["event"], line.get("index", line.get("count")))
+        for line in lines
+    ]
+
+
+def test_writes_events_in_order():
+    file_ = BlockingFile()
+    file_.released.set()
+    stream = EventStream(file_, clock=lambda: 1.0)
+
+    for index in range(100):
+        stream.emit("instance_status", index=index)
+    stream.close()
+
+    assert_that(file_.closed, is_(True))
+    assert_that(len(file_.lines), equal_to(100))
+    assert_that(file_.lines[0], equal_to(dict(event="instance_status", time=1.0, index=0)))
+    assert_that([line["index"] for line in file_.lines], equal_to(list(range(100))))
+
+
+def test_reports_dropped_events():
+    file_ = BlockingFile()
+    stream = EventStream(file_, max_queued_events=2)
+
+    # the writer takes the first event and blocks on it; two more fill the queue
+    stream.emit("test", index=0)
+    file_.writing.wait()
+    for index in range(1, 8):
+        stream.emit("test", index=index)
+    file_.released.set()
+    stream.close()
+
+    assert_that(summarize(file_.lines), equal_to([
+        ("test", 0),
+        ("dropped", 5),
+        ("test", 1),
+        ("test", 2),
+    ]))
+
+
+def test_survives_write_errors():
+    file_ = BrokenFile()
+    stream = EventStream(file_)
+
+    for index in range(10):
+        stream.emit("test", index=index)
+    stream.close()
+
+    assert_that(stream.failed, is_(True))
+    assert_that(file_.closed, is_(True))
+
+
+def test_truncate_log_tail():
+    assert_that(truncate_log_tail("abc", limit=3), equal_to(("abc", False)))
+    assert_that(truncate_log_tail("abcdef", limit=4), equal_to(("cdef", True)))
@@ -0,0 +1,78 @@
+from argparse import Namespace
+from collections import OrderedDict
+
+from hamcrest import assert_that, equal_to, is_, none
+
+from awscodedeploy.wait import FailurePolicy
+
+
+def overview(failed=0, succeeded=0, in_progress=0, pending=0):
+    return OrderedDict([
+        ("Pending", pending),
+        ("InProgress", in_progress),
+        ("Succeeded", succeeded),
+        ("Failed", failed),
+        ("Skipped", 0),
+        ("Ready", 0),
+    ])
+
+
+def test_no_limits():
+    policy = FailurePolicy()
+
+    assert_that(policy.check(overview(failed=10), [("i-1", "Install")]), is_(none()))
+    assert_that(policy.check(None, []), is_(none()))
+
+
+def test_max_failed_instances():
+    policy = FailurePolicy(max_failed_instances=2)
+
+    assert_that(policy.check(overview(failed=2, pending=8), []), is_(none()))
+    assert_that(
+        policy.check(overview(failed=3, pending=7), []),
+        equal_to("3 instances failed (at most 2 allowed)"),
+    )
+
+
+def test_zero_failed_instances():
+    policy = FailurePolicy(max_failed_instances=0)
+
+    assert_that(policy.check(overview(pending=10), []), is_(none()))
+    assert_that(
+        policy.check(overview(failed=1, pending=9), []),
+        equal_to("1 instances failed (at most 0 allowed)"),
+    )
+
+
+def test_max_failed_percent():
+    policy = FailurePolicy(max_failed_percent=10)
+
+    assert_that(policy.check(overview(failed=1, succeeded=4, pending=5), []), is_(none()))
+    assert_that(
+        policy.check(overview(failed=2, succeeded=4, pending=4), []),
+        equal_to("2 of 10 instances failed (at most 10% allowed)"),
+    )
+    # no instances listed yet
+    assert_that(policy.check(overview(), []), is_(none()))
+
+
+def test_failed_event():
+    policy = FailurePolicy(failed_event=True)
+
+    assert_that(policy.check(overview(in_progress=2), []), is_(none()))
+    assert_that(
+        policy.check(None, [("i-1", "ValidateService"), ("i-2", "Install")]),
+        equal_to("ValidateService failed on i-1"),
+    )
+
+
+def test_from_args():
+    policy = FailurePolicy.from_args(Namespace(
+        max_failed_instances=3,
+        max_failed_percent=None,
+        fail_on_failed_event=True,
+    ))
+
+    assert_that(policy.max_failed_instances, equal_to(3))
+    assert_that(policy.max_failed_percent, is_(none()))
+    assert_that(policy.failed_event, is_(True))
@@ -0,0 +1,99 @@
+from argparse import Namespace
+from io import BytesIO
+from json import loads
+from threading import Thread
+
+from hamcrest import assert_that, contains, equal_to, has_entries
+from mock import patch
+
+from awscodedeploy.context import bind
+from awscodedeploy.daemon import Connection
+from awscodedeploy.metrics import START_TIME, ApiMetrics
+
+
+def call(metrics, operation="GetDeployment"):
+    context = dict()
+    metrics.before_call(context=context)
+    metrics.request_created(event_name="request-created.codedeploy.{}".format(operation))
+    metrics.after_call(
+        event_name="after-call.codedeploy.{}".format(operation),
+        parsed=dict(),
+        context=context,
+    )
+
+
+def test_records_calls_per_operation():
+    metrics = ApiMetrics()
+
+    call(metrics)
+    call(metrics)
+    call(metrics, "ListDeploymentInstances")
+
+    assert_that(list(metrics.to_dict()), contains(
+        "codedeploy.GetDeployment",
+        "codedeploy.ListDeploymentInstances",
+    ))
+    assert_that(metrics.to_dict()["codedeploy.GetDeployment"], has_entries(
+        calls=2,
+        retries=0,
+        errors=0,
+    ))
+
+
+def test_counts_throttles_and_retries():
+    metrics = ApiMetrics()
+    context = {START_TIME: 0.0}
+    throttled = dict(Error=dict(Code="ThrottlingException"))
+
+    metrics.request_created(event_name="request-created.s3.PutObject")
+    metrics.needs_retry(event_name="needs-retry.s3.PutObject", response=(None, throttled))
+    metrics.request_created(event_name="request-created.s3.PutObject")
+    metrics.after_call(event_name="after-call.s3.PutObject", parsed=dict(), context=context)
+
+    assert_that(metrics.to_dict()["s3.PutObject"], has_entries(
+        calls=1,
+        retries=1,
+        throttles=1,
+    ))
+
+
+def test_daemon_requests_count_their_own_calls():
+    # a warm profile's session hooks are shared by every request
+    shared = ApiMetrics()
+    connections = [Connection(None, None) for _ in range(4)]
+
+    def serve(connection, count):
+        bind(connection)
+        try:
+            for _ in range(count):
+                call(shared)
+        finally:
+            bind(None)
+
+    threads = [
+        Thread(target=serve, args=(connection, 10 * (index + 1)))
+        for index, connection in enumerate(connections)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert_that(
+        [
+            connection.metrics.to_dict()["codedeploy.GetDeployment"]["calls"]
+            for connection in connections
+        ],
+        equal_to([10, 20, 30, 40]),
+    )
+    assert_that(shared.to_dict(), equal_to(dict()))
+
+
+def test_reports_json_to_stdout():
+    metrics = ApiMetrics()
+    call(metrics)
+
+    with patch("sys.stdout", new_callable=BytesIO) as stdout:
+        metrics.report(Namespace(metrics="json", metrics_statsd=None))
+
+    assert_that(loads(stdout.getvalue()), equal_to(metrics.to_dict()))
@@ -0,0 +1,146 @@
+from argparse import Namespace
+from json import dumps
+
+from hamcrest import (
+    assert_that,
+    equal_to,
+    has_entries,
+    has_length,
+    is_,
+    less_than,
+    less_than_or_equal_to,
+    none,
+)
+
+from awscodedeploy.fake import FakeClock, FakeCodeDeploy, FakeSQS, sns_envelope
+from awscodedeploy.notifications import QueueSource, parse_notification
+from awscodedeploy.wait import DeploymentWatcher, wait_for_deploy
+
+
+DEPLOYMENT_ID = "d-000000001"
+
+INSTANCE_ID = "i-000000000001"
+
+
+def make_args(deployment_id=DEPLOYMENT_ID):
+    return Namespace(
+        deployment_id=deployment_id,
+        sleep_timeout=1,
+        max_sleep_timeout=30,
+        lifecycle_report=False,
+        max_failed_instances=None,
+        max_failed_percent=None,
+        fail_on_failed_event=False,
+        auto_rollback=False,
+        event_stream=None,
+    )
+
+
+def instance_notification(status, deployment_id=DEPLOYMENT_ID):
+    return dict(
+        deploymentId=deployment_id,
+        instanceId="arn:aws:ec2:us-west-2:000000000000:instance/{}".format(INSTANCE_ID),
+        instanceStatus=status,
+        lifecycleEvents=dumps([
+            dict(LifecycleEvent="Install", LifecycleEventStatus=status),
+        ]),
+    )
+
+
+def make_source(sqs, client=None):
+    return QueueSource(
+        sqs,
+        "queue",
+        client or FakeCodeDeploy(clock=sqs.clock),
+        wait_time=0,
+        clock=sqs.clock.time,
+    )
+
+
+def test_parse_notification_unwraps_sns_envelopes():
+    notification = instance_notification("SUCCEEDED")
+
+    assert_that(parse_notification(sns_envelope(notification)), equal_to(notification))
+
+
+def test_parse_notification_accepts_raw_messages():
+    notification = instance_notification("SUCCEEDED")
+
+    assert_that(parse_notification(dumps(notification)), equal_to(notification))
+
+
+def test_parse_notification_ignores_other_messages():
+    assert_that(parse_notification("not json"), is_(none()))
+    assert_that(parse_notification(dumps(["a", "list"])), is_(none()))
+    assert_that(parse_notification(dumps(dict(Type="Notification", Message="{}"))), is_(none()))
+    assert_that(parse_notification(dumps(dict(Type="Notification"))), is_(none()))
+
+
+def test_finished_instances_ignore_late_notifications():
+    clock = FakeClock()
+    sqs = FakeSQS(clock=clock)
+    # the start notification is delivered after the finish notification
+    sqs.schedule(clock.time(), sns_envelope(instance_notification("SUCCEEDED")))
+    sqs.schedule(clock.time(), sns_envelope(instance_notification("IN_PROGRESS")))
+    source = make_source(sqs)
+    watcher = DeploymentWatcher(source.client, make_args(), source=source)
+    # the reconcile fetch would find no such deployment
+    source.reconciled_at[DEPLOYMENT_ID] = clock.time()
+
+    source.fetch(watcher)
+
+    assert_that(watcher.tracker.statuses[INSTANCE_ID], equal_to("Succeeded"))
+    assert_that(watcher.tracker.event_statuses[INSTANCE_ID], has_entries(Install="Succeeded"))
+
+
+def test_other_deployments_stay_on_the_queue():
+    clock = FakeClock()
+    sqs = FakeSQS(clock=clock, visibility_timeout=30.0)
+    sqs.schedule(clock.time(), sns_envelope(instance_notification("SUCCEEDED", "d-000000002")))
+    sqs.schedule(clock.time(), sns_envelope(instance_notification("SUCCEEDED")))
+    source = make_source(sqs)
+    watcher = DeploymentWatcher(source.client, make_args(), source=source)
+    source.reconciled_at[DEPLOYMENT_ID] = clock.time()
+
+    source.fetch(watcher)
+
+    assert_that(watcher.tracker.statuses[INSTANCE_ID], equal_to("Succeeded"))
+    assert_that(sqs.calls["DeleteMessageBatch"], equal_to(1))
+    # only the other deployment's message comes back once its visibility timeout expires
+    clock.sleep(30.0)
+    messages = sqs.receive_message("queue", MaxNumberOfMessages=10)["Messages"]
+    assert_that(messages, has_length(1))
+    assert_that(
+        parse_notification(messages[0]["Body"]),
+        has_entries(deploymentId="d-000000002"),
+    )
+
+
+def test_reconcile_finishes_when_final_notifications_are_lost():
+    clock = FakeClock()
+    sqs = FakeSQS(clock=clock)
+    client = FakeCodeDeploy(clock=clock, default_fleet_size=3, notifications=sqs)
+    deployment_id = client.create_deployment(
+        applicationName="application",
+        deploymentGroupName="group",
+    )["deploymentId"]
+    deployment = client.deployments[deployment_id]
+    finished_at = max(
+        deployment.finished_at(instance_id)
+        for instance_id in deployment.instance_ids
+    )
+    # lose the last instance's and the deployment's final notifications
+    sqs.cancel(deployment_id, after=finished_at - 0.001)
+    client.calls.clear()
+
+    args = make_args(deployment_id)
+    source = QueueSource(sqs, "queue", client, reconcile_interval=60.0, clock=clock.time)
+    scheduler = source.scheduler(args)
+    scheduler.sleep = clock.sleep
+
+    wait_for_deploy(client, args, scheduler, source)
+
+    # finished by the next reconcile, at most one interval (and long poll) late
+    assert_that(deployment.status(clock.time()), equal_to("Succeeded"))
+    assert_that(clock.time(), less_than_or_equal_to(finished_at + 60.0 + 20.0))
+    assert_that(client.calls["GetDeployment"], less_than(clock.time() / 60.0 + 2))
@@ -0,0 +1,87 @@
+from argparse import ArgumentTypeError
+
+from hamcrest import assert_that, calling, close_to, equal_to, is_, none, raises
+
+from awscodedeploy.fake import FakeClock, client_error
+from awscodedeploy.ratelimit import (
+    BACKOFF,
+    MIN_RATE_FRACTION,
+    RECOVERY,
+    RateLimiter,
+    TokenBucket,
+    is_throttle,
+    parse_rate_limit,
+)
+
+
+def make_bucket(rate, burst=None):
+    clock = FakeClock()
+    return clock, TokenBucket(rate, burst, clock=clock.time, sleep=clock.sleep)
+
+
+def test_parse_rate_limit():
+    assert_that(parse_rate_limit("GetDeployment=5"), equal_to(("GetDeployment", 5.0)))
+    assert_that(parse_rate_limit("default=0.5"), equal_to(("default", 0.5)))
+    assert_that(parse_rate_limit("default=0"), equal_to(("default", 0.0)))
+
+
+def test_parse_rate_limit_rejects_invalid_values():
+    for value in ("GetDeployment", "GetDeployment=fast", "GetDeployment=-1"):
+        assert_that(calling(parse_rate_limit).with_args(value), raises(ArgumentTypeError))
+
+
+def test_bucket_allows_burst_then_paces():
+    clock, bucket = make_bucket(rate=10.0, burst=5)
+
+    delays = [bucket.acquire() for _ in range(15)]
+
+    assert_that(delays[:5], equal_to([0.0] * 5))
+    for delay in delays[5:]:
+        assert_that(delay, close_to(0.1, 1e-9))
+    assert_that(clock.time(), close_to(1.0, 1e-9))
+
+
+def test_bucket_refills_while_idle():
+    clock, bucket = make_bucket(rate=2.0)
+    bucket.acquire()
+    bucket.acquire()
+
+    clock.sleep(10.0)
+
+    # the saved-up tokens are capped at the burst
+    assert_that([bucket.acquire() for _ in range(3)], equal_to([0.0, 0.0, 0.5]))
+
+
+def test_bucket_backs_off_and_recovers():
+    _, bucket = make_bucket(rate=10.0)
+
+    bucket.throttled()
+    assert_that(bucket.rate, equal_to(10.0 * BACKOFF))
+    assert_that(bucket.tokens <= 0, is_(True))
+
+    for _ in range(100):
+        bucket.throttled()
+    assert_that(bucket.rate, equal_to(10.0 * MIN_RATE_FRACTION))
+
+    bucket.succeeded()
+    assert_that(bucket.rate, close_to(10.0 * (MIN_RATE_FRACTION + RECOVERY), 1e-9))
+    for _ in range(100):
+        bucket.succeeded()
+    assert_that(bucket.rate, equal_to(10.0))
+
+
+def test_rate_limiter_budgets():
+    limiter = RateLimiter(default_rate=5.0, budgets=dict(GetDeployment=0.0))
+
+    # a zero rate leaves the operation unlimited
+    assert_that(limiter.get("GetDeployment"), is_(none()))
+    assert_that(limiter.acquire("GetDeployment"), equal_to(0.0))
+
+    bucket = limiter.get("ListDeploymentInstances")
+    assert_that(bucket.max_rate, equal_to(5.0))
+    assert_that(limiter.get("ListDeploymentInstances"), is_(bucket))
+
+
+def test_is_throttle():
+    assert_that(is_throttle(client_error("GetDeployment", "ThrottlingException", "")), is_(True))
+    assert_that(is_throttle(client_error("GetDeployment", "AccessDenied", "")), is_(False))
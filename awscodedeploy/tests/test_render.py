@@ -0,0 +1,55 @@
+from os.path import basename
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from hamcrest import assert_that, contains, equal_to
+
+from awscodedeploy.render import render_bundles
+from awscodedeploy.revision import DockerComposeRevision
+
+
+COMPOSE_DATA = {
+    "web": {"image": "nginx:1.11", "links": ["api"]},
+    "api": {"image": "example/api:1"},
+}
+
+NAMES = ["name-{}".format(index) for index in range(6)]
+
+
+def render(processes, bundle_type="zip"):
+    """
+    Render bundles for NAMES, returning their paths and contents.
+    """
+    output_dir = mkdtemp()
+    try:
+        paths = render_bundles(
+            COMPOSE_DATA,
+            NAMES,
+            output_dir,
+            timeout=300,
+            processes=processes,
+            bundle_type=bundle_type,
+        )
+        contents = []
+        for path in paths:
+            with open(path, "rb") as file_:
+                contents.append(file_.read())
+        return [basename(path) for path in paths], contents
+    finally:
+        rmtree(output_dir)
+
+
+def test_render_bundles_matches_each_revision():
+    paths, contents = render(processes=1)
+
+    assert_that(paths, contains(*["{}.zip".format(name) for name in NAMES]))
+    for name, content in zip(NAMES, contents):
+        revision = DockerComposeRevision.from_compose_data(name, COMPOSE_DATA, 300)
+        with revision.bundle() as bundle:
+            assert_that(content, equal_to(bundle.read()))
+
+
+def test_render_bundles_in_worker_processes():
+    for bundle_type in ("zip", "tgz"):
+        assert_that(render(processes=3, bundle_type=bundle_type),
+                    equal_to(render(processes=1, bundle_type=bundle_type)))
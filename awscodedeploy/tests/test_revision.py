@@ -0,0 +1,303 @@
+from calendar import timegm
+from io import BytesIO
+from os import chmod, environ, pathsep
+from os.path import join
+from shutil import rmtree
+from subprocess import PIPE, Popen
+from tarfile import open as open_tar
+from tempfile import mkdtemp
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
+
+from hamcrest import (
+    assert_that,
+    calling,
+    contains_inanyorder,
+    contains_string,
+    equal_to,
+    greater_than,
+    raises,
+)
+from mock import patch
+from yaml import safe_dump
+
+from awscodedeploy.revision import (
+    BUNDLE_DATE_TIME,
+    BUNDLE_TYPES,
+    DockerComposeRevision,
+    HelloWorldRevision,
+    dependency_levels,
+)
+
+
+COMPOSE_DATA = {
+    "version": "2",
+    "services": {
+        "web": {"image": "nginx:1.11", "depends_on": ["api"]},
+        "api": {"image": "example/api@sha256:present", "links": ["db:database"]},
+        "db": {"image": "postgres@sha256:missing"},
+        "worker": {"build": "."},
+    },
+}
+
+# records its arguments; only the "present" image exists locally
+FAKE_DOCKER = """\
+#!/bin/bash
+echo "$@" >> "$DOCKER_LOG"
+case "$1" in
+    inspect) [[ "$3" == *present ]] ;;
+    pull) [[ "$2" != *broken* ]] || { echo "manifest unknown"; exit 1; } ;;
+esac
+"""
+
+
+def make_revision(compose_data, pull_concurrency=2):
+    return DockerComposeRevision("example", safe_dump(compose_data), 300, pull_concurrency)
+
+
+def run_pull_script(revision):
+    """
+    Run a pull script against a fake docker, returning its exit code, output and docker calls.
+    """
+    tmpdir = mkdtemp()
+    try:
+        docker = join(tmpdir, "docker")
+        with open(docker, "w") as file_:
+            file_.write(FAKE_DOCKER)
+        chmod(docker, 0o755)
+        log = join(tmpdir, "docker.log")
+        open(log, "w").close()
+
+        # skip creating /etc/docker-compose
+        script = revision.pull_images_script.replace(
+            "mkdir -p /etc/docker-compose/example",
+            "",
+        )
+        env = dict(environ, DOCKER_LOG=log, PATH=tmpdir + pathsep + environ["PATH"])
+        process = Popen(["bash", "-c", script], stdout=PIPE, stderr=PIPE, env=env)
+        stdout, stderr = process.communicate()
+        with open(log) as file_:
+            calls = file_.read().splitlines()
+        return process.returncode, stdout + stderr, calls
+    finally:
+        rmtree(tmpdir)
+
+
+def test_pull_script_pulls_images_in_parallel():
+    script = make_revision({"web": {"image": "nginx:1.11"}}, pull_concurrency=3).pull_images_script
+
+    assert_that(script, contains_string("xargs -n 1 -P 3 "))
+    assert_that(script, contains_string("\nnginx:1.11\nEOF\n"))
+
+
+def test_pull_script_pulls_tagged_images():
+    exit_code, output, calls = run_pull_script(make_revision({"web": {"image": "nginx:1.11"}}))
+
+    assert_that(exit_code, equal_to(0))
+    assert_that(calls, equal_to(["pull nginx:1.11"]))
+    assert_that(output, contains_string("Pulled image: nginx:1.11"))
+
+
+def test_pull_script_skips_present_pinned_images():
+    exit_code, output, calls = run_pull_script(make_revision({
+        "api": {"image": "example/api@sha256:present"},
+    }))
+
+    assert_that(exit_code, equal_to(0))
+    assert_that(calls, equal_to(["inspect --type=image example/api@sha256:present"]))
+    assert_that(output, contains_string("Image already present: example/api@sha256:present"))
+
+
+def test_pull_script_pulls_missing_pinned_images():
+    exit_code, _, calls = run_pull_script(make_revision({
+        "db": {"image": "postgres@sha256:missing"},
+    }))
+
+    assert_that(exit_code, equal_to(0))
+    assert_that(calls, equal_to([
+        "inspect --type=image postgres@sha256:missing",
+        "pull postgres@sha256:missing",
+    ]))
+
+
+def test_pull_script_fails_if_pull_fails():
+    exit_code, output, _ = run_pull_script(make_revision({"web": {"image": "example/broken:1"}}))
+
+    assert_that(exit_code, equal_to(1))
+    assert_that(output, contains_string("Failed to pull image: example/broken:1"))
+    assert_that(output, contains_string("manifest unknown"))
+
+
+def test_pull_script_without_images():
+    exit_code, _, calls = run_pull_script(make_revision({"worker": {"build": "."}}))
+
+    assert_that(exit_code, equal_to(0))
+    assert_that(calls, equal_to([]))
+
+
+def test_pull_script_pulls_each_image_once():
+    revision = make_revision(COMPOSE_DATA)
+
+    # sorted, without the service that is built
+    assert_that(revision.pull_images_script, contains_string(
+        "\nexample/api@sha256:present\nnginx:1.11\npostgres@sha256:missing\nEOF\n",
+    ))
+
+    exit_code, _, calls = run_pull_script(revision)
+
+    assert_that(exit_code, equal_to(0))
+    assert_that([call for call in calls if call.startswith("pull ")], contains_inanyorder(
+        "pull nginx:1.11",
+        "pull postgres@sha256:missing",
+    ))
+
+
+def test_pull_script_fails_if_any_pull_fails():
+    compose_data = {"one": {"image": "example/broken:1"}, "two": {"image": "nginx:1.11"}}
+
+    exit_code, output, calls = run_pull_script(make_revision(compose_data))
+
+    assert_that(exit_code, equal_to(1))
+    assert_that(calls, contains_inanyorder("pull example/broken:1", "pull nginx:1.11"))
+    assert_that(output, contains_string("Failed to pull one or more images"))
+
+
+def test_dependency_levels():
+    assert_that(dependency_levels(dict(
+        web=["api", "cache"],
+        api=["db"],
+        cache=[],
+        db=[],
+        worker=["db"],
+    )), equal_to([["cache", "db"], ["api", "worker"], ["web"]]))
+
+
+def test_dependency_levels_from_links_and_depends_on():
+    assert_that(
+        make_revision(COMPOSE_DATA).service_levels,
+        equal_to([["db", "worker"], ["api"], ["web"]]),
+    )
+
+
+def test_dependency_levels_undefined_dependency():
+    assert_that(
+        calling(dependency_levels).with_args(dict(web=["api", "db", "cache"], db=[])),
+        raises(Exception, "Service web depends on undefined services: api, cache"),
+    )
+
+
+def test_dependency_levels_cycle():
+    assert_that(
+        calling(dependency_levels).with_args(dict(a=["c"], b=["a"], c=["b"], d=[], e=["d"])),
+        raises(Exception, "Services have circular dependencies: a, b, c"),
+    )
+    assert_that(
+        calling(dependency_levels).with_args(dict(a=["a"])),
+        raises(Exception, "Services have circular dependencies: a"),
+    )
+
+
+def test_revision_rejects_invalid_dependencies():
+    assert_that(
+        calling(make_revision).with_args({"web": {"image": "nginx", "links": ["api"]}}),
+        raises(Exception, "Service web depends on undefined services: api"),
+    )
+
+
+def test_for_deployment_matches_a_fresh_revision():
+    template = make_revision(COMPOSE_DATA)
+    # render the shared properties before copying
+    template.hooks
+
+    for deployment_name in ("first", "second"):
+        revision = template.for_deployment(deployment_name)
+        fresh = DockerComposeRevision.from_compose_data(deployment_name, COMPOSE_DATA, 300, 2)
+
+        assert_that(sorted(revision.entries()), equal_to(sorted(fresh.entries())))
+        assert_that(revision.start_script, contains_string(deployment_name))
+
+
+def read_bundle(revision, bundle_type, compression_level=6):
+    with revision.bundle(bundle_type, compression_level) as bundle:
+        return bundle.read()
+
+
+def test_bundles_are_reproducible():
+    for bundle_type in BUNDLE_TYPES:
+        # timestamps must not leak into the archive
+        with patch("time.time", return_value=1000000000.0):
+            first = read_bundle(make_revision(COMPOSE_DATA), bundle_type)
+        with patch("time.time", return_value=1500000000.0):
+            second = read_bundle(make_revision(COMPOSE_DATA), bundle_type)
+        assert_that(second, equal_to(first))
+
+
+def test_zip_bundle_entries():
+    revision = make_revision(COMPOSE_DATA)
+    expected = sorted(revision.entries())
+
+    levels = ((0, ZIP_STORED), (1, ZIP_DEFLATED), (9, ZIP_DEFLATED))
+    for compression_level, compress_type in levels:
+        with revision.bundle("zip", compression_level) as bundle:
+            archive = ZipFile(bundle)
+            infos = archive.infolist()
+            assert_that([(info.filename, archive.read(info)) for info in infos],
+                        equal_to(expected))
+            for info in infos:
+                assert_that(info.compress_type, equal_to(compress_type))
+                assert_that(info.date_time, equal_to(BUNDLE_DATE_TIME))
+                assert_that(info.external_attr >> 16, equal_to(0o644))
+
+
+def test_zip_bundles_honor_compression_level():
+    compose_data = dict(COMPOSE_DATA)
+    compose_data["services"] = dict(COMPOSE_DATA["services"], web=dict(
+        image="nginx:1.11",
+        environment=dict(
+            ("VARIABLE_{}".format(index), "value-{}".format(index * 7919 % 1000))
+            for index in range(2000)
+        ),
+    ))
+    revision = make_revision(compose_data)
+
+    sizes = [len(read_bundle(revision, "zip", level)) for level in (1, 6, 9)]
+
+    # the fastest level compresses least
+    assert_that(sizes[0], greater_than(max(sizes[1:])))
+
+
+def test_zip_bundles_match_zipfile_at_the_default_level():
+    revision = make_revision(COMPOSE_DATA)
+    expected = BytesIO()
+    archive = ZipFile(expected, "w", ZIP_DEFLATED, allowZip64=True)
+    for path, content in sorted(revision.entries()):
+        info = ZipInfo(path, date_time=BUNDLE_DATE_TIME)
+        info.compress_type = ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        archive.writestr(info, content)
+    archive.close()
+
+    assert_that(read_bundle(revision, "zip", 6), equal_to(expected.getvalue()))
+
+
+def test_tar_bundle_entries():
+    revision = HelloWorldRevision()
+    expected = sorted(revision.entries())
+
+    for bundle_type in ("tar", "tgz"):
+        with revision.bundle(bundle_type) as bundle:
+            archive = open_tar(fileobj=bundle)
+            members = archive.getmembers()
+            assert_that(
+                [(member.name, archive.extractfile(member).read()) for member in members],
+                equal_to(expected),
+            )
+            for member in members:
+                assert_that(member.mode, equal_to(0o644))
+                assert_that(member.mtime, equal_to(timegm(BUNDLE_DATE_TIME)))
+
+
+def test_unsupported_bundle_type():
+    assert_that(
+        calling(read_bundle).with_args(HelloWorldRevision(), "rar"),
+        raises(Exception, "Unsupported bundle type: rar"),
+    )
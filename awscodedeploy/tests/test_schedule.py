@@ -0,0 +1,70 @@
+from hamcrest import assert_that, close_to, contains, equal_to, greater_than_or_equal_to
+from hamcrest import less_than_or_equal_to
+from mock import patch
+
+from awscodedeploy.schedule import PollScheduler
+
+
+def make_scheduler(**kwargs):
+    sleeps = []
+    return PollScheduler(sleep=sleeps.append, **kwargs), sleeps
+
+
+def test_update_grows_delay_while_unchanged():
+    scheduler, _ = make_scheduler(min_timeout=1.0, max_timeout=100.0, factor=2.0)
+
+    delays = []
+    for _ in range(4):
+        scheduler.update(False)
+        delays.append(scheduler.delay)
+
+    assert_that(delays, contains(2.0, 4.0, 8.0, 16.0))
+
+
+def test_update_caps_delay_at_max_timeout():
+    scheduler, _ = make_scheduler(min_timeout=1.0, max_timeout=30.0)
+
+    for _ in range(50):
+        scheduler.update(False)
+
+    assert_that(scheduler.delay, equal_to(30.0))
+
+
+def test_update_resets_delay_on_change():
+    scheduler, _ = make_scheduler(min_timeout=1.0, max_timeout=30.0)
+    for _ in range(5):
+        scheduler.update(False)
+
+    scheduler.update(True)
+
+    assert_that(scheduler.delay, equal_to(1.0))
+
+
+def test_max_timeout_is_at_least_min_timeout():
+    scheduler, _ = make_scheduler(min_timeout=10.0, max_timeout=5.0)
+
+    assert_that(scheduler.max_timeout, equal_to(10.0))
+
+
+def test_wait_jitters_within_bounds():
+    scheduler, sleeps = make_scheduler(min_timeout=1.0, max_timeout=100.0, jitter=0.1)
+    scheduler.delay = 10.0
+
+    for _ in range(200):
+        scheduler.wait()
+
+    assert_that(min(sleeps), greater_than_or_equal_to(9.0))
+    assert_that(max(sleeps), less_than_or_equal_to(11.0))
+
+
+def test_wait_clamps_jitter_to_timeouts():
+    scheduler, sleeps = make_scheduler(min_timeout=1.0, max_timeout=30.0, jitter=0.1)
+
+    with patch("awscodedeploy.schedule.uniform", return_value=0.9):
+        scheduler.wait()
+    scheduler.delay = 30.0
+    with patch("awscodedeploy.schedule.uniform", return_value=1.1):
+        delay = scheduler.wait()
+
+    assert_that(sleeps, contains(1.0, 30.0))
+    assert_that(delay, close_to(30.0, 1e-9))
@@ -0,0 +1,111 @@
+from argparse import Namespace
+from json import dump, load
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from hamcrest import (
+    assert_that,
+    contains,
+    contains_string,
+    empty,
+    equal_to,
+    has_entries,
+    has_key,
+    is_not,
+)
+from mock import patch
+
+from awscodedeploy.timing import PhaseTimer, find_regressions, report
+
+
+def make_phases(**totals):
+    timer = PhaseTimer()
+    for name, total in totals.items():
+        timer.record(name.replace("_", "."), total)
+    return timer.to_dict()
+
+
+def test_find_regressions_over_threshold():
+    baseline = make_phases(wait=10.0, push_upload=2.0)
+    phases = make_phases(wait=16.0, push_upload=2.5)
+
+    assert_that(find_regressions(phases, baseline, 1.5), contains(("wait", 10.0, 16.0)))
+
+
+def test_find_regressions_ignores_small_deltas():
+    # twice as slow, but only by a few milliseconds
+    baseline = make_phases(deploy=0.01)
+    phases = make_phases(deploy=0.02)
+
+    assert_that(find_regressions(phases, baseline, 1.5), empty())
+
+
+def test_find_regressions_ignores_new_and_removed_phases():
+    baseline = make_phases(lifecycle_BeforeInstall=5.0, wait=10.0)
+    phases = make_phases(lifecycle_AfterInstall=30.0, wait=10.0)
+
+    assert_that(find_regressions(phases, baseline, 1.5), empty())
+
+
+class Fixture(object):
+
+    def __init__(self):
+        self.tmpdir = mkdtemp()
+        self.timer = PhaseTimer()
+
+    def path(self, name):
+        return join(self.tmpdir, name)
+
+    def report(self, baseline="baseline.json"):
+        args = Namespace(
+            timing_report=self.path("report.json"),
+            timing_baseline=self.path(baseline),
+            timing_threshold=1.5,
+        )
+        with patch("awscodedeploy.timing.TIMER", self.timer), \
+                patch("awscodedeploy.timing.getLogger") as get_logger:
+            report(args)
+        with open(args.timing_report) as file_:
+            return load(file_), get_logger.return_value
+
+    def save_baseline(self, **totals):
+        with open(self.path("baseline.json"), "w") as file_:
+            dump(dict(phases=make_phases(**totals)), file_)
+
+    def close(self):
+        rmtree(self.tmpdir)
+
+
+def test_report_flags_regressions():
+    fixture = Fixture()
+    try:
+        fixture.save_baseline(wait=10.0, lifecycle_Install=1.0)
+        fixture.timer.record("wait", 20.0)
+        fixture.timer.record("lifecycle.AfterInstall", 5.0)
+
+        result, logger = fixture.report()
+    finally:
+        fixture.close()
+
+    assert_that(result["phases"], has_entries(wait=has_entries(total=20.0, count=1)))
+    assert_that(result["regressions"], contains(
+        dict(phase="wait", baseline=10.0, current=20.0),
+    ))
+    assert_that(logger.warn.call_count, equal_to(1))
+
+
+def test_report_without_baseline():
+    fixture = Fixture()
+    try:
+        fixture.timer.record("wait", 20.0)
+
+        result, logger = fixture.report(baseline="missing.json")
+    finally:
+        fixture.close()
+
+    # the report is still written, without comparisons
+    assert_that(result["phases"], has_key("wait"))
+    assert_that(result, is_not(has_key("regressions")))
+    message, = logger.warn.call_args[0]
+    assert_that(message, contains_string("missing.json"))
@@ -0,0 +1,67 @@
+from io import BytesIO
+
+from hamcrest import assert_that, calling, equal_to, raises
+from mock import patch
+
+from awscodedeploy.fake import FakeS3, client_error
+from awscodedeploy.upload import DIGEST_METADATA_KEY, upload_bundle
+
+
+BUCKET = "bucket"
+
+KEY = "application/group.zip"
+
+# 2.5 parts, so that the last part is short
+DATA = b"".join(chr(index % 256) for index in range(2560))
+
+
+def upload(s3, data=DATA):
+    # shrink the thresholds so that a small bundle is uploaded in parts
+    with patch("awscodedeploy.upload.MULTIPART_THRESHOLD", 1024), \
+            patch("awscodedeploy.upload.PART_SIZE", 1024):
+        return upload_bundle(s3, BUCKET, KEY, BytesIO(data), "digest")
+
+
+def test_small_bundles_are_put_in_one_request():
+    s3 = FakeS3(versioning=True)
+
+    etag, version = upload(s3, DATA[:1000])
+
+    assert_that(s3.calls["PutObject"], equal_to(1))
+    assert_that(s3.calls["CreateMultipartUpload"], equal_to(0))
+    stored = s3.objects[(BUCKET, KEY)]
+    assert_that(stored["data"], equal_to(DATA[:1000]))
+    assert_that(stored["metadata"], equal_to({DIGEST_METADATA_KEY: "digest"}))
+    assert_that((etag, version), equal_to((stored["etag"].strip('"'), "v1")))
+
+
+def test_large_bundles_are_uploaded_in_parts():
+    s3 = FakeS3()
+
+    etag, version = upload(s3)
+
+    assert_that(s3.calls["PutObject"], equal_to(0))
+    assert_that(s3.calls["UploadPart"], equal_to(3))
+    assert_that(s3.calls["CompleteMultipartUpload"], equal_to(1))
+    stored = s3.objects[(BUCKET, KEY)]
+    assert_that(stored["data"], equal_to(DATA))
+    assert_that(stored["metadata"], equal_to({DIGEST_METADATA_KEY: "digest"}))
+    assert_that((etag, version), equal_to((stored["etag"].strip('"'), None)))
+
+
+def test_multipart_upload_is_aborted_when_a_part_fails():
+    s3 = FakeS3()
+    upload_part = s3.upload_part
+
+    def fail_second_part(**kwargs):
+        if kwargs["PartNumber"] == 2:
+            raise client_error("UploadPart", "InternalError", "We encountered an internal error")
+        return upload_part(**kwargs)
+
+    s3.upload_part = fail_second_part
+
+    assert_that(calling(upload).with_args(s3), raises(Exception, "internal error"))
+    assert_that(s3.calls["AbortMultipartUpload"], equal_to(1))
+    assert_that(s3.calls["CompleteMultipartUpload"], equal_to(0))
+    assert_that(s3.uploads, equal_to(dict()))
+    assert_that(s3.objects, equal_to(dict()))
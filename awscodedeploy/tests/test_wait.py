@@ -0,0 +1,193 @@
+from argparse import Namespace
+from collections import OrderedDict
+from itertools import islice
+
+from botocore.exceptions import ClientError
+from hamcrest import assert_that, contains, empty, equal_to, has_length, is_, less_than
+
+from awscodedeploy.fake import FakeClock, FakeCodeDeploy, LIFECYCLE_EVENTS
+from awscodedeploy.schedule import PollScheduler
+from awscodedeploy.wait import (
+    InstanceTracker,
+    get_instance_ids,
+    iter_instance_ids,
+    wait_for_deploy,
+)
+
+
+class PagedClient(object):
+    """
+    Lists instance ids a page at a time, as ListDeploymentInstances does.
+    """
+    def __init__(self, statuses, page_size=100, added=True):
+        self.statuses = statuses
+        self.page_size = page_size
+        self.added = added
+        self.calls = []
+
+    def list_deployment_instances(self, deploymentId, nextToken=None, instanceStatusFilter=None):
+        self.calls.append((nextToken, instanceStatusFilter))
+        if not self.added:
+            raise ClientError(dict(Error=dict(
+                Code="InvalidDeploymentStatusException",
+                Message="The deployment {} hasn't completed adding instances.".format(
+                    deploymentId,
+                ),
+            )), "ListDeploymentInstances")
+
+        instance_ids = [
+            instance_id
+            for instance_id, status in self.statuses.items()
+            if not instanceStatusFilter or status in instanceStatusFilter
+        ]
+        start = int(nextToken or 0)
+        result = dict(instancesList=instance_ids[start:start + self.page_size])
+        if start + self.page_size < len(instance_ids):
+            result["nextToken"] = str(start + self.page_size)
+        return result
+
+
+def make_statuses(count):
+    return OrderedDict(
+        ("i-{:012x}".format(index), "Succeeded" if index % 3 == 0 else "InProgress")
+        for index in range(count)
+    )
+
+
+ARGS = Namespace(deployment_id="d-000000001")
+
+FLEET_SIZE = 3000
+PAGE_SIZE = 100
+
+
+def test_iter_instance_ids_follows_pages():
+    statuses = make_statuses(2550)
+    client = PagedClient(statuses)
+
+    assert_that(get_instance_ids(client, ARGS), equal_to(list(statuses)))
+    assert_that(
+        [next_token for next_token, _ in client.calls],
+        equal_to([None] + [str(start) for start in range(100, 2600, 100)]),
+    )
+
+
+def test_iter_instance_ids_filters_by_status():
+    statuses = make_statuses(2550)
+    client = PagedClient(statuses)
+
+    instance_ids = get_instance_ids(client, ARGS, ("InProgress",))
+
+    assert_that(instance_ids, equal_to([
+        instance_id for instance_id, status in statuses.items() if status == "InProgress"
+    ]))
+    assert_that(
+        set(tuple(status_filter) for _, status_filter in client.calls),
+        equal_to({("InProgress",)}),
+    )
+
+
+def test_iter_instance_ids_before_instances_are_added():
+    client = PagedClient(make_statuses(10), added=False)
+
+    assert_that(list(iter_instance_ids(client, ARGS)), empty())
+
+
+def create_deployment(**kwargs):
+    clock = FakeClock()
+    client = FakeCodeDeploy(
+        clock=clock,
+        default_fleet_size=FLEET_SIZE,
+        page_size=PAGE_SIZE,
+        **kwargs
+    )
+    deployment_id = client.create_deployment(
+        applicationName="application",
+        deploymentGroupName="group",
+    )["deploymentId"]
+    # instances are listed once the deployment has added them
+    clock.sleep(client.start_delay)
+    return clock, client, Namespace(deployment_id=deployment_id)
+
+
+def test_tracker_lists_only_active_instances_once_listed():
+    # the first batch of instances finishes after all seven lifecycle events
+    clock, client, args = create_deployment(batch_size=1000)
+    tracker = InstanceTracker()
+
+    assert_that(list(tracker.instance_ids(client, args)), has_length(FLEET_SIZE))
+    assert_that(tracker.listed, is_(True))
+
+    clock.sleep(7.5)
+    tracker.statuses.update(client.deployments[args.deployment_id].statuses(clock.time()))
+    calls = client.calls["ListDeploymentInstances"]
+
+    instance_ids = list(tracker.instance_ids(client, args))
+
+    assert_that(instance_ids, has_length(FLEET_SIZE - 1000))
+    assert_that(set(instance_ids), equal_to(set(tracker.active)))
+    # the filtered listing only pages through the active instances
+    assert_that(
+        client.calls["ListDeploymentInstances"] - calls,
+        equal_to((FLEET_SIZE - 1000) // PAGE_SIZE),
+    )
+
+
+def test_list_all_resumes_from_next_token():
+    _, client, args = create_deployment()
+    tracker = InstanceTracker()
+
+    # stop partway through the second page, e.g. on a throttled fetch
+    listing = tracker.list_all(client, args)
+    first = list(islice(listing, PAGE_SIZE + PAGE_SIZE // 2))
+    listing.close()
+
+    assert_that(tracker.next_token, equal_to(str(2 * PAGE_SIZE)))
+    assert_that(tracker.listed, is_(False))
+    # the rest of the second page is still tracked
+    assert_that(tracker.active, has_length(2 * PAGE_SIZE))
+
+    rest = list(tracker.instance_ids(client, args))
+
+    assert_that(tracker.listed, is_(True))
+    assert_that(tracker.next_token, equal_to(None))
+    assert_that(set(rest), has_length(len(rest)))
+    assert_that(
+        sorted(set(first) | set(rest)),
+        contains(*sorted(client.deployments[args.deployment_id].instance_ids)),
+    )
+    # no page is listed twice
+    assert_that(client.calls["ListDeploymentInstances"], equal_to(FLEET_SIZE // PAGE_SIZE))
+
+
+def test_wait_for_deploy_backs_off_during_long_lifecycle_events():
+    clock = FakeClock()
+    client = FakeCodeDeploy(
+        clock=clock,
+        batch_size=10,
+        event_durations=[
+            (name, 600.0 if name == "Install" else 1.0)
+            for name in LIFECYCLE_EVENTS
+        ],
+    )
+    deployment_id = client.create_deployment(
+        applicationName="application",
+        deploymentGroupName="group",
+    )["deploymentId"]
+    args = Namespace(
+        deployment_id=deployment_id,
+        sleep_timeout=1,
+        max_sleep_timeout=30,
+        lifecycle_report=False,
+        max_failed_instances=None,
+        max_failed_percent=None,
+        fail_on_failed_event=False,
+        auto_rollback=False,
+        event_stream=None,
+    )
+    scheduler = PollScheduler.from_args(args)
+    scheduler.sleep = clock.sleep
+
+    wait_for_deploy(client, args, scheduler)
+
+    # polls stay at the minimum interval only while statuses keep changing
+    assert_that(client.calls["GetDeployment"], less_than(60))
@@ -0,0 +1,67 @@
+from io import BytesIO
+
+from hamcrest import assert_that, calling, equal_to, raises
+from nose.plugins.skip import SkipTest
+from yaml import SafeDumper, SafeLoader
+from yaml.constructor import ConstructorError
+
+from awscodedeploy.yamlio import backend, dump, has_libyaml, load
+
+
+COMPOSE_YAML = """\
+version: "2"
+services:
+  web:
+    image: nginx:1.11
+    ports:
+      - "80:80"
+    environment:
+      GREETING: "hello: world"
+      EMPTY:
+      ENABLED: "true"
+    depends_on: [api]
+  api:
+    image: example/api@sha256:0123456789abcdef
+    command: ["serve", "--port", "8080"]
+    mem_limit: 512m
+    cpu_shares: 0.5
+"""
+
+
+def test_pure_backend():
+    assert_that(backend(pure=True), equal_to((SafeLoader, SafeDumper)))
+
+
+def test_load_from_string_and_file():
+    data = load(COMPOSE_YAML)
+
+    assert_that(data["services"]["web"]["environment"], equal_to(dict(
+        GREETING="hello: world",
+        EMPTY=None,
+        ENABLED="true",
+    )))
+    assert_that(load(BytesIO(COMPOSE_YAML)), equal_to(data))
+
+
+def test_backends_agree():
+    if not has_libyaml():
+        raise SkipTest("libyaml is not available")
+
+    data = load(COMPOSE_YAML, pure=True)
+
+    assert_that(load(COMPOSE_YAML), equal_to(data))
+    assert_that(dump(data), equal_to(dump(data, pure=True)))
+    assert_that(load(dump(data)), equal_to(data))
+
+
+def test_round_trip():
+    data = load(COMPOSE_YAML, pure=True)
+
+    assert_that(load(dump(data, pure=True), pure=True), equal_to(data))
+
+
+def test_load_is_safe():
+    document = "!!python/object/apply:os.system ['true']"
+
+    for pure in (True, False):
+        assert_that(calling(load).with_args(document, pure), raises(ConstructorError))
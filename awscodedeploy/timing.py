@@ -0,0 +1,144 @@
+"""
+Phase timing.
+
+Records wall time spent in each phase of a run (render, bundle, upload, register,
+create_deployment, wait, lifecycle events) and compares it against a saved baseline.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from json import dump, load
+from logging import getLogger
+from threading import Lock
+from time import time
+
+from awscodedeploy.context import current as current_request
+
+
+class PhaseTimer(object):
+    """
+    Accumulate wall time per named phase.
+
+    Phases may repeat (e.g. one lifecycle event per instance); each keeps a count,
+    total and maximum.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.phases = OrderedDict()
+
+    def reset(self):
+        with self.lock:
+            self.phases.clear()
+
+    def record(self, name, seconds):
+        with self.lock:
+            phase = self.phases.setdefault(name, OrderedDict([
+                ("count", 0),
+                ("total", 0.0),
+                ("max", 0.0),
+            ]))
+            phase["count"] += 1
+            phase["total"] += seconds
+            phase["max"] = max(phase["max"], seconds)
+
+    @contextmanager
+    def phase(self, name):
+        start = time()
+        try:
+            yield
+        finally:
+            self.record(name, time() - start)
+
+    def to_dict(self):
+        with self.lock:
+            return OrderedDict(
+                (name, OrderedDict(phase))
+                for name, phase in self.phases.items()
+            )
+
+
+# process-wide timer
+TIMER = PhaseTimer()
+
+
+def get_timer():
+    """
+    Get the timer of the daemon request being served, or the process-wide timer.
+    """
+    request = current_request()
+    return TIMER if request is None else request.timer
+
+
+def phase(name):
+    """
+    Time a block as a phase of the current timer.
+    """
+    return get_timer().phase(name)
+
+
+def record(name, seconds):
+    get_timer().record(name, seconds)
+
+
+def find_regressions(phases, baseline, threshold, min_delta=0.1):
+    """
+    Compare phase totals against a baseline.
+
+    A phase regresses if it took more than `threshold` times its baseline total and
+    at least `min_delta` seconds longer. Returns a list of (name, baseline, current).
+    """
+    regressions = []
+    for name, current in phases.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["total"]
+        after = current["total"]
+        if after > before * threshold and after - before >= min_delta:
+            regressions.append((name, before, after))
+    return regressions
+
+
+def report(args):
+    """
+    Write the timing report and flag regressions, as configured on the command line.
+    """
+    if not args.timing_report and not args.timing_baseline:
+        return
+
+    logger = getLogger("timing")
+    phases = get_timer().to_dict()
+    result = OrderedDict([
+        ("phases", phases),
+    ])
+
+    baseline = None
+    if args.timing_baseline:
+        try:
+            with open(args.timing_baseline) as file_:
+                baseline = load(file_)["phases"]
+        except (IOError, KeyError, TypeError, ValueError) as error:
+            # e.g. the first run, before any report was saved
+            logger.warn("Unable to read timing baseline {}: {}".format(
+                args.timing_baseline,
+                error,
+            ))
+
+    if baseline is not None:
+        regressions = find_regressions(phases, baseline, args.timing_threshold)
+        for name, before, after in regressions:
+            logger.warn("Phase {} regressed: {:.2f}s (baseline {:.2f}s)".format(
+                name,
+                after,
+                before,
+            ))
+        result["regressions"] = [
+            OrderedDict([
+                ("phase", name),
+                ("baseline", before),
+                ("current", after),
+            ])
+            for name, before, after in regressions
+        ]
+
+    if args.timing_report:
+        with open(args.timing_report, "w") as file_:
+            dump(result, file_, indent=2)
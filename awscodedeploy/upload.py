@@ -0,0 +1,155 @@
+"""
+Revision upload to S3.
+"""
+from hashlib import sha256
+from logging import getLogger
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+
+from botocore.exceptions import ClientError
+
+
+ONE_MB = 1 << 20
+
+# bundles at least this large are uploaded as parallel multipart uploads
+MULTIPART_THRESHOLD = 8 * ONE_MB
+PART_SIZE = 8 * ONE_MB
+
+# upper bound on concurrent part uploads per bundle
+MAX_WORKERS = 8
+
+# object metadata key holding the bundle's content hash
+DIGEST_METADATA_KEY = "content-sha256"
+
+
+# botocore sessions are not thread-safe, so client creation is serialized
+_client_lock = Lock()
+
+
+def create_client(profile, service_name, **kwargs):
+    """
+    Create a client from a profile; safe to call from many threads.
+    """
+    with _client_lock:
+        return profile.create_client(service_name, **kwargs)
+
+
+def bundle_size(bundle):
+    bundle.seek(0, 2)
+    size = bundle.tell()
+    bundle.seek(0)
+    return size
+
+
+def bundle_digest(bundle):
+    """
+    Compute the SHA-256 hex digest of a bundle's content.
+    """
+    digest = sha256()
+    bundle.seek(0)
+    for chunk in iter(lambda: bundle.read(ONE_MB), b""):
+        digest.update(chunk)
+    bundle.seek(0)
+    return digest.hexdigest()
+
+
+def find_bundle(s3, bucket, key, digest):
+    """
+    Look for an already uploaded bundle with the given content digest.
+
+    Returns the (ETag, VersionId) of the existing object, or None if there is no
+    object or its content differs.
+    """
+    try:
+        result = s3.head_object(
+            Bucket=bucket,
+            Key=key,
+        )
+    except ClientError as error:
+        # missing objects (and missing read access) just mean we have to upload
+        getLogger("push").debug("Unable to inspect s3://{}/{}: {}".format(bucket, key, error))
+        return None
+
+    if result.get("Metadata", {}).get(DIGEST_METADATA_KEY) != digest:
+        return None
+
+    return result["ETag"].strip('"'), result.get("VersionId")
+
+
+def upload_bundle(s3, bucket, key, bundle, digest=None):
+    """
+    Upload a bundle to S3.
+
+    If a `digest` is given, it is stored in the object's metadata for `find_bundle`.
+
+    Returns the (ETag, VersionId) of the uploaded object; the version is None
+    for buckets without versioning.
+    """
+    metadata = {DIGEST_METADATA_KEY: digest} if digest else {}
+
+    size = bundle_size(bundle)
+    if size < MULTIPART_THRESHOLD:
+        result = s3.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=bundle,
+            Metadata=metadata,
+        )
+    else:
+        result = multipart_upload(s3, bucket, key, bundle, size, metadata)
+
+    return result["ETag"].strip('"'), result.get("VersionId")
+
+
+def multipart_upload(s3, bucket, key, bundle, size, metadata=None):
+    """
+    Upload a large bundle in parts, several parts at a time.
+    """
+    upload_id = s3.create_multipart_upload(
+        Bucket=bucket,
+        Key=key,
+        Metadata=metadata or {},
+    )["UploadId"]
+
+    # parts share one file object, so reads are serialized; uploads are not
+    read_lock = Lock()
+
+    def upload_part(part_number):
+        with read_lock:
+            bundle.seek((part_number - 1) * PART_SIZE)
+            data = bundle.read(PART_SIZE)
+        result = s3.upload_part(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        return dict(
+            ETag=result["ETag"],
+            PartNumber=part_number,
+        )
+
+    part_count = (size + PART_SIZE - 1) // PART_SIZE
+    pool = ThreadPool(processes=min(part_count, MAX_WORKERS))
+    try:
+        parts = pool.map(upload_part, range(1, part_count + 1))
+    except Exception:
+        s3.abort_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+        )
+        raise
+    finally:
+        pool.close()
+        pool.join()
+
+    return s3.complete_multipart_upload(
+        Bucket=bucket,
+        Key=key,
+        UploadId=upload_id,
+        MultipartUpload=dict(
+            Parts=parts,
+        ),
+    )
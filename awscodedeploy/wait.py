@@ -1,17 +1,52 @@
 """
 Watch deployment.
 """
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+from copy import copy
 from logging import getLogger
-from time import sleep
+from time import time
 
 from botocore.exceptions import ClientError
 from termcolor import colored
 
+from awscodedeploy.analytics import LifecycleStats, print_lifecycle_report
+from awscodedeploy.context import thread_pool
+from awscodedeploy.events import emit, truncate_log_tail
+from awscodedeploy.ratelimit import is_throttle
+from awscodedeploy.schedule import PollScheduler
+from awscodedeploy.timing import phase, record
+
+
+# BatchGetDeploymentInstances accepts at most this many instance ids per call
+BATCH_SIZE = 25
+
+# instances in these states will not change again
+TERMINAL_STATUSES = ("Succeeded", "Failed", "Skipped")
+ACTIVE_STATUSES = ("Pending", "InProgress", "Unknown", "Ready")
+
+# deployments in these states will not change again
+FINISHED_STATUSES = ("Succeeded", "Failed", "Stopped")
+
 
 class FailedDeploymentException(Exception):
     pass
 
 
+def chunked(iterable, size):
+    """
+    Split an iterable into lists of at most `size` items.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 def get_deployment(client, args):
     deployment = client.get_deployment(**{
         "deploymentId": args.deployment_id,
@@ -21,28 +56,74 @@ def get_deployment(client, args):
     return status, overview
 
 
-def get_instance_ids(client, args):
+def list_instance_ids(client, args, statuses=None, next_token=None):
+    """
+    Fetch one page of a deployment's instance ids.
+
+    Returns the page's instance ids and the token for the next page, if any.
+    If `statuses` is given, only instances with one of those statuses are listed.
+    """
+    params = {
+        "deploymentId": args.deployment_id,
+    }
+    if statuses:
+        params["instanceStatusFilter"] = list(statuses)
+    if next_token:
+        params["nextToken"] = next_token
+
     try:
-        return client.list_deployment_instances(**{
-            "deploymentId": args.deployment_id,
-        })["instancesList"]
+        result = client.list_deployment_instances(**params)
     except ClientError as error:
         if "hasn't completed adding instances" in error.message:
-            return []
+            return [], None
         raise
 
+    return result.get("instancesList", []), result.get("nextToken")
 
-def get_instance_data(client, args, instance_id):
-    deployment_instance = client.get_deployment_instance(**{
-        "deploymentId": args.deployment_id,
-        "instanceId": instance_id,
-    })
-    instance_status = deployment_instance["instanceSummary"]["status"]
-    instance_events = deployment_instance["instanceSummary"]["lifecycleEvents"]
-    return instance_status, instance_events
+
+def iter_instance_ids(client, args, statuses=None):
+    """
+    Stream a deployment's instance ids, following pagination one page at a time.
+    """
+    next_token = None
+    while True:
+        instance_ids, next_token = list_instance_ids(client, args, statuses, next_token)
+        for instance_id in instance_ids:
+            yield instance_id
+        if not next_token:
+            return
+
+
+def get_instance_ids(client, args, statuses=None):
+    return list(iter_instance_ids(client, args, statuses))
+
+
+def get_instances_data(client, args, instance_ids):
+    """
+    Fetch instance status and lifecycle events in batches.
+
+    Yields (instance_id, instance_status, instance_events) in the order of `instance_ids`.
+    Instances missing from a batch response are skipped until the next poll.
+    """
+    for batch in chunked(instance_ids, BATCH_SIZE):
+        result = client.batch_get_deployment_instances(**{
+            "deploymentId": args.deployment_id,
+            "instanceIds": batch,
+        })
+        # summaries may identify instances by ARN; match on the trailing instance id
+        summaries = {
+            instance_summary["instanceId"].split("/")[-1]: instance_summary
+            for instance_summary in result.get("instancesSummary", [])
+        }
+        for instance_id in batch:
+            instance_summary = summaries.get(instance_id.split("/")[-1])
+            if instance_summary is None:
+                continue
+            yield instance_id, instance_summary["status"], instance_summary["lifecycleEvents"]
 
 
 def print_status(args, status):
+    emit(args, "deployment_status", deployment_id=args.deployment_id, status=status)
     logger = getLogger("wait")
     logger.info("[{}]: Deployment status is now: {}".format(
         colored(args.deployment_id, "cyan"),
@@ -65,6 +146,13 @@ def print_overview(args, overview):
 
 
 def print_instance_status(args, instance_id, instance_status):
+    emit(
+        args,
+        "instance_status",
+        deployment_id=args.deployment_id,
+        instance_id=instance_id,
+        status=instance_status,
+    )
     logger = getLogger("wait")
     logger.info("[{}]: Instance status is now: {}".format(
         colored(instance_id, "cyan"),
@@ -72,6 +160,24 @@ def print_instance_status(args, instance_id, instance_status):
     ))
 
 
+def emit_instance_event(args, instance_id, instance_event):
+    fields = dict(
+        deployment_id=args.deployment_id,
+        instance_id=instance_id,
+        lifecycle_event=instance_event["lifecycleEventName"],
+        status=instance_event["status"],
+        start_time=instance_event.get("startTime"),
+        end_time=instance_event.get("endTime"),
+    )
+    diagnostics = instance_event.get("diagnostics")
+    if diagnostics:
+        fields["error_code"] = diagnostics.get("errorCode")
+        fields["log_tail"], fields["log_tail_truncated"] = truncate_log_tail(
+            diagnostics.get("logTail") or "",
+        )
+    emit(args, "lifecycle_event", **fields)
+
+
 def print_instance_event(args, instance_id, instance_event):
     # print log tail for new events; seems to only appear on errors?
     if "diagnostics" not in instance_event:
@@ -88,6 +194,50 @@ def print_instance_event(args, instance_id, instance_event):
     ))
 
 
+def print_throttle(args, error):
+    emit(
+        args,
+        "throttled",
+        deployment_id=args.deployment_id,
+        error_code=error.response["Error"]["Code"],
+    )
+    logger = getLogger("wait")
+    logger.warn("[{}]: Throttled ({}); slowing down".format(
+        colored(args.deployment_id, "cyan"),
+        error.response["Error"]["Code"],
+    ))
+
+
+def print_stop(args, reason):
+    emit(args, "deployment_stopping", deployment_id=args.deployment_id, reason=reason)
+    logger = getLogger("wait")
+    logger.error("[{}]: Stopping deployment: {}".format(
+        colored(args.deployment_id, "cyan"),
+        colored(reason, "red"),
+    ))
+
+
+def print_result(name, deployment_id, status):
+    logger = getLogger("wait")
+    logger.info("[{}]: Deployment {} finished with status: {}".format(
+        colored(name, "cyan"),
+        deployment_id,
+        colored(status, "red" if status == "Failed" else "green"),
+    ))
+
+
+def emit_result(watcher, **fields):
+    emit(
+        watcher.args,
+        "deployment_finished",
+        deployment_id=watcher.deployment_id,
+        status=watcher.status,
+        failed=watcher.failed,
+        stopped=watcher.stopped,
+        **fields
+    )
+
+
 def is_done(overview, instance_statuses):
     if not overview or not instance_statuses:
         return False
@@ -97,46 +247,396 @@ def is_done(overview, instance_statuses):
     return finished_instances >= total_instances
 
 
-def wait_for_deploy(client, args):
+class FailurePolicy(object):
     """
-    Wait for a deployment and update the console.
+    Decide when to give up on a deployment without waiting for CodeDeploy to.
 
-    Refactor me!
+    :param max_failed_instances: stop once more instances than this have failed
+    :param max_failed_percent: stop once more than this percentage of instances have failed
+    :param failed_event: stop at the first failed lifecycle event
     """
-    last_status = None
-    overview = None
-    instance_statuses = dict()
-    instances_seen = dict()
+    def __init__(self, max_failed_instances=None, max_failed_percent=None, failed_event=False):
+        self.max_failed_instances = max_failed_instances
+        self.max_failed_percent = max_failed_percent
+        self.failed_event = failed_event
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(
+            max_failed_instances=args.max_failed_instances,
+            max_failed_percent=args.max_failed_percent,
+            failed_event=args.fail_on_failed_event,
+        )
+
+    def check(self, overview, failed_events):
+        """
+        Return the reason to stop the deployment, if any.
+
+        :param failed_events: (instance_id, lifecycle event name) pairs of failed events
+        """
+        if self.failed_event and failed_events:
+            instance_id, event_name = failed_events[0]
+            return "{} failed on {}".format(event_name, instance_id)
+
+        if not overview:
+            return None
+
+        failed = overview["Failed"]
+        if self.max_failed_instances is not None and failed > self.max_failed_instances:
+            return "{} instances failed (at most {} allowed)".format(
+                failed,
+                self.max_failed_instances,
+            )
+
+        total = sum(overview.values())
+        if self.max_failed_percent is not None and total and \
+                failed * 100.0 / total > self.max_failed_percent:
+            return "{} of {} instances failed (at most {}% allowed)".format(
+                failed,
+                total,
+                self.max_failed_percent,
+            )
+
+        return None
+
+
+class InstanceTracker(object):
+    """
+    Track instance statuses across polls so that only active instances are fetched.
 
-    while not is_done(overview, instance_statuses):
+    Until every instance has been listed, each poll resumes the full listing where
+    the last one stopped; instances listed but not yet fetched count as active.
+    After that, only instances in an active state are listed. Instances that were
+    active on the previous poll are always fetched once more, so their final status
+    and lifecycle events are still reported after they finish.
+    """
+    def __init__(self):
+        self.statuses = dict()
+        self.listed = False
+        self.next_token = None
+        self.events_seen = dict()
+        self.event_statuses = dict()
+        self.events_timed = dict()
+        self.failed_events = []
+        self.lifecycle_stats = LifecycleStats()
+
+    @property
+    def active(self):
+        return [
+            instance_id
+            for instance_id, status in self.statuses.items()
+            if status not in TERMINAL_STATUSES
+        ]
+
+    def instance_ids(self, client, args):
+        """
+        Stream the ids of instances to fetch on this poll.
+        """
+        seen = set()
+        for instance_id in self.active:
+            seen.add(instance_id)
+            yield instance_id
+
+        if self.listed:
+            listing = iter_instance_ids(client, args, ACTIVE_STATUSES)
+        else:
+            listing = self.list_all(client, args)
+
+        for instance_id in listing:
+            if instance_id not in seen:
+                seen.add(instance_id)
+                yield instance_id
+
+    def list_all(self, client, args):
+        """
+        Stream every instance id, resuming from the last page listed.
+        """
+        while True:
+            instance_ids, self.next_token = list_instance_ids(
+                client, args, next_token=self.next_token,
+            )
+            # record the whole page before yielding, since the next poll resumes after it
+            # even if this one stops partway through
+            for instance_id in instance_ids:
+                self.statuses.setdefault(instance_id, None)
+            for instance_id in instance_ids:
+                yield instance_id
+            if not self.next_token:
+                self.listed = bool(self.statuses)
+                return
+
+    def update(self, args, instance_id, instance_status, instance_events):
+        """
+        Record an instance's status and events, printing changes.
+
+        Returns whether the instance's status changed.
+        """
+        self.events_seen.setdefault(instance_id, set())
+        event_statuses = self.event_statuses.setdefault(instance_id, dict())
+
+        changed = self.statuses.get(instance_id) != instance_status
+        if changed:
+            self.statuses[instance_id] = instance_status
+            print_instance_status(args, instance_id, instance_status)
+
+        for instance_event in instance_events:
+            # event log data isn't showing up; it only appears to show up on errors
+            # and probably doesn't appear when the event is first seen
+            if instance_event["lifecycleEventName"] not in self.events_seen[instance_id]:
+                self.events_seen[instance_id].add(instance_event["lifecycleEventName"])
+                print_instance_event(args, instance_id, instance_event)
+
+            name = instance_event["lifecycleEventName"]
+            if event_statuses.get(name) != instance_event["status"]:
+                event_statuses[name] = instance_event["status"]
+                emit_instance_event(args, instance_id, instance_event)
+
+            failed_event = (instance_id, instance_event["lifecycleEventName"])
+            if instance_event["status"] == "Failed" and failed_event not in self.failed_events:
+                self.failed_events.append(failed_event)
+
+        self.time_events(instance_id, instance_events)
+        return changed
+
+    def time_events(self, instance_id, instance_events):
+        """
+        Record the duration of each lifecycle event once it has finished.
+        """
+        events_timed = self.events_timed.setdefault(instance_id, set())
+        for instance_event in instance_events:
+            name = instance_event["lifecycleEventName"]
+            if name in events_timed or not instance_event.get("endTime"):
+                continue
+            events_timed.add(name)
+            if instance_event.get("startTime"):
+                duration = instance_event["endTime"] - instance_event["startTime"]
+                record("lifecycle.{}".format(name), duration.total_seconds())
+                self.lifecycle_stats.add(name, instance_id, duration.total_seconds())
+
+
+class StatusSource(object):
+    """
+    Where a DeploymentWatcher learns about its deployment's progress.
+    """
+    __metaclass__ = ABCMeta
 
-        # sleep first; the deploy won't be ready immediately anyway
-        sleep(args.sleep_timeout)
+    def scheduler(self, args):
+        """
+        Create the schedule for fetching from this source.
+        """
+        return PollScheduler.from_args(args)
 
-        # fetch the deployment and print changes
-        new_status, overview = get_deployment(client, args)
+    @abstractmethod
+    def fetch(self, watcher):
+        """
+        Apply any news about the watcher's deployment to it.
 
-        if new_status != last_status:
-            last_status = new_status
-            print_status(args, new_status)
-            print_overview(args, overview)
+        Returns whether anything changed.
+        """
+        pass
 
-        # fetch each instance and print changes
-        for instance_id in get_instance_ids(client, args):
-            instance_status, instance_events = get_instance_data(client, args, instance_id)
 
-            instances_seen.setdefault(instance_id, set())
+class PollingSource(StatusSource):
+    """
+    Poll CodeDeploy for the deployment and its active instances.
+    """
+    def __init__(self, client):
+        self.client = client
+
+    def fetch(self, watcher):
+        # fetch the deployment and print changes
+        status, overview = get_deployment(self.client, watcher.args)
+        changed = watcher.update_deployment(status, overview)
+
+        # stream active instance ids into batched fetches and print changes
+        tracker = watcher.tracker
+        instance_ids = tracker.instance_ids(self.client, watcher.args)
+        for instance_id, instance_status, instance_events in get_instances_data(
+                self.client, watcher.args, instance_ids):
+            if tracker.update(watcher.args, instance_id, instance_status, instance_events):
+                changed = True
+
+        return changed
 
-            if instance_statuses.get(instance_id) != instance_status:
-                instance_statuses[instance_id] = instance_status
-                print_instance_status(args, instance_id, instance_status)
 
-            for instance_event in instance_events:
-                # event log data isn't showing up; it only appears to show up on errors
-                # and probably doesn't appear when the event is first seen
-                if instance_event["lifecycleEventName"] not in instances_seen[instance_id]:
-                    instances_seen[instance_id].add(instance_event["lifecycleEventName"])
-                    print_instance_event(args, instance_id, instance_event)
+class DeploymentWatcher(object):
+    """
+    Follow a single deployment, one fetch from its status source at a time.
+    """
+    def __init__(self, client, args, deployment_id=None, source=None):
+        self.client = client
+        self.source = source or PollingSource(client)
+        self.args = copy(args)
+        if deployment_id is not None:
+            self.args.deployment_id = deployment_id
+        self.status = None
+        self.overview = None
+        self.tracker = InstanceTracker()
+        self.policy = FailurePolicy.from_args(self.args)
+        self.stopped = None
+        self.throttled = False
+        self.started_at = time()
+
+    @property
+    def deployment_id(self):
+        return self.args.deployment_id
+
+    @property
+    def done(self):
+        if self.stopped is not None or self.status in FINISHED_STATUSES:
+            return True
+        return self.tracker.listed and is_done(self.overview, self.tracker.statuses)
+
+    @property
+    def failed(self):
+        if self.stopped is not None or self.status == "Failed":
+            return True
+        return bool(self.overview and self.overview["Failed"])
+
+    def update_deployment(self, status, overview):
+        """
+        Record the deployment's status and overview, printing changes.
+
+        Returns whether either changed.
+        """
+        changed = status != self.status or overview != self.overview
+        if overview and overview != self.overview:
+            emit(
+                self.args,
+                "deployment_overview",
+                deployment_id=self.deployment_id,
+                overview=overview,
+            )
+        if status != self.status:
+            self.status = status
+            print_status(self.args, status)
+            print_overview(self.args, overview)
+        self.overview = overview
+        return changed
+
+    def stop(self, reason):
+        """
+        Stop the deployment, rolling it back if configured to.
+        """
+        print_stop(self.args, reason)
+        try:
+            self.client.stop_deployment(**{
+                "deploymentId": self.deployment_id,
+                "autoRollbackEnabled": self.args.auto_rollback,
+            })
+        except ClientError as error:
+            if is_throttle(error):
+                raise
+            # e.g. the deployment finished in the meantime
+            getLogger("wait").warn("[{}]: Unable to stop deployment: {}".format(
+                colored(self.deployment_id, "cyan"),
+                error,
+            ))
+        self.stopped = reason
+
+    def poll(self):
+        """
+        Fetch news about the deployment from the status source, printing changes.
+
+        Returns whether anything changed. A throttled
+        poll is abandoned and reports no change, so that polling slows down.
+        """
+        try:
+            changed = self.fetch()
+        except ClientError as error:
+            if not is_throttle(error):
+                raise
+            print_throttle(self.args, error)
+            self.throttled = True
+            return False
+        self.throttled = False
+        return changed
+
+    def fetch(self):
+        first_instance = not any(self.tracker.statuses.values())
+        changed = self.source.fetch(self)
+        if first_instance and any(self.tracker.statuses.values()):
+            record("wait.first_instance", time() - self.started_at)
+
+        reason = self.policy.check(self.overview, self.tracker.failed_events)
+        if reason is not None:
+            self.stop(reason)
+            return True
+
+        return changed
+
+
+def wait_for_deploy(client, args, scheduler=None, source=None):
+    """
+    Wait for a deployment and update the console.
 
-    if overview["Failed"]:
+    :param source: the StatusSource to follow the deployment with; polls CodeDeploy
+           by default
+    """
+    if source is None:
+        source = PollingSource(client)
+    if scheduler is None:
+        scheduler = source.scheduler(args)
+
+    watcher = DeploymentWatcher(client, args, source=source)
+
+    with phase("wait"):
+        while not watcher.done:
+            # sleep first; the deploy won't be ready immediately anyway
+            scheduler.wait()
+            scheduler.update(watcher.poll())
+
+    if args.lifecycle_report:
+        print_lifecycle_report(watcher.args, watcher.tracker.lifecycle_stats)
+    emit_result(watcher)
+
+    if watcher.stopped is not None:
+        raise FailedDeploymentException("Deployment stopped: {}".format(watcher.stopped))
+    if watcher.failed:
         raise FailedDeploymentException
+
+
+def wait_for_deploys(client, args, deployment_ids, scheduler=None, source=None):
+    """
+    Wait for several deployments at once and report the result of each.
+
+    Each poll fetches every unfinished deployment concurrently, at most
+    `args.poll_concurrency` at a time, and shares one poll schedule.
+
+    :param deployment_ids: a mapping from deployment group name to deployment id
+    :param source: the StatusSource shared by all deployments; polls CodeDeploy by default
+    """
+    if source is None:
+        source = PollingSource(client)
+    if scheduler is None:
+        scheduler = source.scheduler(args)
+
+    watchers = OrderedDict(
+        (name, DeploymentWatcher(client, args, deployment_id, source))
+        for name, deployment_id in deployment_ids.items()
+    )
+
+    # deployments are polled concurrently through the shared client; the pool size
+    # bounds how many API calls are in flight at once
+    pool = thread_pool(max(1, min(len(watchers), args.poll_concurrency)))
+    try:
+        with phase("wait"):
+            while not all(watcher.done for watcher in watchers.values()):
+                scheduler.wait()
+                active = [watcher for watcher in watchers.values() if not watcher.done]
+                changed = pool.map(lambda watcher: watcher.poll(), active)
+                throttled = any(watcher.throttled for watcher in active)
+                scheduler.update(any(changed) and not throttled)
+    finally:
+        pool.close()
+        pool.join()
+
+    for name, watcher in watchers.items():
+        if args.lifecycle_report:
+            print_lifecycle_report(watcher.args, watcher.tracker.lifecycle_stats)
+        print_result(name, watcher.deployment_id, watcher.status)
+        emit_result(watcher, deployment_group=name)
+
+    failed = [name for name, watcher in watchers.items() if watcher.failed]
+    if failed:
+        raise FailedDeploymentException("Deployment failed for: {}".format(", ".join(failed)))
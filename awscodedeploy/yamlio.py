@@ -0,0 +1,48 @@
+"""
+YAML loading and dumping.
+
+Uses PyYAML's libyaml bindings when they are available, falling back to the
+pure-Python implementation otherwise. Both use the safe loader and dumper: compose
+files and appspecs only contain plain data.
+
+PyYAML is imported on first use; it is only needed once a revision is rendered.
+"""
+
+
+def has_libyaml():
+    import yaml
+
+    return getattr(yaml, "__with_libyaml__", False)
+
+
+def backend(pure=False):
+    """
+    Get the (Loader, Dumper) classes to use.
+
+    :param pure: whether to use the pure-Python implementation even if libyaml is available
+    """
+    import yaml
+
+    if not pure and has_libyaml():
+        return yaml.CSafeLoader, yaml.CSafeDumper
+    return yaml.SafeLoader, yaml.SafeDumper
+
+
+def load(stream, pure=False):
+    """
+    Load a YAML document from a string or file.
+    """
+    from yaml import load as load_yaml
+
+    loader, _ = backend(pure)
+    return load_yaml(stream, Loader=loader)
+
+
+def dump(data, pure=False):
+    """
+    Dump data as a YAML document.
+    """
+    from yaml import dump as dump_yaml
+
+    _, dumper = backend(pure)
+    return dump_yaml(data, Dumper=dumper)
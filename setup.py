@@ -2,7 +2,7 @@
 
 from setuptools import setup, find_packages
 
-__version__ = "1.4"
+__version__ = "1.5"
 
 setup(
     name="awscodedeploy",
@@ -16,8 +16,8 @@ setup(
         "nose>=1.3.7"
     ],
     install_requires=[
-        "awscli>=1.9.5",
         "awsenv>=1.7",
+        "botocore>=1.4.0",
         "PyYAML>=3.11",
         "termcolor>=1.1.0",
     ],
@@ -30,6 +30,7 @@ setup(
     entry_points={
         "console_scripts": [
             "aws-code-deploy = awscodedeploy.main:main",
+            "aws-code-deploy-daemon = awscodedeploy.daemon:main",
         ]
     }
 )